@@ -1,4 +1,5 @@
 from flask import Flask
+import click
 from flask_login import login_required, current_user
 from datetime import datetime
 import platform
@@ -11,6 +12,9 @@ from auth import init_login_manager
 from routes.auth import auth
 from routes.main import main
 from routes.test_dispenser import test_dispenser
+from routes.ws import ws, sock
+from dose_instances import DoseInstanceGenerator
+from sql_metrics import sql_metrics
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -18,6 +22,8 @@ app.config.from_object(Config)
 # Khởi tạo các extension
 db.init_app(app)
 init_login_manager(app)
+sql_metrics.init_app(app)
+sock.init_app(app)
 
 # Thêm filter để parse JSON trong template
 @app.template_filter('from_json')
@@ -33,6 +39,24 @@ def from_json_filter(value):
 app.register_blueprint(auth, url_prefix='/auth')
 app.register_blueprint(main)
 app.register_blueprint(test_dispenser, url_prefix='/api')
+app.register_blueprint(ws)
+
+# Job sinh liều thuốc mỗi ngày (chạy ngay khi khởi động, sau đó lúc nửa đêm).
+# Chỉ được chạy ở MỘT tiến trình: gunicorn import app.py trong mọi worker, nên mặc định
+# không tự chạy - dùng `flask dose-job` (cron lúc nửa đêm) hoặc `flask dose-job --loop`
+# (tiến trình riêng, FLASK_APP=app), hoặc DOSE_GENERATOR_ENABLED khi chỉ chạy một tiến trình
+dose_generator = DoseInstanceGenerator(app)
+if __name__ != '__main__' and app.config.get('DOSE_GENERATOR_ENABLED'):
+    dose_generator.start()
+
+@app.cli.command('dose-job')
+@click.option('--loop', is_flag=True, help='Chạy liên tục, lặp lại mỗi nửa đêm (thay vì chạy một lần)')
+def dose_job(loop):
+    """Sinh liều hôm nay, đánh dấu liều bỏ lỡ hôm qua và tính lại expected tới hết tuần"""
+    if loop:
+        dose_generator.run()
+    else:
+        dose_generator.run_once(datetime.now().date())
 
 # Khởi tạo Raspberry Pi handler chỉ khi chạy trên Raspberry Pi
 rpi_handler = None
@@ -56,6 +80,10 @@ if __name__ == '__main__':
             import traceback
             print(traceback.format_exc())
     
+    # Reloader của debug chạy app.py ở cả tiến trình cha và con - chỉ tiến trình con phục vụ request
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        dose_generator.start()
+    
     try:
         app.run(debug=True, host='0.0.0.0', port=5001)
     finally:
@@ -0,0 +1,261 @@
+"""
+Benchmark các API lịch uống thuốc với dữ liệu giả lập cho nhiều hộ gia đình.
+
+Seed N users x M thuốc x K lịch/thuốc x H ngày lịch sử vào SQLite (mặc định)
+hoặc MySQL (--database-url), sau đó gọi qua Flask test client và in ra
+độ trễ p50/p95/p99 cùng số câu lệnh SQL mỗi request.
+
+Chạy từ thư mục gốc của project (cần config.py như khi chạy app):
+    python benchmarks/benchmark_schedules.py --users 200 --medicines 4 --schedules 2 --days 30
+    python benchmarks/benchmark_schedules.py --check   # thoát với mã 1 nếu vượt ngưỡng số câu lệnh SQL
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+
+from config import Config
+from models import db, User, Medicine, Schedule, MedicineHistory, WEEKDAY_NAMES, days_to_mask
+from auth import init_login_manager
+from routes.auth import auth
+from routes.main import main
+import routes.main as main_routes
+from schedule_index import schedule_index
+from profile_cache import profile_cache
+
+# Ngưỡng số câu lệnh SQL tối đa mỗi request (dùng với --check để bắt regression N+1)
+MAX_STATEMENTS = {
+    'check_schedule_by_user': 2,
+    'check_schedule_batch': 2,
+    'user_profile': 6,
+    'user_profile_cached': 1,
+    'reports': 4,
+}
+
+API_KEY = 'benchmark-api-key'
+
+
+class FrozenDateTime(datetime):
+    """datetime.now() cố định để request luôn rơi vào cửa sổ đến hạn của liều"""
+    frozen_at = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.frozen_at
+
+
+def create_app(database_url):
+    app = Flask(__name__, root_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    app.config.from_object(Config)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=database_url,
+        API_KEY_REQUIRED=True,
+        API_KEY=API_KEY,
+        TESTING=True
+    )
+    db.init_app(app)
+    init_login_manager(app)
+    app.register_blueprint(auth, url_prefix='/auth')
+    app.register_blueprint(main)
+    return app
+
+
+def seed(args, frozen_at):
+    """Tạo dữ liệu giả lập bằng bulk insert, trả về danh sách user_id"""
+    rng = random.Random(args.seed)
+    users = [
+        {'username': f'bench_user_{i}', 'email': f'bench_user_{i}@example.com',
+         'password_hash': 'x', 'role': 'user', 'status': 'active',
+         'created_at': frozen_at, 'notification_delay_minutes': 15}
+        for i in range(args.users)
+    ]
+    db.session.bulk_insert_mappings(User, users)
+    db.session.commit()
+    user_ids = [row[0] for row in db.session.query(User.id).filter(User.username.like('bench_user_%'))]
+
+    medicines = [
+        {'name': f'Medicine {c}', 'user_id': user_id, 'compartment_number': c,
+         'quantity': rng.randint(0, 30), 'min_quantity': 5, 'dosage': 1}
+        for user_id in user_ids for c in range(1, args.medicines + 1)
+    ]
+    db.session.bulk_insert_mappings(Medicine, medicines)
+    db.session.commit()
+
+    # Một phần lịch rơi đúng phút đang benchmark để đường đến hạn được đo
+    due_time = frozen_at.strftime('%H:%M')
+    schedules = []
+    for medicine_id, user_id in db.session.query(Medicine.id, Medicine.user_id):
+        for k in range(args.schedules):
+            days = [day for day in WEEKDAY_NAMES if rng.random() < 0.7] or ['monday']
+            if k == 0:
+                days = list(WEEKDAY_NAMES)
+            time_str = due_time if k == 0 else f'{rng.randint(6, 21):02d}:{rng.choice([0, 15, 30, 45]):02d}'
+            schedules.append({
+                'medicine_id': medicine_id, 'user_id': user_id, 'time': time_str,
+                'days': json.dumps(days), 'days_mask': days_to_mask(days),
+                'period': 'daily', 'active': True
+            })
+    db.session.bulk_insert_mappings(Schedule, schedules)
+    db.session.commit()
+
+    history = []
+    for schedule_id, time_str in db.session.query(Schedule.id, Schedule.time):
+        hour, minute = map(int, time_str.split(':'))
+        for day in range(1, args.days + 1):
+            if rng.random() < 0.85:
+                taken_at = datetime.combine(frozen_at.date() - timedelta(days=day), datetime.min.time())
+                history.append({
+                    'schedule_id': schedule_id,
+                    'timestamp': taken_at + timedelta(hours=hour, minutes=minute + rng.randint(0, 20)),
+                    'status': 'taken'
+                })
+        if len(history) >= 10000:
+            db.session.bulk_insert_mappings(MedicineHistory, history)
+            db.session.commit()
+            history = []
+    if history:
+        db.session.bulk_insert_mappings(MedicineHistory, history)
+        db.session.commit()
+
+    return user_ids
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_scenario(name, client, make_request, iterations, counter):
+    latencies = []
+    statements = []
+    for i in range(iterations):
+        counter['count'] = 0
+        started = time.perf_counter()
+        response = make_request(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+        statements.append(counter['count'])
+        if response.status_code not in (200, 304):
+            raise RuntimeError(f'{name}: HTTP {response.status_code} {response.data[:200]}')
+    return {
+        'name': name,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'sql_avg': sum(statements) / len(statements),
+        'sql_max': max(statements),
+    }
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Benchmark schedule evaluation with synthetic fleet data')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--medicines', type=int, default=4, help='Thuốc mỗi user (1-4 ngăn)')
+    parser.add_argument('--schedules', type=int, default=2, help='Lịch mỗi thuốc')
+    parser.add_argument('--days', type=int, default=30, help='Số ngày lịch sử MedicineHistory')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--database-url', default=None, help='Mặc định là file SQLite tạm')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--check', action='store_true', help='Thoát với mã 1 nếu vượt MAX_STATEMENTS')
+    args = parser.parse_args()
+    args.medicines = max(1, min(args.medicines, 4))
+
+    tmp_path = None
+    database_url = args.database_url
+    if not database_url:
+        fd, tmp_path = tempfile.mkstemp(suffix='.db', prefix='bench_')
+        os.close(fd)
+        database_url = f'sqlite:///{tmp_path}'
+
+    # Thứ Hai 08:00:05 - nằm trong cửa sổ 10 giây đến hạn
+    frozen_at = datetime(2026, 10, 19, 8, 0, 5)
+    FrozenDateTime.frozen_at = frozen_at
+    main_routes.datetime = FrozenDateTime
+
+    app = create_app(database_url)
+    try:
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            user_ids = seed(args, frozen_at)
+            print(f'Seeded {len(user_ids)} users x {args.medicines} medicines x {args.schedules} schedules '
+                  f'x {args.days} days in {time.perf_counter() - started:.1f}s')
+
+            counter = {'count': 0}
+
+            def count_statement(conn, cursor, statement, parameters, context, executemany):
+                counter['count'] += 1
+
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+            client = app.test_client()
+            headers = {'X-API-Key': API_KEY}
+            schedule_index.clear()
+
+            def check_schedule(i):
+                return client.get(f'/api/check_schedule_by_user/{user_ids[i % len(user_ids)]}', headers=headers)
+
+            def check_batch(i):
+                start = (i * args.batch_size) % len(user_ids)
+                batch = user_ids[start:start + args.batch_size] or user_ids[:args.batch_size]
+                return client.post('/api/check_schedule_batch', headers=headers, json={'user_ids': batch})
+
+            def user_profile_cached(i):
+                return client.get(f'/api/user_profile/{user_ids[i % len(user_ids)]}', headers=headers)
+
+            def user_profile(i):
+                # Đo đường dựng profile thật (get_user_profile), không phải bản trong profile_cache
+                profile_cache.clear()
+                return user_profile_cached(i)
+
+            def reports(i):
+                with client.session_transaction() as session:
+                    session['_user_id'] = str(user_ids[i % len(user_ids)])
+                    session['_fresh'] = True
+                return client.get('/reports')
+
+            # Làm nóng chỉ mục lịch trong bộ nhớ, profile_cache (đo user_profile_cached trước
+            # user_profile - bản đo lạnh xóa cache) và tạo sẵn bản ghi phiên bản ETag
+            for i in range(len(user_ids)):
+                check_schedule(i)
+                user_profile_cached(i)
+
+            results = [
+                run_scenario('check_schedule_by_user', client, check_schedule, args.iterations, counter),
+                run_scenario('check_schedule_batch', client, check_batch, args.iterations, counter),
+                run_scenario('user_profile_cached', client, user_profile_cached, args.iterations, counter),
+                run_scenario('user_profile', client, user_profile, args.iterations, counter),
+                run_scenario('reports', client, reports, args.iterations, counter),
+            ]
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+    print(f'{"endpoint":<26}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"sql avg":>10}{"sql max":>10}')
+    failed = []
+    for r in results:
+        print(f'{r["name"]:<26}{r["p50"]:>10.2f}{r["p95"]:>10.2f}{r["p99"]:>10.2f}{r["sql_avg"]:>10.1f}{r["sql_max"]:>10}')
+        limit = MAX_STATEMENTS.get(r['name'])
+        if limit is not None and r['sql_max'] > limit:
+            failed.append(f'{r["name"]}: {r["sql_max"]} SQL statements (max {limit})')
+
+    if failed:
+        print('\nSQL statement budget exceeded:')
+        for line in failed:
+            print(f'  - {line}')
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,149 @@
+"""
+Benchmark bộ tính số liều theo lịch (expected_doses.py) cho cả hệ thống.
+
+Sinh N users x K lịch với mặt nạ thứ ngẫu nhiên, đo thời gian tính tổng và
+theo từng ngày với NumPy và bản Python thuần, kiểm tra hai bản cho cùng kết quả,
+sau đó đo refresh_expected (job hằng đêm) trên SQLite tạm.
+
+Chạy từ thư mục gốc của project (cần config.py như khi chạy app):
+    python benchmarks/expected_doses_bench.py --users 10000 --schedules 3 --days 365
+    python benchmarks/expected_doses_bench.py --check   # thoát với mã 1 nếu job hằng đêm >= 1 giây
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from config import Config
+from models import db, User, Medicine, Schedule, WEEKDAY_NAMES, days_to_mask
+import expected_doses
+
+# Ngưỡng thời gian job hằng đêm (refresh tới hết tuần cho mọi user)
+MAX_NIGHTLY_SECONDS = 1.0
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def compare_engines(schedules, start_day, end_day):
+    numpy = expected_doses.np
+    if numpy is None:
+        print('numpy is not installed - only the pure Python engine is measured')
+
+    rows = []
+    results = {}
+    for engine in ('numpy', 'python'):
+        if engine == 'numpy' and numpy is None:
+            continue
+        expected_doses.np = numpy if engine == 'numpy' else None
+        try:
+            totals, totals_ms = timed(expected_doses.expected_doses, schedules, start_day, end_day)
+            by_day, by_day_ms = timed(expected_doses.expected_doses_by_day, schedules, start_day, end_day)
+        finally:
+            expected_doses.np = numpy
+        results[engine] = (totals, by_day)
+        rows.append((engine, totals_ms, by_day_ms))
+
+    print(f'{"engine":<10}{"totals ms":>12}{"by day ms":>12}')
+    for engine, totals_ms, by_day_ms in rows:
+        print(f'{engine:<10}{totals_ms:>12.1f}{by_day_ms:>12.1f}')
+
+    if len(results) == 2 and results['numpy'] != results['python']:
+        raise RuntimeError('numpy and pure Python engines disagree')
+
+    # Tổng theo ngày phải khớp tổng cả khoảng
+    totals, by_day = next(iter(results.values()))
+    if any(sum(counts) != totals[user_id] for user_id, counts in by_day.items()):
+        raise RuntimeError('per-day expected doses do not add up to the range total')
+
+
+def create_app(database_url):
+    app = Flask(__name__, root_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    app.config.from_object(Config)
+    app.config.update(SQLALCHEMY_DATABASE_URI=database_url, TESTING=True)
+    db.init_app(app)
+    return app
+
+
+def seed(args, rng):
+    db.session.bulk_insert_mappings(User, [
+        {'username': f'bench_user_{i}', 'email': f'bench_user_{i}@example.com',
+         'password_hash': 'x', 'role': 'user', 'status': 'active'}
+        for i in range(args.users)
+    ])
+    db.session.commit()
+    db.session.bulk_insert_mappings(Medicine, [
+        {'name': 'Medicine 1', 'user_id': user_id, 'compartment_number': 1, 'quantity': 30, 'min_quantity': 5}
+        for (user_id,) in db.session.query(User.id)
+    ])
+    db.session.commit()
+
+    schedules = []
+    for medicine_id, user_id in db.session.query(Medicine.id, Medicine.user_id):
+        for _ in range(args.schedules):
+            days = [day for day in WEEKDAY_NAMES if rng.random() < 0.6] or ['monday']
+            schedules.append({
+                'medicine_id': medicine_id, 'user_id': user_id, 'time': '08:00',
+                'days': json.dumps(days), 'days_mask': days_to_mask(days),
+                'period': 'daily', 'active': True
+            })
+    db.session.bulk_insert_mappings(Schedule, schedules)
+    db.session.commit()
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Benchmark the weekday-mask expected dose calculator')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--schedules', type=int, default=3, help='Lịch mỗi user')
+    parser.add_argument('--days', type=int, default=365, help='Độ dài khoảng ngày khi so sánh hai bản tính')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--check', action='store_true', help='Thoát với mã 1 nếu job hằng đêm vượt ngưỡng')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    schedules = [(user_id, rng.randint(1, 127)) for user_id in range(1, args.users + 1)
+                 for _ in range(args.schedules)]
+    start_day = date.today()
+    print(f'{args.users} users x {args.schedules} schedules over {args.days} days')
+    compare_engines(schedules, start_day, start_day + timedelta(days=args.days - 1))
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', prefix='bench_')
+    os.close(fd)
+    try:
+        app = create_app(f'sqlite:///{tmp_path}')
+        with app.app_context():
+            db.create_all()
+            seed(args, rng)
+
+            monday = start_day - timedelta(days=start_day.weekday())
+            runs = []
+            for label in ('nightly (empty)', 'nightly (rerun)'):
+                started = time.perf_counter()
+                written = expected_doses.refresh_expected_week(None, monday)
+                db.session.commit()
+                elapsed = time.perf_counter() - started
+                runs.append(elapsed)
+                print(f'{label:<18} {written} rows in {elapsed * 1000:.0f} ms')
+            db.session.remove()
+    finally:
+        os.remove(tmp_path)
+
+    if max(runs) >= MAX_NIGHTLY_SECONDS:
+        print(f'\nNightly refresh took {max(runs):.2f}s (max {MAX_NIGHTLY_SECONDS}s)')
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,90 @@
+"""
+Kiểm tra đồng thời cho /api/power_button_press: nhiều thread cùng bấm POWER
+của một hộ, sau đó kiểm tra trạng thái cuối và chuỗi kết quả có nhất quán không.
+
+Với toggle nguyên tử, N lần bấm thành công cho N kết quả xen kẽ bật/tắt:
+số lần 'enable' và 'disable' lệch nhau tối đa 1, và trạng thái cuối bằng
+trạng thái đầu nếu N chẵn. Thoát với mã 1 nếu phát hiện race.
+
+Server phải chạy sẵn (nên dùng MySQL như production):
+    python benchmarks/power_toggle_race.py --server http://localhost:5001 --user-id 13 --threads 16 --presses 200
+
+Bản tự động qua test client trên SQLite: python -m pytest -q tests/test_power_button_race.py
+"""
+import argparse
+import sys
+import threading
+import time
+from collections import Counter
+
+import requests
+
+
+def main_race():
+    parser = argparse.ArgumentParser(description='Hammer /api/power_button_press from concurrent threads')
+    parser.add_argument('--server', default='http://localhost:5001')
+    parser.add_argument('--api-key', default='my-secret-key-2025')
+    parser.add_argument('--user-id', type=int, default=13)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--presses', type=int, default=200, help='Tổng số lần bấm')
+    args = parser.parse_args()
+
+    server = args.server.rstrip('/')
+    headers = {'X-API-Key': args.api_key}
+
+    def status():
+        response = requests.get(f'{server}/api/system_status', params={'user_id': args.user_id}, headers=headers)
+        response.raise_for_status()
+        return response.json()['system_enabled']
+
+    initial = status()
+    results = Counter()
+    failures = []
+    lock = threading.Lock()
+    remaining = [args.presses]
+
+    def worker():
+        session = requests.Session()
+        session.headers.update(headers)
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            response = session.post(f'{server}/api/power_button_press',
+                                    json={'user_id': args.user_id, 'duration': 0})
+            with lock:
+                if response.status_code == 200:
+                    results[response.json()['action']] += 1
+                else:
+                    failures.append(f'{response.status_code} {response.text[:200]}')
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # Cache của worker khác có thể trễ tối đa STAMP_CHECK_SECONDS
+    time.sleep(2.5)
+    final = status()
+    succeeded = sum(results.values())
+    expected = initial if succeeded % 2 == 0 else not initial
+
+    print(f'{succeeded}/{args.presses} presses succeeded in {elapsed:.1f}s '
+          f'({succeeded / elapsed:.0f}/s) with {args.threads} threads')
+    print(f"Results: enable={results['enable']} disable={results['disable']}, failures={len(failures)}")
+    print(f'Initial state: {initial}, final state: {final}, expected: {expected}')
+    if failures:
+        print(f'  first failure: {failures[0]}')
+
+    ok = final == expected and abs(results['enable'] - results['disable']) <= 1
+    print('OK - toggles were serialized' if ok else 'RACE DETECTED')
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_race()
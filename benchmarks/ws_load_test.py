@@ -0,0 +1,137 @@
+"""
+Load test cho WebSocket /ws/device/<user_id>: mở N socket đồng thời tới một
+server đang chạy, giữ trong --duration giây, đo thời gian kết nối, số socket
+còn sống và độ trễ đẩy INFO flag (POST /api/trigger_info_display -> socket nhận).
+
+Server phải chạy sẵn (VD: gunicorn -k gthread --threads 1000 -w 1 app:app,
+mỗi socket giữ một thread của worker):
+    python benchmarks/ws_load_test.py --server http://localhost:5001 --connections 500 --duration 60
+"""
+import argparse
+import json
+import threading
+import time
+
+import requests
+import simple_websocket
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoadClient:
+    def __init__(self, url, api_key):
+        self.url = url
+        self.api_key = api_key
+        self.socket = None
+        self.connect_ms = None
+        self.error = None
+        self.messages = 0
+        self.info_flags = {}  # flag_id -> thời điểm nhận
+        self.closed = False
+
+    def start(self):
+        started = time.perf_counter()
+        try:
+            self.socket = simple_websocket.Client.connect(self.url, headers={'X-API-Key': self.api_key})
+        except Exception as e:
+            self.error = str(e)
+            return
+        self.connect_ms = (time.perf_counter() - started) * 1000
+        threading.Thread(target=self.read_loop, daemon=True).start()
+
+    def read_loop(self):
+        try:
+            while True:
+                message = json.loads(self.socket.receive())
+                self.messages += 1
+                info_flag = message.get('info_flag') or {}
+                if info_flag.get('info_flag_detected'):
+                    # Không ack để mọi socket của cùng user đều nhận được flag
+                    self.info_flags[info_flag['flag_id']] = time.perf_counter()
+        except Exception:
+            self.closed = True
+
+    def alive(self):
+        return self.socket is not None and not self.closed and self.socket.connected
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except Exception:
+                pass
+
+
+def main_load_test():
+    parser = argparse.ArgumentParser(description='Concurrent WebSocket load test for the ESP32 display channel')
+    parser.add_argument('--server', default='http://localhost:5001')
+    parser.add_argument('--api-key', default='my-secret-key-2025')
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--user-ids', default='1-200', help='Khoảng user_id, VD: 1-200')
+    parser.add_argument('--ramp', type=int, default=50, help='Số kết nối mở mỗi giây')
+    parser.add_argument('--duration', type=int, default=30, help='Số giây giữ kết nối')
+    parser.add_argument('--pushes', type=int, default=20, help='Số INFO flag gửi để đo độ trễ đẩy')
+    args = parser.parse_args()
+
+    first, last = (int(part) for part in args.user_ids.split('-'))
+    user_ids = list(range(first, last + 1))
+    ws_server = args.server.replace('http://', 'ws://').replace('https://', 'wss://').rstrip('/')
+
+    clients = []
+    started = time.perf_counter()
+    for i in range(args.connections):
+        user_id = user_ids[i % len(user_ids)]
+        client = LoadClient(f'{ws_server}/ws/device/{user_id}', args.api_key)
+        client.user_id = user_id
+        client.start()
+        clients.append(client)
+        if args.ramp and (i + 1) % args.ramp == 0:
+            time.sleep(max(0, (i + 1) / args.ramp - (time.perf_counter() - started)))
+
+    connected = [c for c in clients if c.connect_ms is not None]
+    print(f'Opened {len(connected)}/{args.connections} sockets in {time.perf_counter() - started:.1f}s')
+    errors = [c.error for c in clients if c.error]
+    if errors:
+        print(f'  first error: {errors[0]}')
+
+    # Đo độ trễ đẩy INFO flag tới socket của từng user
+    latencies = []
+    session = requests.Session()
+    session.headers['X-API-Key'] = args.api_key
+    targets = list({c.user_id: c for c in connected if c.alive()}.values())[:args.pushes]
+    for client in targets:
+        sent_at = time.perf_counter()
+        response = session.post(f'{args.server.rstrip("/")}/api/trigger_info_display',
+                                json={'user_id': client.user_id, 'info_flag': True})
+        flag_id = response.json().get('flag_id')
+        deadline = sent_at + 10
+        while flag_id not in client.info_flags and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        if flag_id in client.info_flags:
+            latencies.append((client.info_flags[flag_id] - sent_at) * 1000)
+
+    hold_until = started + args.duration
+    while time.perf_counter() < hold_until:
+        time.sleep(1)
+
+    alive = sum(1 for c in clients if c.alive())
+    connect_times = [c.connect_ms for c in connected]
+    print(f'Alive after {args.duration}s: {alive}/{args.connections}')
+    if connect_times:
+        print(f'Connect ms: p50 {percentile(connect_times, 50):.1f}  p95 {percentile(connect_times, 95):.1f}  '
+              f'p99 {percentile(connect_times, 99):.1f}')
+    if latencies:
+        print(f'INFO push ms ({len(latencies)}/{len(targets)} delivered): p50 {percentile(latencies, 50):.1f}  '
+              f'p95 {percentile(latencies, 95):.1f}  max {max(latencies):.1f}')
+    print(f'Messages received: {sum(c.messages for c in clients)}')
+
+    for client in clients:
+        client.close()
+
+
+if __name__ == '__main__':
+    main_load_test()
@@ -0,0 +1,48 @@
+from sqlalchemy.exc import IntegrityError
+
+from models import db, DailyCompliance
+
+# Uống sau giờ hẹn quá chừng này phút thì tính là muộn
+LATE_AFTER_MINUTES = 30
+
+ROLLUP_COLUMNS = ('expected', 'taken', 'late', 'missed')
+
+
+def add_to_rollup(user_id, day, **deltas):
+    """
+    Cộng dồn vào bản ghi (user_id, day) bằng một câu UPDATE nguyên tử, tạo bản ghi nếu chưa có.
+    Không commit - gọi trong cùng transaction với thay đổi liều/lịch sử.
+    """
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    table = DailyCompliance.__table__
+    update = table.update().where(
+        table.c.user_id == user_id,
+        table.c.day == day
+    ).values({table.c[column]: table.c[column] + delta for column, delta in deltas.items()})
+    if db.session.execute(update).rowcount or all(delta < 0 for delta in deltas.values()):
+        return
+
+    row = {column: max(deltas.get(column, 0), 0) for column in ROLLUP_COLUMNS}
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(user_id=user_id, day=day, **row))
+    except IntegrityError:
+        # Request khác vừa tạo bản ghi của ngày này
+        db.session.execute(update)
+
+
+def rollup_rows(user_id, start_day, end_day):
+    """Các bản ghi tổng hợp của user từ start_day đến end_day (một lần quét theo khóa chính)"""
+    return DailyCompliance.query.filter(
+        DailyCompliance.user_id == user_id,
+        DailyCompliance.day >= start_day,
+        DailyCompliance.day <= end_day
+    ).all()
+
+
+def sum_rollup(rows):
+    """Cộng các cột của nhiều ngày: {'expected': .., 'taken': .., 'late': .., 'missed': ..}"""
+    return {column: sum(getattr(row, column) for row in rows) for column in ROLLUP_COLUMNS}
@@ -32,6 +32,24 @@ class Config:
     # Cấu hình SMS backup (SpeedSMS) - OPTIONAL
     SMS_ACCESS_TOKEN = os.environ.get('SMS_ACCESS_TOKEN') or 'your_sms_access_token_here'
     
+    # Kho sự kiện tạm thời (INFO flag...) - OPTIONAL
+    # Đặt redis://... khi chạy nhiều worker, để trống sẽ dùng bộ nhớ tiến trình
+    EVENT_STORE_URL = os.environ.get('EVENT_STORE_URL')
+    
+    # WebSocket cho màn hình ESP32 (/ws/device/<user_id>) - ping để phát hiện kết nối chết
+    SOCK_SERVER_OPTIONS = {'ping_interval': 25}
+    
+    # Cache payload /api/user_profile trong tiến trình (LRU) - OPTIONAL
+    PROFILE_CACHE_MAX_ENTRIES = 1000
+    PROFILE_CACHE_TTL_SECONDS = 300
+    
+    # Tự chạy job sinh liều trong tiến trình web - chỉ bật khi chạy MỘT tiến trình.
+    # Nhiều worker (gunicorn): để tắt và chạy `flask dose-job` bằng cron lúc nửa đêm
+    DOSE_GENERATOR_ENABLED = os.environ.get('DOSE_GENERATOR_ENABLED') == '1'
+    
+    # Thời gian giữ kết quả bảng tuân thủ toàn hệ thống /admin/compliance (giây, 0 = tắt) - OPTIONAL
+    FLEET_COMPLIANCE_CACHE_SECONDS = 30
+    
     # Cấu hình thông báo
     NOTIFICATION_SETTINGS = {
         'DEFAULT_DELAY_MINUTES': 15,
@@ -0,0 +1,118 @@
+import hashlib
+
+import sqlalchemy as sa
+from flask import request, Response
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ContentVersion, User, Medicine, Schedule, MedicineHistory, DoseInstance
+
+# scope_id dành cho trạng thái hệ thống (bảng system_control)
+SYSTEM_SCOPE = 0
+
+_bump_sql = sa.text(
+    "UPDATE content_versions SET version = version + 1 WHERE scope_id IN :scope_ids"
+).bindparams(sa.bindparam('scope_ids', expanding=True))
+
+
+def get_content_version(scope_id):
+    """
+    Đọc phiên bản nội dung của một scope (một truy vấn theo khóa chính).
+    Tạo bản ghi phiên bản 1 nếu chưa có, để các lần ghi sau tăng được phiên bản.
+    """
+    version = db.session.query(ContentVersion.version).filter_by(scope_id=scope_id).scalar()
+    if version is not None:
+        return version
+
+    try:
+        db.session.add(ContentVersion(scope_id=scope_id, version=1))
+        db.session.commit()
+    except IntegrityError:
+        # Worker khác vừa tạo bản ghi
+        db.session.rollback()
+    return db.session.query(ContentVersion.version).filter_by(scope_id=scope_id).scalar()
+
+
+def ensure_content_versions(*scope_ids):
+    """
+    Tạo bản ghi phiên bản 1 cho các scope chưa có, trong transaction hiện tại và không commit
+    (dùng trước khi ghi, để thay đổi và bản ghi phiên bản commit cùng nhau).
+    """
+    existing = {
+        scope_id for (scope_id,) in
+        db.session.query(ContentVersion.scope_id).filter(ContentVersion.scope_id.in_(scope_ids))
+    }
+    for scope_id in scope_ids:
+        if scope_id in existing:
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(ContentVersion(scope_id=scope_id, version=1))
+        except IntegrityError:
+            # Worker khác vừa tạo bản ghi
+            pass
+
+
+def bump_content_version(*scope_ids):
+    """Tăng phiên bản trong transaction hiện tại (dùng cho các lệnh SQL thô)"""
+    if scope_ids:
+        db.session.execute(_bump_sql, {'scope_ids': list(scope_ids)})
+        db.session.info.setdefault('content_version_bumped', set()).update(scope_ids)
+
+
+def _affected_user_ids(session):
+    user_ids = set()
+    schedule_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+        elif isinstance(obj, (Medicine, Schedule, DoseInstance)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, MedicineHistory):
+            schedule_ids.add(obj.schedule_id)
+    return user_ids, schedule_ids
+
+
+@sa.event.listens_for(db.session, 'before_flush')
+def _collect_versioned_writes(session, flush_context, instances):
+    # User mới tạo chưa có id - chưa có ETag nào được phát cho họ nên bỏ qua
+    user_ids, schedule_ids = _affected_user_ids(session)
+    session.info.setdefault('content_version_users', set()).update(
+        uid for uid in user_ids if uid is not None
+    )
+    session.info.setdefault('content_version_schedules', set()).update(
+        sid for sid in schedule_ids if sid is not None
+    )
+
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _bump_versioned_writes(session, flush_context):
+    user_ids = session.info.pop('content_version_users', set())
+    schedule_ids = session.info.pop('content_version_schedules', set())
+    connection = session.connection()
+    if schedule_ids:
+        rows = connection.execute(
+            sa.select(Schedule.user_id).where(Schedule.id.in_(list(schedule_ids)))
+        )
+        user_ids.update(row[0] for row in rows)
+    if user_ids:
+        connection.execute(_bump_sql, {'scope_ids': sorted(user_ids)})
+        # Các user đã đổi trong transaction - cache xóa bản của họ khi commit (profile_cache.py)
+        session.info.setdefault('content_version_bumped', set()).update(user_ids)
+
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def not_modified(etag):
+    """Trả về response 304 nếu client đã có bản này (If-None-Match), ngược lại None"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    return response
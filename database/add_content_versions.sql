@@ -0,0 +1,8 @@
+USE elder_project;
+
+-- Phiên bản nội dung theo user cho ETag / 304 Not Modified trên các API thiết bị
+-- scope_id = user_id, 0 = trạng thái hệ thống (system_control)
+CREATE TABLE IF NOT EXISTS content_versions (
+    scope_id INT PRIMARY KEY,
+    version INT NOT NULL DEFAULT 1
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
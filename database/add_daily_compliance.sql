@@ -0,0 +1,34 @@
+USE elder_project;
+
+-- Bảng tổng hợp tuân thủ theo user theo ngày: thống kê tuần chỉ đọc tối đa 7 dòng
+-- thay vì đếm medicine_history. Ứng dụng cập nhật bảng trong cùng transaction
+-- với xác nhận uống thuốc và job sinh liều (compliance_rollup.py).
+CREATE TABLE IF NOT EXISTS daily_compliance (
+    user_id INT NOT NULL,
+    day DATE NOT NULL,
+    expected INT NOT NULL DEFAULT 0,
+    taken INT NOT NULL DEFAULT 0,
+    late INT NOT NULL DEFAULT 0,
+    missed INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Dữ liệu cũ: số liều / missed / muộn từ dose_instances (LATE_AFTER_MINUTES = 30)
+INSERT INTO daily_compliance (user_id, day, expected, late, missed)
+SELECT user_id, DATE(due_at), COUNT(*),
+       SUM(state = 'taken' AND taken_at > due_at + INTERVAL 30 MINUTE),
+       SUM(state = 'missed')
+FROM dose_instances
+GROUP BY user_id, DATE(due_at)
+ON DUPLICATE KEY UPDATE expected = VALUES(expected), late = VALUES(late), missed = VALUES(missed);
+
+-- Số liều đã uống từ medicine_history, cùng quy tắc với ứng dụng (mark_dose_taken):
+-- mỗi lịch tính tối đa một lần mỗi ngày, xác nhận lặp cho cùng liều không cộng thêm
+INSERT INTO daily_compliance (user_id, day, taken)
+SELECT s.user_id, DATE(h.timestamp), COUNT(DISTINCT h.schedule_id)
+FROM medicine_history h
+JOIN schedules s ON s.id = h.schedule_id
+WHERE h.status = 'taken'
+GROUP BY s.user_id, DATE(h.timestamp)
+ON DUPLICATE KEY UPDATE taken = VALUES(taken);
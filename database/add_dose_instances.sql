@@ -0,0 +1,15 @@
+USE elder_project;
+
+-- Bảng liều thuốc theo ngày, sinh từ schedules bởi job lúc nửa đêm
+CREATE TABLE IF NOT EXISTS dose_instances (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    schedule_id INT NOT NULL,
+    due_at DATETIME NOT NULL,
+    state VARCHAR(20) NOT NULL DEFAULT 'pending',
+    taken_at DATETIME NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (schedule_id) REFERENCES schedules(id),
+    UNIQUE KEY dose_instances_unique_schedule_due (schedule_id, due_at),
+    INDEX idx_dose_instances_user_due_state (user_id, due_at, state)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
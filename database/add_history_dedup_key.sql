@@ -0,0 +1,7 @@
+USE elder_project;
+
+-- Khóa idempotency cho xác nhận uống thuốc: Pi/web gửi lại cùng một xác nhận
+-- không tạo thêm bản ghi history. Bản ghi cũ giữ NULL (UNIQUE cho phép nhiều NULL).
+ALTER TABLE medicine_history
+    ADD COLUMN dedup_key VARCHAR(64) NULL,
+    ADD UNIQUE INDEX uq_history_dedup_key (dedup_key);
@@ -0,0 +1,4 @@
+USE elder_project;
+
+-- Index cho truy vấn "đã uống hôm nay" (anti-join trong get_current_schedules)
+CREATE INDEX idx_history_schedule_time_status ON medicine_history (schedule_id, timestamp, status);
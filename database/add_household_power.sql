@@ -0,0 +1,10 @@
+USE elder_project;
+
+-- Trạng thái nguồn theo hộ gia đình: mỗi user (thiết bị) có bản ghi system_control riêng
+-- Bản ghi có user_id NULL (id = 1) là trạng thái chung, dùng cho hộ chưa bấm POWER
+ALTER TABLE system_control
+    ADD COLUMN user_id INT NULL,
+    ADD UNIQUE INDEX idx_system_control_user (user_id),
+    ADD CONSTRAINT fk_system_control_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
+
+-- Phiên bản trạng thái nguồn của hộ nằm trong content_versions với scope_id = -user_id
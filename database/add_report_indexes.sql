@@ -0,0 +1,6 @@
+USE elder_project;
+
+-- Báo cáo theo khoảng ngày (reports.py) chỉ đọc index, không chạm tới bảng:
+-- medicine_history dùng idx_history_schedule_time_status (schedule_id, timestamp, status) đã có;
+-- liều bỏ lỡ lọc theo (user_id, state, due_at) và cần schedule_id để gộp theo thuốc/khung giờ
+CREATE INDEX idx_dose_instances_user_state_due_schedule ON dose_instances (user_id, state, due_at, schedule_id);
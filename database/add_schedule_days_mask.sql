@@ -0,0 +1,16 @@
+USE elder_project;
+
+-- Bitmask thứ trong tuần cho lịch uống thuốc: bit 0 = thứ Hai ... bit 6 = Chủ nhật
+ALTER TABLE schedules ADD days_mask INT NOT NULL DEFAULT 0;
+
+-- Backfill từ cột days (chuỗi JSON như ["monday", "friday"])
+UPDATE schedules SET days_mask =
+      (days LIKE '%"monday"%') * 1
+    + (days LIKE '%"tuesday"%') * 2
+    + (days LIKE '%"wednesday"%') * 4
+    + (days LIKE '%"thursday"%') * 8
+    + (days LIKE '%"friday"%') * 16
+    + (days LIKE '%"saturday"%') * 32
+    + (days LIKE '%"sunday"%') * 64;
+
+CREATE INDEX idx_schedules_user_active_days ON schedules (user_id, active, days_mask);
@@ -5,7 +5,10 @@ CREATE TABLE IF NOT EXISTS system_control (
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     updated_by VARCHAR(50) DEFAULT 'system',
     notes TEXT,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    user_id INT NULL,  -- NULL = trạng thái chung, có giá trị = trạng thái riêng của hộ
+    UNIQUE INDEX idx_system_control_user (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
 -- Insert dữ liệu mặc định
@@ -0,0 +1,189 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from collections import Counter
+
+from models import db, Schedule, DoseInstance, weekday_bit
+from schedule_index import parse_schedule_minute, schedule_days_mask
+from compliance_rollup import add_to_rollup, LATE_AFTER_MINUTES
+from expected_doses import refresh_expected_week
+
+# Thử lại sau khoảng thời gian này nếu job gặp lỗi (VD: database chưa sẵn sàng)
+RETRY_SECONDS = 60
+
+
+def day_bounds(day):
+    """Trả về (00:00:00, 23:59:59.999999) của một ngày"""
+    return datetime.combine(day, datetime.min.time()), datetime.combine(day, datetime.max.time())
+
+
+def schedule_due_at(schedule, day):
+    """Thời điểm đến hạn của lịch trong ngày `day`, None nếu lịch không chạy ngày đó"""
+    minute = parse_schedule_minute(schedule.time)
+    if minute is None or not schedule_days_mask(schedule) & weekday_bit(day):
+        return None
+    return datetime.combine(day, datetime.min.time()) + timedelta(minutes=minute)
+
+
+def generate_dose_instances(day, schedules=None):
+    """
+    Sinh các liều thuốc của ngày `day` từ lịch đang active (có thể chạy lại nhiều lần).
+
+    Args:
+        day: Ngày cần sinh (date)
+        schedules: Chỉ sinh cho các lịch này, mặc định là mọi lịch active
+
+    Returns:
+        int: Số liều mới được tạo
+    """
+    if schedules is None:
+        schedules = Schedule.query.filter(
+            Schedule.active == True,
+            Schedule.days_mask.op('&')(weekday_bit(day)) != 0
+        ).all()
+
+    due = {}
+    for schedule in schedules:
+        due_at = schedule_due_at(schedule, day)
+        if schedule.active and due_at is not None:
+            due[schedule.id] = (schedule.user_id, due_at)
+    if not due:
+        return 0
+
+    start, end = day_bounds(day)
+    existing = {
+        row.schedule_id for row in db.session.query(DoseInstance.schedule_id).filter(
+            DoseInstance.schedule_id.in_(list(due.keys())),
+            DoseInstance.due_at >= start,
+            DoseInstance.due_at <= end
+        )
+    }
+
+    new_instances = [
+        {'user_id': user_id, 'schedule_id': schedule_id, 'due_at': due_at, 'state': 'pending'}
+        for schedule_id, (user_id, due_at) in due.items()
+        if schedule_id not in existing
+    ]
+    if new_instances:
+        db.session.bulk_insert_mappings(DoseInstance, new_instances)
+        db.session.commit()
+    return len(new_instances)
+
+
+def mark_missed_doses(day):
+    """Đánh dấu 'missed' cho các liều còn pending của ngày đã qua"""
+    start, end = day_bounds(day)
+    pending = DoseInstance.query.filter(
+        DoseInstance.due_at >= start,
+        DoseInstance.due_at <= end,
+        DoseInstance.state == 'pending'
+    )
+    missed_by_user = dict(
+        pending.with_entities(DoseInstance.user_id, db.func.count()).group_by(DoseInstance.user_id).all()
+    )
+    updated = pending.update({'state': 'missed'}, synchronize_session=False)
+    for user_id, count in missed_by_user.items():
+        add_to_rollup(user_id, day, missed=count)
+    db.session.commit()
+    return updated
+
+
+def mark_dose_taken(schedule, taken_at):
+    """
+    Cập nhật liều trong ngày của lịch sang 'taken' và cộng vào bảng tổng hợp ngày.
+    Chỉ tính vào taken khi một liều pending/missed thật sự chuyển sang taken:
+    liều đã taken (xác nhận lặp với khóa khác) hay ngày lịch không chạy thì bỏ qua.
+    Không commit - gọi trong cùng transaction với bản ghi MedicineHistory.
+    """
+    day = taken_at.date()
+    start, end = day_bounds(day)
+    doses = DoseInstance.query.filter(
+        DoseInstance.schedule_id == schedule.id,
+        DoseInstance.due_at >= start,
+        DoseInstance.due_at <= end
+    )
+
+    # Xác nhận bù cho ngày đã qua (upload theo lô) có thể gặp liều đã bị đánh dấu missed
+    was_missed = 0
+    if day < datetime.now().date():
+        was_missed = doses.filter(DoseInstance.state == 'missed').update(
+            {'state': 'taken', 'taken_at': taken_at}, synchronize_session=False)
+    moved = was_missed + doses.filter(DoseInstance.state == 'pending').update(
+        {'state': 'taken', 'taken_at': taken_at}, synchronize_session=False)
+
+    due_at = schedule_due_at(schedule, day)
+    if moved == 0:
+        if due_at is None or doses.count():
+            # Lịch không chạy ngày này, hoặc liều đã được tính
+            return
+        # Lịch chưa có liều hôm nay (VD: job chưa chạy) - tạo luôn ở trạng thái taken
+        db.session.add(DoseInstance(
+            user_id=schedule.user_id,
+            schedule_id=schedule.id,
+            due_at=due_at,
+            state='taken',
+            taken_at=taken_at
+        ))
+
+    late = taken_at - due_at > timedelta(minutes=LATE_AFTER_MINUTES) if due_at else False
+    add_to_rollup(schedule.user_id, day, taken=1, late=int(late), missed=-was_missed)
+
+
+def confirmation_dedup_key(schedule_id, taken_at):
+    """Khóa idempotency mặc định của xác nhận uống thuốc: mỗi lịch một lần mỗi ngày"""
+    return f'{schedule_id}:{taken_at.date().isoformat()}'
+
+
+def delete_dose_instances(schedule_id):
+    """
+    Xóa các liều của một lịch (gọi trước khi xóa lịch, không commit). Chỉ trừ taken/missed khỏi
+    bảng tổng hợp từ hôm nay - các ngày đã qua giữ nguyên số liệu đã ghi, để tuân thủ trong quá
+    khứ không đổi khi lịch bị xóa. Cột expected từ hôm nay do refresh_expected tính lại.
+    """
+    today = datetime.now().date()
+    doses = DoseInstance.query.filter_by(schedule_id=schedule_id)
+    removed = Counter()
+    for user_id, due_at, state in doses.with_entities(DoseInstance.user_id, DoseInstance.due_at, DoseInstance.state):
+        if state in ('taken', 'missed') and due_at.date() >= today:
+            removed[(user_id, due_at.date(), state)] += 1
+    doses.delete(synchronize_session=False)
+
+    for (user_id, day, state), count in removed.items():
+        add_to_rollup(user_id, day, **{state: -count})
+
+
+class DoseInstanceGenerator:
+    """Job nền: sinh liều cho hôm nay khi khởi động, sau đó mỗi nửa đêm"""
+
+    def __init__(self, app):
+        self.app = app
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run_once(self, day):
+        with self.app.app_context():
+            missed = mark_missed_doses(day - timedelta(days=1))
+            created = generate_dose_instances(day)
+            started = time.monotonic()
+            refreshed = refresh_expected_week(None, day)
+            db.session.commit()
+            print(f"Dose instances {day}: created {created}, marked {missed} missed, "
+                  f"refreshed {refreshed} expected rows in {time.monotonic() - started:.2f}s")
+
+    def run(self):
+        while True:
+            today = datetime.now().date()
+            try:
+                self.run_once(today)
+            except Exception as e:
+                print(f"Error generating dose instances: {e}")
+                time.sleep(RETRY_SECONDS)
+                continue
+
+            next_midnight = datetime.combine(today + timedelta(days=1), datetime.min.time())
+            time.sleep(max((next_midnight - datetime.now()).total_seconds(), 0) + 1)
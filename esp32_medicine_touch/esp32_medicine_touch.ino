@@ -19,11 +19,10 @@ bool alertActive = false;
 String medicine = "";
 int compartmentNum = 0;
 int scheduleId = 0;
-unsigned long lastCheck = 0;
+unsigned long lastStateCheck = 0;
 unsigned long lastTouch = 0;
-unsigned long lastConfirmCheck = 0;
-unsigned long lastInfoCheck = 0;
 int currentConfirmationId = 0;
+String deviceCursor = "";  // cursor của /api/device_state, bỏ qua các phần không đổi
 
 // Touch areas (x, y, width, height)
 struct TouchArea {
@@ -64,22 +63,10 @@ void setup() {
 }
 
 void loop() {
-  // Kiểm tra thuốc mỗi 5 giây
-  if (millis() - lastCheck > 5000) {
-    checkMedicine();
-    lastCheck = millis();
-  }
-  
-  // Kiểm tra Pi button confirmation mỗi 2 giây
-  if (millis() - lastConfirmCheck > 2000) {
-      checkPiConfirmation();
-      lastConfirmCheck = millis();
-  }
-  
-  // Check for INFO flag every 4 seconds
-  if (millis() - lastInfoCheck > 4000) {
-      checkInfoFlag();
-      lastInfoCheck = millis();
+  // Lịch thuốc, INFO flag và Pi confirmation trong một request mỗi 2 giây
+  if (millis() - lastStateCheck > 2000) {
+    checkDeviceState();
+    lastStateCheck = millis();
   }
   
   // Kiểm tra touch screen
@@ -156,47 +143,112 @@ void checkMedicine() {
   
   int code = http.GET();
   
+  if (code == 200) {
+    handleScheduleData(http.getString());
+  } else {
+    showError("Loi API: " + String(code));
+  }
+  
+  http.end();
+}
+
+void checkDeviceState() {
+  if (WiFi.status() != WL_CONNECTED) {
+    return;
+  }
+  
+  HTTPClient http;
+  http.begin(String(serverURL) + "/api/device_state/" + String(userId) + "?since=" + deviceCursor);
+  http.addHeader("X-API-Key", "my-secret-key-2025");
+  
+  int code = http.GET();
+  
   if (code == 200) {
     String data = http.getString();
     
-    if (data.indexOf("medicine_name") > 0) {
-      // Tìm tên thuốc
-      int start = data.indexOf("\"medicine_name\":\"") + 17;
-      int end = data.indexOf("\"", start);
-      medicine = data.substring(start, end);
-      
-      // Tìm ngăn
-      start = data.indexOf("\"compartment_number\":") + 21;
-      end = data.indexOf(",", start);
-      compartmentNum = data.substring(start, end).toInt();
-      
-      // Tìm schedule ID
-      start = data.indexOf("\"schedule_id\":") + 14;
-      end = data.indexOf(",", start);
-      scheduleId = data.substring(start, end).toInt();
-      
-      if (!alertActive) {
-        alertActive = true;
-        showAlertScreen();
-      }
-    } else {
-      if (alertActive) {
-        alertActive = false;
-        showMainScreen();
-      } else {
-        // Hiển thị không có thuốc
-        tft.fillRect(10, 100, 300, 20, TFT_BLACK);
-        tft.setTextColor(TFT_GREEN);
-        tft.drawString("Khong co lich uong thuoc!", 10, 100);
-      }
+    // Phần nào không đổi so với cursor thì server bỏ đi
+    String section = jsonSection(data, "schedule");
+    if (section.length() > 0) handleScheduleData(section);
+    
+    section = jsonSection(data, "info_flag");
+    if (section.length() > 0) handleInfoFlagData(section);
+    
+    section = jsonSection(data, "confirmation");
+    if (section.length() > 0) handlePiConfirmationData(section);
+    
+    int start = data.indexOf("\"cursor\":\"");
+    if (start >= 0) {
+      start += 10;
+      deviceCursor = data.substring(start, data.indexOf("\"", start));
     }
   } else {
-    showError("Loi API: " + String(code));
+    Serial.println("Error checking device state: " + String(code));
   }
   
   http.end();
 }
 
+// Lấy object/array con theo key trong JSON (không cần thư viện JSON)
+String jsonSection(const String& data, const char* key) {
+  int keyPos = data.indexOf(String("\"") + key + "\":");
+  if (keyPos < 0) return "";
+  
+  int start = keyPos + strlen(key) + 3;
+  while (start < data.length() && data[start] == ' ') start++;
+  
+  int depth = 0;
+  bool inString = false;
+  for (int i = start; i < data.length(); i++) {
+    char c = data[i];
+    if (inString) {
+      if (c == '\\') i++;
+      else if (c == '"') inString = false;
+    } else if (c == '"') {
+      inString = true;
+    } else if (c == '{' || c == '[') {
+      depth++;
+    } else if (c == '}' || c == ']') {
+      depth--;
+      if (depth == 0) return data.substring(start, i + 1);
+    }
+  }
+  return "";
+}
+
+void handleScheduleData(String data) {
+  if (data.indexOf("medicine_name") > 0) {
+    // Tìm tên thuốc
+    int start = data.indexOf("\"medicine_name\":\"") + 17;
+    int end = data.indexOf("\"", start);
+    medicine = data.substring(start, end);
+    
+    // Tìm ngăn
+    start = data.indexOf("\"compartment_number\":") + 21;
+    end = data.indexOf(",", start);
+    compartmentNum = data.substring(start, end).toInt();
+    
+    // Tìm schedule ID
+    start = data.indexOf("\"schedule_id\":") + 14;
+    end = data.indexOf(",", start);
+    scheduleId = data.substring(start, end).toInt();
+    
+    if (!alertActive) {
+      alertActive = true;
+      showAlertScreen();
+    }
+  } else {
+    if (alertActive) {
+      alertActive = false;
+      showMainScreen();
+    } else {
+      // Hiển thị không có thuốc
+      tft.fillRect(10, 100, 300, 20, TFT_BLACK);
+      tft.setTextColor(TFT_GREEN);
+      tft.drawString("Khong co lich uong thuoc!", 10, 100);
+    }
+  }
+}
+
 void showMainScreen() {
   tft.fillScreen(TFT_BLACK);
   
@@ -308,7 +360,7 @@ void showInfo() {
 
     Serial.println("Making API call to get user profile...");
     HTTPClient http;
-    http.begin(String(serverURL) + "/api/user_profile/" + String(userId));
+    http.begin(String(serverURL) + "/api/user_profile/" + String(userId) + "?fields=user_info,weekly_stats");
     http.addHeader("X-API-Key", "my-secret-key-2025");
 
     int code = http.GET();
@@ -429,93 +481,54 @@ void confirmMedicine(bool sendAPI) {
   showMainScreen();
 }
 
-void checkInfoFlag() {
-  if (WiFi.status() != WL_CONNECTED) {
-    Serial.println("WiFi not connected, skipping INFO flag check");
-    return; // Only check when WiFi is connected
-  }
-
-  Serial.println("Checking INFO flag for user: " + String(userId));
-  HTTPClient http;
-  http.begin(String(serverURL) + "/api/check_info_flag/" + String(userId));
-  http.addHeader("X-API-Key", "my-secret-key-2025");
-
-  int code = http.GET();
-  Serial.println("INFO flag check response code: " + String(code));
-
-  if (code == 200) {
-    String data = http.getString();
-    Serial.println("INFO flag response: " + data);
-
-    if (data.indexOf("\"info_flag_detected\":true") > 0) {
-      Serial.println("INFO flag detected! Displaying user profile...");
-      
-      // Extract flag_id to clear it after displaying
-      int idStart = data.indexOf("\"flag_id\":") + 10;
-      int idEnd = data.indexOf("}", idStart);
-      if (idEnd == -1) idEnd = data.indexOf(",", idStart);
-      int flagId = data.substring(idStart, idEnd).toInt();
-      Serial.println("Flag ID to clear: " + String(flagId));
-      
-      // Clear the flag first to prevent repeated detection
-      clearInfoFlag(flagId);
-      
-      // Show user info
-      Serial.println("Starting to display user info...");
-      showInfo();
-      Serial.println("User info display completed");
-      
-    } else {
-      Serial.println("No INFO flag detected");
-    }
-  } else {
-    Serial.println("Error checking INFO flag: " + String(code));
+void handleInfoFlagData(String data) {
+  if (data.indexOf("\"info_flag_detected\":true") > 0) {
+    Serial.println("INFO flag detected! Displaying user profile...");
+    
+    // Extract flag_id to clear it after displaying
+    int idStart = data.indexOf("\"flag_id\":") + 10;
+    int idEnd = data.indexOf(",", idStart);
+    if (idEnd == -1) idEnd = data.indexOf("}", idStart);
+    int flagId = data.substring(idStart, idEnd).toInt();
+    Serial.println("Flag ID to clear: " + String(flagId));
+    
+    // Clear the flag first to prevent repeated detection
+    clearInfoFlag(flagId);
+    
+    // Show user info
+    Serial.println("Starting to display user info...");
+    showInfo();
+    Serial.println("User info display completed");
   }
-
-  http.end();
 }
 
-void checkPiConfirmation() {
-  if (WiFi.status() != WL_CONNECTED || !alertActive) {
-    return; // Chỉ check khi có WiFi và đang alert
+void handlePiConfirmationData(String data) {
+  if (!alertActive) {
+    return; // Chỉ xử lý khi đang alert
   }
   
-  HTTPClient http;
-  http.begin(String(serverURL) + "/api/check_confirmation_status/" + String(userId));
-  http.addHeader("X-API-Key", "my-secret-key-2025");
-  
-  int code = http.GET();
-  
-  if (code == 200) {
-    String data = http.getString();
+  // Kiểm tra xem có confirmation mới không
+  if (data.indexOf("\"confirmed\":true") > 0) {
+    // Tìm confirmation_id
+    int idStart = data.indexOf("\"confirmation_id\":") + 18;
+    int idEnd = data.indexOf(",", idStart);
+    if (idEnd == -1) idEnd = data.indexOf("}", idStart);
+    int confirmId = data.substring(idStart, idEnd).toInt();
     
-    // Kiểm tra xem có confirmation mới không
-    if (data.indexOf("\"confirmed\":true") > 0) {
-      // Tìm confirmation_id
-      int idStart = data.indexOf("\"confirmation_id\":") + 18;
-      int idEnd = data.indexOf("}", idStart);
-      if (idEnd == -1) idEnd = data.indexOf(",", idStart);
-      int confirmId = data.substring(idStart, idEnd).toInt();
+    // Nếu là confirmation mới
+    if (confirmId != currentConfirmationId && confirmId > 0) {
+      currentConfirmationId = confirmId;
       
-      // Nếu là confirmation mới
-      if (confirmId != currentConfirmationId && confirmId > 0) {
-        currentConfirmationId = confirmId;
-        
-        Serial.println("PI BUTTON CONFIRMATION DETECTED!");
-        
-        // HIỂN THỊ GIỐNG NHƯ KHI NHẤN NÚT BOOT
-        // Sử dụng cùng function confirmMedicine() nhưng không gửi API
-        confirmMedicine(false);  // false = không gửi API vì Pi đã gửi rồi
-        
-        // Xóa confirmation sau khi hiển thị
-        clearConfirmation(confirmId);
-      }
+      Serial.println("PI BUTTON CONFIRMATION DETECTED!");
+      
+      // HIỂN THỊ GIỐNG NHƯ KHI NHẤN NÚT BOOT
+      // Sử dụng cùng function confirmMedicine() nhưng không gửi API
+      confirmMedicine(false);  // false = không gửi API vì Pi đã gửi rồi
+      
+      // Xóa confirmation sau khi hiển thị
+      clearConfirmation(confirmId);
     }
-  } else {
-    Serial.println("Error checking Pi confirmation: " + String(code));
   }
-  
-  http.end();
 }
 
 void clearInfoFlag(int flagId) {
@@ -524,7 +537,8 @@ void clearInfoFlag(int flagId) {
   http.addHeader("X-API-Key", "my-secret-key-2025");
   http.addHeader("Content-Type", "application/json");
   
-  int result = http.POST("{}");
+  // Server chỉ cho xóa INFO flag của đúng user này
+  int result = http.POST("{\"user_id\":" + String(userId) + "}");
   
   if (result == 200) {
     Serial.println("INFO flag cleared successfully!");
@@ -542,7 +556,8 @@ void clearConfirmation(int confirmId) {
   http.addHeader("X-API-Key", "my-secret-key-2025");
   http.addHeader("Content-Type", "application/json");
   
-  int result = http.POST("{}");
+  // Server chỉ cho xác nhận confirmation của đúng user này
+  int result = http.POST("{\"user_id\":" + String(userId) + "}");
   
   if (result == 200) {
     Serial.println("Confirmation cleared successfully!");
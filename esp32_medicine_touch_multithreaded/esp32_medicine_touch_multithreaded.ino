@@ -5,6 +5,7 @@
 
 #include <WiFi.h>
 #include <HTTPClient.h>
+#include <WebSocketsClient.h>  // Thư viện "WebSockets" (Markus Sattler)
 #include <TFT_eSPI.h>
 #include <freertos/FreeRTOS.h>
 #include <freertos/task.h>
@@ -15,9 +16,12 @@
 const char* ssid = "duy";
 const char* password = "11111111";
 const char* serverURL = "http://192.168.1.159:5000";
+const char* serverHost = "192.168.1.159";  // WebSocket /ws/device/<userId>
+const int serverPort = 5000;
 const int userId = 13;
 
 TFT_eSPI tft = TFT_eSPI();
+WebSocketsClient webSocket;
 
 // FreeRTOS handles
 TaskHandle_t networkTaskHandle = NULL;
@@ -162,58 +166,82 @@ void loop() {
   }
 }
 
-// NETWORK TASK - Handle all HTTP requests
+// NETWORK TASK - Handle all HTTP requests and the WebSocket
 void networkTask(void *parameter) {
   NetworkRequest req;
   
+  // Lịch thuốc, INFO flag và Pi confirmation được server đẩy qua WebSocket
+  // thay vì poll 3 API mỗi vài giây
+  webSocket.begin(serverHost, serverPort, "/ws/device/" + String(userId));
+  webSocket.setExtraHeaders("X-API-Key: my-secret-key-2025");
+  webSocket.onEvent(webSocketEvent);
+  webSocket.setReconnectInterval(5000);
+  
   while (true) {
+    webSocket.loop();
+    
     // Check for network requests
-    if (xQueueReceive(networkQueue, &req, pdMS_TO_TICKS(100)) == pdPASS) {
+    if (xQueueReceive(networkQueue, &req, pdMS_TO_TICKS(20)) == pdPASS) {
       processNetworkRequest(req);
     }
     
-    // Auto-schedule periodic checks
-    static unsigned long lastMedicineCheck = 0;
-    static unsigned long lastInfoCheck = 0;
-    static unsigned long lastConfirmCheck = 0;
-    
-    unsigned long now = millis();
-    
-    // Check medicine schedule every 5 seconds
-    if (now - lastMedicineCheck > 5000) {
-      NetworkRequest medicineReq;
-      medicineReq.type = "check_medicine";
-      medicineReq.endpoint = "/api/check_schedule_by_user/" + String(userId);
-      medicineReq.param = userId;
-      
-      processNetworkRequest(medicineReq);
-      lastMedicineCheck = now;
-    }
-    
-    // Check INFO flag every 4 seconds
-    if (now - lastInfoCheck > 4000) {
-      NetworkRequest infoReq;
-      infoReq.type = "check_info";
-      infoReq.endpoint = "/api/check_info_flag/" + String(userId);
-      infoReq.param = userId;
-      
-      processNetworkRequest(infoReq);
-      lastInfoCheck = now;
-    }
-    
-    // Check Pi confirmation every 2 seconds when alert active
-    if (alertActive && (now - lastConfirmCheck > 2000)) {
-      NetworkRequest confirmReq;
-      confirmReq.type = "check_confirmation";
-      confirmReq.endpoint = "/api/check_confirmation_status/" + String(userId);
-      confirmReq.param = userId;
-      
-      processNetworkRequest(confirmReq);
-      lastConfirmCheck = now;
+    vTaskDelay(pdMS_TO_TICKS(10));
+  }
+}
+
+void webSocketEvent(WStype_t type, uint8_t *payload, size_t length) {
+  switch (type) {
+    case WStype_CONNECTED:
+      Serial.println("WebSocket connected");
+      break;
+    case WStype_DISCONNECTED:
+      Serial.println("WebSocket disconnected, reconnecting...");
+      break;
+    case WStype_TEXT:
+      processStateMessage(String((char *)payload));
+      break;
+    default:
+      break;
+  }
+}
+
+// Server chỉ gửi các phần đã thay đổi: schedule, info_flag, confirmation, system
+void processStateMessage(String message) {
+  String section = jsonSection(message, "schedule");
+  if (section.length() > 0) processMedicineResponse(200, section);
+  
+  section = jsonSection(message, "info_flag");
+  if (section.length() > 0) processInfoResponse(200, section);
+  
+  section = jsonSection(message, "confirmation");
+  if (section.length() > 0 && alertActive) processConfirmationResponse(200, section);
+}
+
+// Lấy object/array con theo key trong JSON (không cần thư viện JSON)
+String jsonSection(const String& data, const char* key) {
+  int keyPos = data.indexOf(String("\"") + key + "\":");
+  if (keyPos < 0) return "";
+  
+  int start = keyPos + strlen(key) + 3;
+  while (start < data.length() && data[start] == ' ') start++;
+  
+  int depth = 0;
+  bool inString = false;
+  for (int i = start; i < data.length(); i++) {
+    char c = data[i];
+    if (inString) {
+      if (c == '\\') i++;
+      else if (c == '"') inString = false;
+    } else if (c == '"') {
+      inString = true;
+    } else if (c == '{' || c == '[') {
+      depth++;
+    } else if (c == '}' || c == ']') {
+      depth--;
+      if (depth == 0) return data.substring(start, i + 1);
     }
-    
-    vTaskDelay(pdMS_TO_TICKS(100));
   }
+  return "";
 }
 
 // DISPLAY TASK - Handle all TFT operations
@@ -383,8 +411,8 @@ void processInfoResponse(int code, String response) {
     
     // Extract flag_id
     int idStart = response.indexOf("\"flag_id\":") + 10;
-    int idEnd = response.indexOf("}", idStart);
-    if (idEnd == -1) idEnd = response.indexOf(",", idStart);
+    int idEnd = response.indexOf(",", idStart);
+    if (idEnd == -1) idEnd = response.indexOf("}", idStart);
     int flagId = response.substring(idStart, idEnd).toInt();
     
     // Clear flag first
@@ -393,7 +421,7 @@ void processInfoResponse(int code, String response) {
     // Request user profile
     NetworkRequest profileReq;
     profileReq.type = "user_profile";
-    profileReq.endpoint = "/api/user_profile/" + String(userId);
+    profileReq.endpoint = "/api/user_profile/" + String(userId) + "?fields=user_info,weekly_stats";
     profileReq.param = userId;
     
     // Process immediately in this task
@@ -404,8 +432,8 @@ void processInfoResponse(int code, String response) {
 void processConfirmationResponse(int code, String response) {
   if (code == 200 && response.indexOf("\"confirmed\":true") > 0) {
     int idStart = response.indexOf("\"confirmation_id\":") + 18;
-    int idEnd = response.indexOf("}", idStart);
-    if (idEnd == -1) idEnd = response.indexOf(",", idStart);
+    int idEnd = response.indexOf(",", idStart);
+    if (idEnd == -1) idEnd = response.indexOf("}", idStart);
     int confirmId = response.substring(idStart, idEnd).toInt();
     
     if (confirmId != currentConfirmationId && confirmId > 0) {
@@ -455,29 +483,17 @@ void processUserProfileResponse(int code, String response) {
 }
 
 void clearInfoFlag(int flagId) {
-  HTTPClient http;
-  http.begin(String(serverURL) + "/api/clear_info_flag/" + String(flagId));
-  http.addHeader("X-API-Key", "my-secret-key-2025");
-  http.addHeader("Content-Type", "application/json");
-  
-  int result = http.POST("{}");
-  if (result == 200) {
+  String message = "{\"type\":\"clear_info_flag\",\"flag_id\":" + String(flagId) + "}";
+  if (webSocket.sendTXT(message)) {
     Serial.println("INFO flag cleared successfully!");
   }
-  http.end();
 }
 
 void clearConfirmation(int confirmId) {
-  HTTPClient http;
-  http.begin(String(serverURL) + "/api/clear_confirmation/" + String(confirmId));
-  http.addHeader("X-API-Key", "my-secret-key-2025");
-  http.addHeader("Content-Type", "application/json");
-  
-  int result = http.POST("{}");
-  if (result == 200) {
+  String message = "{\"type\":\"clear_confirmation\",\"confirmation_id\":" + String(confirmId) + "}";
+  if (webSocket.sendTXT(message)) {
     Serial.println("Confirmation cleared successfully!");
   }
-  http.end();
 }
 
 // Touch handling functions
@@ -494,7 +510,7 @@ void handleInfoTouch() {
   Serial.println("Info button touched!");
   NetworkRequest req;
   req.type = "user_profile";
-  req.endpoint = "/api/user_profile/" + String(userId);
+  req.endpoint = "/api/user_profile/" + String(userId) + "?fields=user_info,weekly_stats";
   req.param = userId;
   xQueueSend(networkQueue, &req, 0);
 }
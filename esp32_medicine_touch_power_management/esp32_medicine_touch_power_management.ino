@@ -33,7 +33,8 @@ unsigned long sessionStartTime = 0;
 unsigned long lastStateChange = 0;
 
 // Intervals (milliseconds)
-const unsigned long SLEEP_API_INTERVAL = 30000;    // 30 seconds in sleep
+const unsigned long SLEEP_API_INTERVAL = 30000;    // 30 seconds in sleep (fallback when /api/next_dose fails)
+const unsigned long MAX_SLEEP_API_INTERVAL = 900000; // 15 minutes upper bound so schedule edits are picked up
 const unsigned long ACTIVE_API_INTERVAL = 5000;    // 5 seconds when active
 const unsigned long ACTIVITY_TIMEOUT = 180000;     // 3 minutes timeout
 const unsigned long DEBOUNCE_DELAY = 2000;         // 2 seconds button debounce
@@ -54,6 +55,10 @@ int currentCompartment = 0;
 bool buttonDebounced = true;
 unsigned long lastConfirmTime = 0;
 
+// Next dose scheduling (from /api/next_dose)
+unsigned long sleepCheckInterval = 0;  // 0 = check immediately
+bool doseDueNow = false;
+
 // Power Management
 bool screenOn = true;
 bool wifiConnected = false;
@@ -112,11 +117,12 @@ void handleSleepMode(unsigned long currentTime) {
     turnOffScreen();
   }
   
-  // Check for medicine schedules every 30 seconds
-  if (currentTime - lastAPICheck >= SLEEP_API_INTERVAL) {
+  // Sleep until the server says the next dose is due instead of polling
+  if (currentTime - lastAPICheck >= sleepCheckInterval) {
     lastAPICheck = currentTime;
+    sleepCheckInterval = fetchNextDoseDelay();
     
-    if (checkForMedicineSchedule()) {
+    if (doseDueNow && checkForMedicineSchedule()) {
       changeState(ACTIVE_MODE);
     }
   }
@@ -313,6 +319,47 @@ bool checkForMedicineSchedule() {
   return false;
 }
 
+unsigned long fetchNextDoseDelay() {
+  // Returns how long to sleep before the next check (ms), sets doseDueNow
+  doseDueNow = false;
+  if (!wifiConnected) {
+    connectToWiFi();
+    if (!wifiConnected) return SLEEP_API_INTERVAL;
+  }
+  
+  HTTPClient http;
+  String url = String(serverURL) + "/api/next_dose/" + String(userId) + "?max_wait=" + String(MAX_SLEEP_API_INTERVAL / 1000);
+  
+  http.begin(url);
+  http.addHeader("X-API-Key", apiKey);
+  
+  unsigned long delayMs = SLEEP_API_INTERVAL;
+  int httpResponseCode = http.GET();
+  
+  if (httpResponseCode == 200) {
+    StaticJsonDocument<256> filter;
+    filter["seconds_until"] = true;
+    filter["retry_after"] = true;
+    
+    DynamicJsonDocument doc(256);
+    if (deserializeJson(doc, http.getString(), DeserializationOption::Filter(filter)) == DeserializationError::Ok) {
+      if (!doc["seconds_until"].isNull() && doc["seconds_until"].as<long>() == 0) {
+        // Dose is due now - re-check just after the 10 second due window
+        doseDueNow = true;
+        delayMs = 11000;
+      } else {
+        delayMs = doc["retry_after"].as<unsigned long>() * 1000UL;
+        if (delayMs < 1000) delayMs = 1000;
+        if (delayMs > MAX_SLEEP_API_INTERVAL) delayMs = MAX_SLEEP_API_INTERVAL;
+      }
+      Serial.println("Next dose check in " + String(delayMs / 1000) + "s");
+    }
+  }
+  
+  http.end();
+  return delayMs;
+}
+
 bool confirmMedicine() {
   if (!wifiConnected) return false;
   
@@ -0,0 +1,232 @@
+from datetime import datetime, timedelta
+
+from models import db, User, Schedule, MedicineHistory, NotificationHistory, AdminLog
+from content_version import get_content_version, bump_content_version, SYSTEM_SCOPE
+from dose_instances import mark_dose_taken, confirmation_dedup_key
+from power_state import power_state, power_scope
+
+EVENT_TYPES = ('confirmation', 'notification_log', 'info_press', 'power_press')
+
+# Số sự kiện tối đa trong một lô upload
+MAX_BULK_EVENTS = 500
+
+# Sự kiện cũ hơn / ở tương lai quá mức này bị từ chối (đồng hồ thiết bị sai)
+MAX_EVENT_AGE = timedelta(days=7)
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+DEDUP_KEY_LENGTH = MedicineHistory.__table__.c.dedup_key.type.length
+
+
+class EventError(ValueError):
+    """Sự kiện không hợp lệ - chỉ sự kiện đó bị từ chối, không hủy cả lô"""
+
+
+def parse_event(raw, default_user_id, now):
+    """Kiểm tra các trường chung, trả về bản sao đã chuẩn hóa user_id và occurred_at"""
+    if not isinstance(raw, dict):
+        raise EventError('Event must be an object')
+    if raw.get('type') not in EVENT_TYPES:
+        raise EventError(f"Unknown event type: {raw.get('type')}")
+
+    try:
+        user_id = int(raw.get('user_id', default_user_id))
+    except (TypeError, ValueError):
+        raise EventError('Missing or invalid user_id')
+
+    occurred_at = raw.get('occurred_at')
+    if occurred_at:
+        try:
+            occurred_at = datetime.fromisoformat(str(occurred_at))
+        except ValueError:
+            raise EventError('Invalid occurred_at (ISO 8601 expected)')
+        if occurred_at.tzinfo:
+            occurred_at = occurred_at.astimezone().replace(tzinfo=None)
+        if occurred_at > now + MAX_CLOCK_SKEW or occurred_at < now - MAX_EVENT_AGE:
+            raise EventError('occurred_at is out of range')
+    else:
+        occurred_at = now
+
+    return dict(raw, user_id=user_id, occurred_at=occurred_at)
+
+
+def ingest_events(raw_events, default_user_id=None, now=None):
+    """
+    Ghi một lô sự kiện thiết bị trong transaction hiện tại, không commit.
+    Mỗi loại được ghi bằng một lệnh INSERT nhiều dòng; sự kiện lỗi chỉ được
+    đánh dấu trong kết quả, các sự kiện còn lại vẫn được ghi.
+
+    Returns:
+        (results, followups): results theo thứ tự gửi lên, mỗi phần tử có
+        'index', 'type', 'status' (created, duplicate, error) và 'error' nếu lỗi;
+        followups là các sự kiện đã ghi cần đẩy cho ESP32 sau khi commit,
+        dạng (event, result, schedule)
+    """
+    now = now or datetime.now()
+    results = []
+    events = []
+    for index, raw in enumerate(raw_events):
+        result = {'index': index, 'type': raw.get('type') if isinstance(raw, dict) else None}
+        results.append(result)
+        try:
+            events.append((parse_event(raw, default_user_id, now), result))
+        except EventError as e:
+            result.update(status='error', error=str(e))
+
+    # Một truy vấn cho user và một cho lịch của cả lô
+    user_ids = {event['user_id'] for event, _ in events}
+    known_users = {row[0] for row in db.session.query(User.id).filter(User.id.in_(user_ids))} if user_ids else set()
+    schedule_ids = {_as_int(event.get('schedule_id')) for event, _ in events} - {None}
+    schedules = {s.id: s for s in Schedule.query.filter(Schedule.id.in_(schedule_ids))} if schedule_ids else {}
+
+    grouped = {event_type: [] for event_type in EVENT_TYPES}
+    for event, result in events:
+        if event['user_id'] not in known_users:
+            result.update(status='error', error=f"Unknown user_id {event['user_id']}")
+            continue
+        grouped[event['type']].append((event, result))
+
+    # Bản ghi phiên bản nguồn phải có trước khi ghi (get_content_version có thể commit)
+    for user_id in {event['user_id'] for event, _ in grouped['power_press']}:
+        get_content_version(SYSTEM_SCOPE)
+        get_content_version(power_scope(user_id))
+
+    followups = _ingest_confirmations(grouped['confirmation'], schedules)
+    _ingest_notification_logs(grouped['notification_log'], schedules)
+    _ingest_power_presses(grouped['power_press'])
+
+    for event, result in grouped['info_press']:
+        # INFO flag không lưu DB - chỉ đẩy cho ESP32 sau khi commit
+        result['status'] = 'created'
+        followups.append((event, result, None))
+
+    return results, followups
+
+
+def _ingest_confirmations(items, schedules):
+    """Ghi history theo khóa idempotency (trùng khóa trả về bản ghi cũ), cập nhật liều trong ngày"""
+    pending = []
+    for event, result in items:
+        schedule = schedules.get(_as_int(event.get('schedule_id')))
+        if schedule is None or schedule.user_id != event['user_id']:
+            result.update(status='error', error='Schedule not found for this user')
+            continue
+        key = event.get('idempotency_key') or confirmation_dedup_key(schedule.id, event['occurred_at'])
+        key = str(key).strip()
+        if not key or len(key) > DEDUP_KEY_LENGTH:
+            result.update(status='error', error=f'idempotency_key must be 1-{DEDUP_KEY_LENGTH} characters')
+            continue
+        pending.append((event, result, schedule, key))
+
+    if not pending:
+        return []
+
+    keys = {key for _, _, _, key in pending}
+    existing = {
+        row.dedup_key: row for row in db.session.query(
+            MedicineHistory.id, MedicineHistory.schedule_id, MedicineHistory.dedup_key
+        ).filter(MedicineHistory.dedup_key.in_(keys))
+    }
+
+    rows = []
+    created = []
+    seen = {}
+    for event, result, schedule, key in pending:
+        previous = existing.get(key)
+        owner = previous.schedule_id if previous is not None else seen.get(key)
+        if owner is not None and owner != schedule.id:
+            result.update(status='error', error='Idempotency key already used for another schedule')
+        elif previous is not None or key in seen:
+            result.update(status='duplicate', idempotency_key=key)
+        else:
+            seen[key] = schedule.id
+            rows.append({
+                'schedule_id': schedule.id,
+                'timestamp': event['occurred_at'],
+                'status': 'taken',
+                'dedup_key': key
+            })
+            result.update(status='created', idempotency_key=key)
+            created.append((event, result, schedule))
+
+    if rows:
+        db.session.execute(MedicineHistory.__table__.insert(), rows)
+        for event, result, schedule in created:
+            mark_dose_taken(schedule, event['occurred_at'])
+        # INSERT thô không qua listener của content_version
+        bump_content_version(*sorted({schedule.user_id for _, _, schedule in created}))
+
+    # Gắn history_id (kể cả bản ghi trùng) bằng một truy vấn
+    ids = dict(db.session.query(MedicineHistory.dedup_key, MedicineHistory.id)
+               .filter(MedicineHistory.dedup_key.in_(keys)))
+    for _, result, _, key in pending:
+        if result['status'] != 'error':
+            result['history_id'] = ids.get(key)
+
+    return created
+
+
+def _ingest_notification_logs(items, schedules):
+    rows = []
+    for event, result in items:
+        schedule_id = _as_int(event.get('schedule_id'))
+        if event.get('schedule_id') is not None and schedule_id not in schedules:
+            result.update(status='error', error='Schedule not found')
+            continue
+        notification_type = event.get('notification_type', 'missed_medicine')
+        rows.append({
+            'user_id': event['user_id'],
+            'schedule_id': schedule_id,
+            'notification_type': notification_type,
+            'recipient_phone': event.get('emergency_contact_phone'),
+            'recipient_zalo_id': event.get('emergency_contact_zalo_id'),  # Email lưu trong trường zalo_id
+            'message_content': f"{notification_type}: {event.get('medicine_name', '')} "
+                               f"from compartment {event.get('compartment', 0)}",
+            'delivery_status': event.get('delivery_status', 'sent'),
+            'sent_at': event['occurred_at'],
+            'error_message': event.get('error_message')
+        })
+        result['status'] = 'created'
+
+    if rows:
+        db.session.execute(NotificationHistory.__table__.insert(), rows)
+
+
+def _ingest_power_presses(items):
+    """
+    Áp dụng lần bấm POWER theo đúng thứ tự gửi lên. Sự kiện có new_status
+    (trạng thái thiết bị đã tự chuyển sang khi offline) được ghi đè, gửi lại
+    không đảo thêm lần nữa; không có new_status thì đảo trạng thái như API thường.
+    """
+    logs = []
+    for event, result in items:
+        user_id = event['user_id']
+        pressed_at = event['occurred_at']
+        updated_by = f'power_button_user_{user_id}'
+        notes = f"Buffered power button press at {pressed_at.isoformat()}"
+
+        if isinstance(event.get('new_status'), bool):
+            new_status = event['new_status']
+            power_state.set(new_status, pressed_at, updated_by, notes, user_id=user_id)
+        else:
+            new_status = power_state.toggle(pressed_at, updated_by, notes, user_id=user_id)
+
+        action = 'enable' if new_status else 'disable'
+        logs.append({
+            'admin_id': user_id,
+            'action': f'power_button_{action}',
+            'target_type': 'system_control',
+            'target_id': user_id,
+            'details': f'Buffered power button press by user {user_id} - System {action}d',
+            'timestamp': pressed_at
+        })
+        result.update(status='created', new_status=new_status)
+
+    if logs:
+        db.session.execute(AdminLog.__table__.insert(), logs)
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,168 @@
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Mặc định sự kiện hết hạn sau 2 phút (giống cửa sổ INFO flag cũ)
+DEFAULT_TTL_SECONDS = 120
+# Số sự kiện tối đa giữ lại cho mỗi (kênh, user)
+MAX_EVENTS_PER_USER = 50
+
+
+class InMemoryEventStore:
+    """
+    Kho sự kiện tạm thời theo (kênh, user) trong bộ nhớ tiến trình, có TTL.
+
+    Mỗi sự kiện có id tăng dần. Client xác nhận bằng ack(kênh, user, event_id), các sự
+    kiện có id <= id đã ack của (kênh, user) đó sẽ không được trả về nữa.
+    Đọc sự kiện mới nhất và ack đều là O(1).
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, max_events=MAX_EVENTS_PER_USER):
+        self.ttl_seconds = ttl_seconds
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._queues = {}   # (channel, user_id) -> deque of events
+        self._cursors = {}  # (channel, user_id) -> id đã ack lớn nhất
+        self._owners = {}   # event_id -> (channel, user_id)
+
+    def _prune(self, key, now):
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        cursor = self._cursors.get(key, 0)
+        while queue and (queue[0]['id'] <= cursor or now > queue[0]['_expires']):
+            self._owners.pop(queue.popleft()['id'], None)
+        if not queue:
+            del self._queues[key]
+            self._cursors.pop(key, None)
+
+    def publish(self, channel, user_id, data=None, ttl_seconds=None):
+        """
+        Thêm sự kiện mới, trả về sự kiện (dict có 'id', 'timestamp', 'data').
+        ttl_seconds ghi đè TTL mặc định - nên giữ cố định cho mỗi kênh.
+        """
+        now = time.monotonic()
+        key = (channel, user_id)
+        with self._lock:
+            event = {
+                'id': next(self._ids),
+                'timestamp': datetime.now().isoformat(),
+                'data': data or {},
+                '_expires': now + (ttl_seconds or self.ttl_seconds)
+            }
+            queue = self._queues.setdefault(key, deque())
+            queue.append(event)
+            self._owners[event['id']] = key
+            while len(queue) > self.max_events:
+                self._owners.pop(queue.popleft()['id'], None)
+            self._prune(key, now)
+            return _public(event)
+
+    def latest(self, channel, user_id):
+        """Sự kiện chưa ack mới nhất còn hạn, hoặc None"""
+        key = (channel, user_id)
+        with self._lock:
+            self._prune(key, time.monotonic())
+            queue = self._queues.get(key)
+            return _public(queue[-1]) if queue else None
+
+    def pending(self, channel, user_id, after=0):
+        """Các sự kiện chưa ack còn hạn có id > after, theo thứ tự cũ -> mới"""
+        key = (channel, user_id)
+        with self._lock:
+            self._prune(key, time.monotonic())
+            return [_public(e) for e in self._queues.get(key, ()) if e['id'] > after]
+
+    def ack(self, channel, user_id, event_id):
+        """
+        Xác nhận mọi sự kiện có id <= event_id của (kênh, user).
+        Trả về False nếu sự kiện không còn hoặc thuộc (kênh, user) khác.
+        """
+        key = (channel, user_id)
+        with self._lock:
+            if self._owners.get(event_id) != key:
+                return False
+            self._cursors[key] = max(self._cursors.get(key, 0), event_id)
+            self._prune(key, time.monotonic())
+            return True
+
+
+class RedisEventStore:
+    """Cùng giao diện với InMemoryEventStore nhưng lưu trong Redis để dùng chung giữa các worker"""
+
+    def __init__(self, url, ttl_seconds=DEFAULT_TTL_SECONDS, max_events=MAX_EVENTS_PER_USER):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_events = max_events
+
+    def _key(self, channel, user_id):
+        return f'events:{channel}:{user_id}'
+
+    def _cursor(self, key):
+        return int(self.redis.get(f'{key}:cursor') or 0)
+
+    def publish(self, channel, user_id, data=None, ttl_seconds=None):
+        key = self._key(channel, user_id)
+        ttl_seconds = ttl_seconds or self.ttl_seconds
+        event = {
+            'id': self.redis.incr('events:seq'),
+            'timestamp': datetime.now().isoformat(),
+            'data': data or {},
+            '_expires': time.time() + ttl_seconds
+        }
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, json.dumps(event))
+        pipe.ltrim(key, -self.max_events, -1)
+        pipe.expire(key, ttl_seconds)
+        pipe.set(f'events:id:{event["id"]}', key, ex=ttl_seconds)
+        pipe.execute()
+        return _public(event)
+
+    def _live_events(self, key):
+        cursor = self._cursor(key)
+        now = time.time()
+        events = (json.loads(raw) for raw in self.redis.lrange(key, 0, -1))
+        return [e for e in events if e['id'] > cursor and now <= e['_expires']]
+
+    def latest(self, channel, user_id):
+        events = self._live_events(self._key(channel, user_id))
+        return _public(events[-1]) if events else None
+
+    def pending(self, channel, user_id, after=0):
+        return [_public(e) for e in self._live_events(self._key(channel, user_id)) if e['id'] > after]
+
+    def ack(self, channel, user_id, event_id):
+        key = self._key(channel, user_id)
+        if self.redis.get(f'events:id:{event_id}') != key:
+            return False
+        if event_id > self._cursor(key):
+            self.redis.set(f'{key}:cursor', event_id, ex=max(self.redis.ttl(key), self.ttl_seconds))
+        return True
+
+
+def _public(event):
+    return {k: v for k, v in event.items() if not k.startswith('_')}
+
+
+def create_event_store(url=None):
+    """Dùng Redis nếu có EVENT_STORE_URL và thư viện redis, ngược lại dùng bộ nhớ tiến trình"""
+    if url:
+        try:
+            return RedisEventStore(url)
+        except ImportError:
+            logger.warning("EVENT_STORE_URL is set but redis is not installed - using in-memory event store")
+    return InMemoryEventStore()
+
+
+# Singleton dùng chung cho toàn bộ app
+event_store = create_event_store(getattr(Config, 'EVENT_STORE_URL', None))
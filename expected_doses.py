@@ -0,0 +1,135 @@
+from datetime import timedelta
+
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Schedule, DailyCompliance
+
+try:
+    import numpy as np
+except ImportError:  # numpy chỉ bắt buộc trên Pi - server vẫn chạy với bản Python thuần
+    np = None
+
+
+def day_range(start_day, end_day):
+    return [start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+
+
+def weekday_schedule_counts(schedules):
+    """
+    Số lịch chạy vào từng thứ của mỗi user.
+
+    Args:
+        schedules: Danh sách (user_id, days_mask), bit 0 = thứ Hai ... bit 6 = Chủ nhật
+
+    Returns:
+        (user_ids, counts): counts[i][w] = số lịch của user_ids[i] chạy vào thứ w
+    """
+    if np is not None:
+        if not schedules:
+            return [], np.zeros((0, 7), dtype=np.int64)
+        users, masks = np.array(schedules, dtype=np.int64).T
+        user_ids, user_index = np.unique(users, return_inverse=True)
+        bits = (masks[:, None] >> np.arange(7)) & 1
+        counts = np.zeros((len(user_ids), 7), dtype=np.int64)
+        np.add.at(counts, user_index, bits)
+        return user_ids.tolist(), counts
+
+    per_user = {}
+    for user_id, mask in schedules:
+        row = per_user.setdefault(user_id, [0] * 7)
+        for weekday in range(7):
+            row[weekday] += (mask >> weekday) & 1
+    user_ids = sorted(per_user)
+    return user_ids, [per_user[user_id] for user_id in user_ids]
+
+
+def expected_doses(schedules, start_day, end_day):
+    """Tổng số liều theo lịch của mỗi user từ start_day đến end_day: {user_id: số liều}"""
+    user_ids, counts = weekday_schedule_counts(schedules)
+    days_per_weekday = [0] * 7
+    for day in day_range(start_day, end_day):
+        days_per_weekday[day.weekday()] += 1
+
+    if np is not None:
+        totals = counts @ np.array(days_per_weekday, dtype=np.int64)
+        return dict(zip(user_ids, totals.tolist()))
+    return {user_id: sum(c * d for c, d in zip(row, days_per_weekday)) for user_id, row in zip(user_ids, counts)}
+
+
+def expected_doses_by_day(schedules, start_day, end_day):
+    """Số liều theo lịch của mỗi user cho từng ngày: {user_id: [số liều ngày start_day, ...]}"""
+    user_ids, counts = weekday_schedule_counts(schedules)
+    weekdays = [day.weekday() for day in day_range(start_day, end_day)]
+
+    if np is not None:
+        return dict(zip(user_ids, counts[:, weekdays].tolist()))
+    return {user_id: [row[weekday] for weekday in weekdays] for user_id, row in zip(user_ids, counts)}
+
+
+def load_active_schedules(user_ids=None):
+    """(user_id, days_mask) của các lịch active, một truy vấn cho cả hệ thống hoặc các user chỉ định"""
+    query = db.session.query(Schedule.user_id, Schedule.days_mask).filter(Schedule.active == True)
+    if user_ids is not None:
+        query = query.filter(Schedule.user_id.in_(list(user_ids)))
+    return [(user_id, days_mask or 0) for user_id, days_mask in query]
+
+
+def refresh_expected(start_day, end_day, user_ids=None):
+    """
+    Ghi số liều theo lịch vào daily_compliance.expected cho từng ngày trong khoảng,
+    cho mọi user (job hằng đêm) hoặc các user vừa sửa lịch. Không commit.
+
+    Returns:
+        int: Số bản ghi (user, ngày) được thêm hoặc sửa
+    """
+    days = day_range(start_day, end_day)
+    by_day = expected_doses_by_day(load_active_schedules(user_ids), start_day, end_day)
+
+    existing_query = db.session.query(DailyCompliance.user_id, DailyCompliance.day, DailyCompliance.expected).filter(
+        DailyCompliance.day >= start_day,
+        DailyCompliance.day <= end_day
+    )
+    if user_ids is not None:
+        existing_query = existing_query.filter(DailyCompliance.user_id.in_(list(user_ids)))
+    existing = {(user_id, day): expected for user_id, day, expected in existing_query}
+
+    # User không còn lịch active nhưng đã có bản ghi -> expected về 0
+    for user_id in {user_id for user_id, _ in existing} - set(by_day):
+        by_day[user_id] = [0] * len(days)
+
+    # Chỉ ghi các ngày có số liều thay đổi - chạy lại hằng đêm gần như không ghi gì
+    updates = []
+    inserts = []
+    for user_id, counts in by_day.items():
+        for day, expected in zip(days, counts):
+            current = existing.get((user_id, day))
+            if current is not None:
+                if current != expected:
+                    updates.append({'user_id_': user_id, 'day_': day, 'expected': expected})
+            elif expected:
+                inserts.append({'user_id': user_id, 'day': day, 'expected': expected,
+                                'taken': 0, 'late': 0, 'missed': 0})
+
+    table = DailyCompliance.__table__
+    if updates:
+        db.session.execute(
+            table.update().where(
+                table.c.user_id == bindparam('user_id_'),
+                table.c.day == bindparam('day_')
+            ).values(expected=bindparam('expected')),
+            updates
+        )
+    if inserts:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), inserts)
+        except IntegrityError:
+            # Xác nhận uống thuốc vừa tạo bản ghi trong khoảng này - đọc lại và ghi lần nữa
+            return refresh_expected(start_day, end_day, user_ids)
+    return len(updates) + len(inserts)
+
+
+def refresh_expected_week(user_ids, day):
+    """Cập nhật expected từ `day` tới hết tuần (Chủ nhật) sau khi lịch của các user thay đổi"""
+    return refresh_expected(day, day + timedelta(days=6 - day.weekday()), user_ids)
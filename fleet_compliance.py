@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+
+from models import db, User, Medicine, DailyCompliance
+from config import Config
+from reports import compliance_rate
+
+# Số user mỗi trang của bảng tuân thủ toàn hệ thống
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Kết quả mỗi trang được giữ lại chừng này giây (số liệu tổng hợp, không cần tức thời)
+DEFAULT_CACHE_SECONDS = 30
+# Số trang (khoảng ngày, vị trí, cỡ trang) tối đa giữ trong bộ nhớ
+CACHE_MAX_ENTRIES = 200
+
+
+class FleetComplianceCache:
+    """Cache ngắn hạn cho các trang tuân thủ toàn hệ thống, giới hạn kích thước theo LRU"""
+
+    def __init__(self, ttl_seconds=DEFAULT_CACHE_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (page, expires_at)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[0]
+            if entry:
+                del self._entries[key]
+            return None
+
+    def put(self, key, page):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (page, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Singleton dùng chung cho toàn bộ app
+fleet_cache = FleetComplianceCache(getattr(Config, 'FLEET_COMPLIANCE_CACHE_SECONDS', DEFAULT_CACHE_SECONDS))
+
+
+def fleet_compliance_page(start_day, end_day, after_id=0, limit=DEFAULT_PAGE_SIZE):
+    """
+    Tuân thủ của các user (role 'user') từ start_day đến end_day, phân trang theo id
+    (keyset: user có id > after_id). Một câu truy vấn GROUP BY cho cả trang:
+    các user của trang LEFT JOIN daily_compliance theo khóa chính (user_id, day),
+    số thuốc sắp hết là subquery tương quan chỉ chạy cho các dòng của trang.
+
+    Returns:
+        dict: 'users' (mỗi user: expected, taken, late, missed, compliance_rate, low_stock)
+              và 'next_after' (None nếu là trang cuối), kèm 'cached'
+    """
+    key = (start_day, end_day, after_id, limit)
+    page = fleet_cache.get(key)
+    if page is not None:
+        return dict(page, cached=True)
+
+    # Chọn trước các user của trang (keyset theo khóa chính) để phần gộp chỉ chạy trên trang đó
+    page_users = db.session.query(User.id, User.username, User.full_name).filter(
+        User.role == 'user',
+        User.id > after_id
+    ).order_by(User.id).limit(limit + 1).subquery()
+
+    low_stock = sa.select(sa.func.count(Medicine.id)).where(
+        Medicine.user_id == page_users.c.id,
+        Medicine.quantity <= Medicine.min_quantity
+    ).correlate(page_users).scalar_subquery()
+
+    rows = db.session.query(
+        page_users.c.id,
+        page_users.c.username,
+        page_users.c.full_name,
+        sa.func.coalesce(sa.func.sum(DailyCompliance.expected), 0),
+        sa.func.coalesce(sa.func.sum(DailyCompliance.taken), 0),
+        sa.func.coalesce(sa.func.sum(DailyCompliance.late), 0),
+        sa.func.coalesce(sa.func.sum(DailyCompliance.missed), 0),
+        low_stock
+    ).outerjoin(DailyCompliance, sa.and_(
+        DailyCompliance.user_id == page_users.c.id,
+        DailyCompliance.day >= start_day,
+        DailyCompliance.day <= end_day
+    )).group_by(page_users.c.id, page_users.c.username, page_users.c.full_name).order_by(page_users.c.id).all()
+
+    users = [
+        {
+            'user_id': user_id,
+            'username': username,
+            'full_name': full_name or username,
+            'expected': int(expected),
+            'taken': int(taken),
+            'late': int(late),
+            'missed': int(missed),
+            'compliance_rate': compliance_rate(int(taken), int(expected)),
+            'low_stock': low_stock_count
+        }
+        for user_id, username, full_name, expected, taken, late, missed, low_stock_count in rows[:limit]
+    ]
+    page = {
+        'start': start_day.isoformat(),
+        'end': end_day.isoformat(),
+        'users': users,
+        'next_after': users[-1]['user_id'] if len(rows) > limit else None
+    }
+    fleet_cache.put(key, page)
+    return dict(page, cached=False)
@@ -2,9 +2,32 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlalchemy as sa
+import json
 
 db = SQLAlchemy()
 
+# 0=Monday, 6=Sunday (giống datetime.weekday()), bit i của Schedule.days_mask ứng với WEEKDAY_NAMES[i]
+WEEKDAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+def parse_schedule_days(days):
+    """Chuyển cột Schedule.days (chuỗi JSON hoặc list) thành list tên ngày"""
+    try:
+        return json.loads(days) if isinstance(days, str) else (days or [])
+    except (ValueError, TypeError):
+        return []
+
+def days_to_mask(days):
+    """Chuyển danh sách ngày (JSON hoặc list) thành bitmask thứ trong tuần"""
+    mask = 0
+    for day in parse_schedule_days(days):
+        if day in WEEKDAY_NAMES:
+            mask |= 1 << WEEKDAY_NAMES.index(day)
+    return mask
+
+def weekday_bit(day):
+    """Bit của một ngày (date/datetime) trong Schedule.days_mask"""
+    return 1 << day.weekday()
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -103,9 +126,20 @@ class Schedule(db.Model):
     user_id = sa.Column(sa.Integer, sa.ForeignKey('users.id'), nullable=False)
     time = sa.Column(sa.String(5), nullable=False)  # Format: "HH:MM"
     days = sa.Column(sa.String(100), nullable=False)  # JSON string of days
+    days_mask = sa.Column(sa.Integer, nullable=False, default=0)  # bit 0=Monday ... bit 6=Sunday, đồng bộ từ days
     period = sa.Column(sa.String(50))
     active = sa.Column(sa.Boolean, default=True)
     history = db.relationship('MedicineHistory', backref='schedule', lazy=True)
+    
+    __table_args__ = (
+        sa.Index('idx_schedules_user_active_days', 'user_id', 'active', 'days_mask'),
+    )
+
+@sa.event.listens_for(Schedule, 'before_insert')
+@sa.event.listens_for(Schedule, 'before_update')
+def sync_schedule_days_mask(mapper, connection, target):
+    # Giữ days_mask khớp với cột days mỗi khi ghi
+    target.days_mask = days_to_mask(target.days)
 
 class MedicineHistory(db.Model):
     __tablename__ = 'medicine_history'
@@ -115,6 +149,50 @@ class MedicineHistory(db.Model):
     timestamp = sa.Column(sa.DateTime, nullable=False)
     status = sa.Column(sa.String(20), nullable=False)  # taken, missed, late
     notes = sa.Column(sa.Text)
+    # Khóa chống ghi trùng xác nhận: "<schedule_id>:<ngày>" hoặc UUID do thiết bị gửi
+    dedup_key = sa.Column(sa.String(64))
+
+    # Index cho kiểm tra "đã uống hôm nay" theo từng lịch
+    __table_args__ = (
+        sa.Index('idx_history_schedule_time_status', 'schedule_id', 'timestamp', 'status'),
+        sa.Index('uq_history_dedup_key', 'dedup_key', unique=True),
+    )
+
+class DoseInstance(db.Model):
+    """Một liều thuốc cụ thể trong ngày, sinh ra từ Schedule bởi job lúc nửa đêm"""
+    __tablename__ = 'dose_instances'
+    
+    id = sa.Column(sa.Integer, primary_key=True)
+    user_id = sa.Column(sa.Integer, sa.ForeignKey('users.id'), nullable=False)
+    schedule_id = sa.Column(sa.Integer, sa.ForeignKey('schedules.id'), nullable=False)
+    due_at = sa.Column(sa.DateTime, nullable=False)
+    state = sa.Column(sa.String(20), nullable=False, default='pending')  # pending, taken, missed
+    taken_at = sa.Column(sa.DateTime, nullable=True)
+    
+    __table_args__ = (
+        sa.UniqueConstraint('schedule_id', 'due_at', name='dose_instances_unique_schedule_due'),
+        sa.Index('idx_dose_instances_user_due_state', 'user_id', 'due_at', 'state'),
+        # Index phủ cho báo cáo liều bỏ lỡ theo thuốc/khung giờ (reports.py)
+        sa.Index('idx_dose_instances_user_state_due_schedule', 'user_id', 'state', 'due_at', 'schedule_id'),
+    )
+
+class DailyCompliance(db.Model):
+    """Tổng hợp tuân thủ theo user theo ngày, cập nhật cùng transaction với xác nhận và job sinh liều"""
+    __tablename__ = 'daily_compliance'
+    
+    user_id = sa.Column(sa.Integer, sa.ForeignKey('users.id'), primary_key=True, autoincrement=False)
+    day = sa.Column(sa.Date, primary_key=True)
+    expected = sa.Column(sa.Integer, nullable=False, default=0)  # số liều theo lịch trong ngày (expected_doses.py)
+    taken = sa.Column(sa.Integer, nullable=False, default=0)
+    late = sa.Column(sa.Integer, nullable=False, default=0)  # taken sau giờ hẹn quá LATE_AFTER_MINUTES
+    missed = sa.Column(sa.Integer, nullable=False, default=0)
+
+class ContentVersion(db.Model):
+    """Phiên bản nội dung theo user (scope_id = user_id, 0 = trạng thái hệ thống) dùng cho ETag"""
+    __tablename__ = 'content_versions'
+    
+    scope_id = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    version = sa.Column(sa.Integer, nullable=False, default=1)
 
 class NotificationHistory(db.Model):
     __tablename__ = 'notification_history'
@@ -0,0 +1,258 @@
+import threading
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+from content_version import ensure_content_versions, SYSTEM_SCOPE
+
+# Đọc phiên bản trong DB tối đa mỗi chừng này giây để nhận thay đổi từ worker khác
+STAMP_CHECK_SECONDS = 2
+
+_bump_sql = sa.text(
+    "UPDATE content_versions SET version = version + 1 WHERE scope_id = :scope_id"
+)
+_versions_sql = sa.text(
+    "SELECT scope_id, version FROM content_versions WHERE scope_id IN :scope_ids"
+).bindparams(sa.bindparam('scope_ids', expanding=True))
+
+
+def power_scope(user_id=None):
+    """
+    scope_id trong content_versions cho trạng thái nguồn:
+    0 (SYSTEM_SCOPE) cho trạng thái chung, -user_id cho từng hộ gia đình.
+    """
+    return -user_id if user_id else SYSTEM_SCOPE
+
+
+def load_system_status(user_id=None):
+    """
+    Đọc trạng thái nguồn từ DB, trả về (status, created).
+    Hộ chưa có bản ghi riêng dùng trạng thái chung. Trạng thái chung đang tắt (nút tắt khẩn cấp
+    của admin) thì mọi hộ đều tắt, kể cả hộ đã bật bằng nút POWER riêng.
+    Tạo bản ghi chung mặc định nếu chưa có, trong transaction hiện tại (không commit) -
+    khi đảo trạng thái, bản ghi này commit cùng lần bấm và log audit.
+    """
+    if user_id:
+        # user_id = :user_id OR user_id IS NULL -> MySQL dùng index (ref_or_null)
+        # Bản ghi của hộ (nếu có) đứng trước bản ghi chung mới nhất
+        query = sa.text("""
+            SELECT system_enabled, updated_at, user_id FROM system_control
+            WHERE user_id = :user_id OR user_id IS NULL
+            ORDER BY user_id IS NULL, id DESC LIMIT 2
+        """).bindparams(user_id=user_id)
+    else:
+        query = sa.text(
+            "SELECT system_enabled, updated_at, user_id FROM system_control "
+            "WHERE user_id IS NULL ORDER BY id DESC LIMIT 1"
+        )
+    rows = db.session.execute(query.columns(updated_at=sa.DateTime)).fetchall()
+
+    if rows:
+        global_row = next((row for row in rows if row[2] is None), None)
+        if global_row is not None and not global_row[0]:
+            return make_status(global_row[0], global_row[1], None), False
+        result = rows[0]
+        return make_status(result[0], result[1], result[2]), False
+
+    # Nếu chưa có record nào, tạo mặc định
+    db.session.execute("""
+        INSERT INTO system_control (system_enabled, updated_by, notes)
+        VALUES (TRUE, 'auto_init', 'Auto-created system status')
+    """)
+    db.session.execute(_bump_sql, {'scope_id': SYSTEM_SCOPE})
+    return make_status(True, None, None), True
+
+
+def _row_filter(user_id):
+    """Điều kiện WHERE chọn bản ghi của hộ (theo index user_id) hoặc bản ghi chung id = 1"""
+    return 'user_id = :user_id' if user_id else 'id = 1'
+
+
+def make_status(system_enabled, updated_at, user_id=None):
+    return {
+        'system_enabled': bool(system_enabled),
+        'last_updated': updated_at.isoformat() if updated_at else None,
+        'status': 'active' if system_enabled else 'disabled',
+        'scope': 'household' if user_id else 'global'
+    }
+
+
+class PowerStateCache:
+    """
+    Cache trạng thái bật/tắt trong tiến trình (write-through), theo hộ gia đình.
+
+    Worker ghi cập nhật cache khi transaction commit; worker khác nhận thay đổi
+    qua phiên bản trong content_versions (chung + của hộ), kiểm tra tối đa mỗi
+    STAMP_CHECK_SECONDS - các lần đọc còn lại không chạm database.
+    """
+
+    def __init__(self, stamp_check_seconds=STAMP_CHECK_SECONDS):
+        self.stamp_check_seconds = stamp_check_seconds
+        self._lock = threading.Lock()
+        self._entries = {}  # user_id (None = chung) -> [status, stamp, checked_at]
+
+    def get(self, user_id=None):
+        """
+        Trả về (status, stamp) của hộ `user_id` (None = trạng thái chung).
+        stamp là chuỗi phiên bản, đổi mỗi khi trạng thái đổi (dùng cho ETag/cursor).
+        """
+        user_id = user_id or None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and now - entry[2] < self.stamp_check_seconds:
+                return dict(entry[0]), entry[1]
+
+        stamp = self._read_stamp(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[1] == stamp:
+                entry[2] = now
+                return dict(entry[0]), stamp
+
+        status, created = load_system_status(user_id)
+        if created:
+            # Đường đọc: lưu bản ghi chung mặc định vừa tạo
+            db.session.commit()
+            stamp = self._read_stamp(user_id)
+        with self._lock:
+            self._entries[user_id] = [status, stamp, now]
+        return dict(status), stamp
+
+    def set(self, system_enabled, updated_at, updated_by, notes, user_id=None):
+        """
+        Ghi trạng thái nguồn (chung hoặc của hộ `user_id`) trong transaction hiện tại,
+        không commit. Cache được cập nhật khi transaction commit thành công.
+        """
+        self._ensure_versions(user_id)
+
+        params = {
+            'enabled': system_enabled,
+            'updated_at': updated_at,
+            'updated_by': updated_by,
+            'notes': notes,
+            'user_id': user_id
+        }
+        result = db.session.execute(sa.text(f"""
+            UPDATE system_control
+            SET system_enabled = :enabled, updated_at = :updated_at, updated_by = :updated_by, notes = :notes
+            WHERE {_row_filter(user_id)}
+        """), params)
+        if result.rowcount == 0:
+            self._insert_row(params, user_id)
+
+        self._stage(system_enabled, updated_at, user_id)
+
+    def toggle(self, updated_at, updated_by, notes, user_id=None):
+        """
+        Đảo trạng thái nguồn bằng một câu UPDATE nguyên tử (khóa dòng) rồi đọc lại giá trị
+        mới trong cùng transaction. Không commit - ghi log audit rồi commit một lần.
+
+        Returns:
+            bool: Trạng thái mới (system_enabled)
+        """
+        self._ensure_versions(user_id)
+
+        params = {
+            'updated_at': updated_at,
+            'updated_by': updated_by,
+            'notes': notes,
+            'user_id': user_id
+        }
+        toggle_sql = sa.text(f"""
+            UPDATE system_control
+            SET system_enabled = NOT system_enabled, updated_at = :updated_at,
+                updated_by = :updated_by, notes = :notes
+            WHERE {_row_filter(user_id)}
+        """)
+        if db.session.execute(toggle_sql, params).rowcount == 0:
+            # Lần bấm đầu tiên của hộ: tạo bản ghi với giá trị đảo của trạng thái đang kế thừa
+            params['enabled'] = not load_system_status(user_id)[0]['system_enabled']
+            if not self._insert_row(params, user_id):
+                # Request khác vừa tạo bản ghi - đảo trên bản ghi đó
+                db.session.execute(toggle_sql, params)
+
+        new_status = bool(db.session.execute(
+            sa.text(f"SELECT system_enabled FROM system_control WHERE {_row_filter(user_id)}"), params
+        ).scalar())
+        self._stage(new_status, updated_at, user_id)
+        return new_status
+
+    def _insert_row(self, params, user_id):
+        """Tạo bản ghi trạng thái, trả về False nếu bản ghi đã được request khác tạo"""
+        params = dict(params, row_id=1)
+        try:
+            with db.session.begin_nested():
+                if user_id:
+                    db.session.execute(sa.text("""
+                        INSERT INTO system_control (user_id, system_enabled, updated_at, updated_by, notes)
+                        VALUES (:user_id, :enabled, :updated_at, :updated_by, :notes)
+                    """), params)
+                else:
+                    db.session.execute(sa.text("""
+                        INSERT INTO system_control (id, system_enabled, updated_by, notes)
+                        VALUES (:row_id, :enabled, :updated_by, :notes)
+                    """), params)
+            return True
+        except IntegrityError:
+            return False
+
+    def _ensure_versions(self, user_id):
+        """Tạo bản ghi phiên bản nếu chưa có, trong transaction của lần ghi (không commit)"""
+        with self._lock:
+            entry = self._entries.get(user_id or None)
+        if entry is None or '0' in entry[1].split('-'):
+            ensure_content_versions(*([SYSTEM_SCOPE, power_scope(user_id)] if user_id else [SYSTEM_SCOPE]))
+
+    def _stage(self, system_enabled, updated_at, user_id):
+        """Tăng phiên bản trong transaction và chờ commit để cập nhật cache"""
+        db.session.execute(_bump_sql, {'scope_id': power_scope(user_id)})
+        if user_id:
+            # Cache giữ trạng thái hiệu lực - hộ vẫn tắt khi trạng thái chung đang tắt
+            status = load_system_status(user_id)[0]
+        else:
+            status = make_status(system_enabled, updated_at, user_id)
+        pending = db.session.info.setdefault('power_state_pending', {})
+        pending[user_id or None] = (status, self._read_stamp(user_id))
+
+    def _read_stamp(self, user_id):
+        scope_ids = [SYSTEM_SCOPE] if not user_id else [SYSTEM_SCOPE, power_scope(user_id)]
+        versions = dict(db.session.execute(_versions_sql, {'scope_ids': scope_ids}).fetchall())
+        return '-'.join(str(versions.get(scope_id, 0)) for scope_id in scope_ids)
+
+    def _apply(self, pending):
+        now = time.monotonic()
+        with self._lock:
+            for user_id, (status, stamp) in pending.items():
+                self._entries[user_id] = [status, stamp, now]
+                if user_id is None:
+                    # Trạng thái chung đổi - các hộ đang kế thừa phải đọc lại
+                    for key, entry in self._entries.items():
+                        if key is not None:
+                            entry[2] = 0.0
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self._entries.pop(user_id or None, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Singleton dùng chung cho toàn bộ app
+power_state = PowerStateCache()
+
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _apply_pending_power_state(session):
+    pending = session.info.pop('power_state_pending', None)
+    if pending:
+        power_state._apply(pending)
+
+
+@sa.event.listens_for(db.session, 'after_rollback')
+def _discard_pending_power_state(session):
+    session.info.pop('power_state_pending', None)
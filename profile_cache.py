@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+
+from models import db
+from config import Config
+
+# Số payload tối đa giữ trong bộ nhớ (mỗi user có thể có vài biến thể ?fields=/compact)
+DEFAULT_MAX_ENTRIES = 1000
+# Payload hết hạn sau chừng này giây kể cả khi không có ghi nào
+DEFAULT_TTL_SECONDS = 300
+
+
+class ProfileCache:
+    """
+    Cache LRU giới hạn kích thước cho payload /api/user_profile đã serialize,
+    theo (user_id, biến thể). Mỗi bản được lưu kèm ETag (phiên bản nội dung + ngày):
+    ETag hiện tại khác thì coi như miss, nên ghi từ worker khác cũng không trả dữ liệu cũ.
+    Ghi User/Medicine/Schedule/MedicineHistory/DoseInstance trong worker này xóa
+    bản của user ngay khi transaction commit.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (user_id, variant) -> (etag, body, expires_at)
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id, variant, etag):
+        """Payload đã lưu nếu còn hạn và cùng ETag, ngược lại None"""
+        key = (user_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == etag and entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, variant, etag, body):
+        key = (user_id, variant)
+        with self._lock:
+            self._entries[key] = (etag, body, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *user_ids):
+        """Xóa mọi biến thể đã lưu của các user"""
+        user_ids = set(user_ids)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in user_ids]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self, reset=False):
+        with self._lock:
+            lookups = self.hits + self.misses
+            result = {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups * 100, 1) if lookups else 0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+            if reset:
+                self._reset_counters()
+            return result
+
+
+# Singleton dùng chung cho toàn bộ app
+profile_cache = ProfileCache(getattr(Config, 'PROFILE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+                             getattr(Config, 'PROFILE_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _invalidate_committed_users(session):
+    # content_version.py ghi lại các user có phiên bản bị tăng trong transaction
+    user_ids = session.info.pop('content_version_bumped', None)
+    if user_ids:
+        profile_cache.invalidate(*user_ids)
+
+
+@sa.event.listens_for(db.session, 'after_rollback')
+def _discard_bumped_users(session):
+    session.info.pop('content_version_bumped', None)
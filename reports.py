@@ -0,0 +1,126 @@
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+
+from models import db, Medicine, Schedule, DoseInstance
+from compliance_rollup import rollup_rows, sum_rollup, ROLLUP_COLUMNS
+from dose_instances import day_bounds
+
+# Khoảng báo cáo tối đa (ngày)
+MAX_REPORT_DAYS = 366
+
+# Khung giờ trong ngày theo giờ hẹn của lịch: (mã, nhãn, giờ bắt đầu, giờ kết thúc)
+TIME_SLOTS = (
+    ('morning', 'Sáng', 5, 11),
+    ('noon', 'Trưa', 11, 14),
+    ('afternoon', 'Chiều', 14, 18),
+    ('evening', 'Tối', 18, 22),
+    ('night', 'Đêm', 22, 5),
+)
+
+
+def time_slot(hour):
+    for slot, _, start, end in TIME_SLOTS:
+        if (start <= hour < end) if start < end else (hour >= start or hour < end):
+            return slot
+    return TIME_SLOTS[-1][0]
+
+
+def parse_report_range(start, end, today=None):
+    """
+    Đọc khoảng ngày YYYY-MM-DD, mặc định là tuần này (thứ Hai đến hôm nay).
+
+    Returns:
+        (start_day, end_day, None) hoặc (None, None, thông báo lỗi)
+    """
+    today = today or date.today()
+    try:
+        end_day = date.fromisoformat(end) if end else today
+        start_day = date.fromisoformat(start) if start else end_day - timedelta(days=end_day.weekday())
+    except ValueError:
+        return None, None, 'Ngày phải có dạng YYYY-MM-DD'
+
+    if start_day > end_day:
+        return None, None, 'Ngày bắt đầu phải trước ngày kết thúc'
+    if (end_day - start_day).days >= MAX_REPORT_DAYS:
+        return None, None, f'Khoảng báo cáo tối đa {MAX_REPORT_DAYS} ngày'
+    return start_day, end_day, None
+
+
+def build_report(user_id, start_day, end_day):
+    """
+    Báo cáo tuân thủ của user từ start_day đến end_day, tính bằng GROUP BY trong DB:
+    - theo ngày: bảng tổng hợp daily_compliance (một dòng mỗi ngày)
+    - theo thuốc và khung giờ: một truy vấn gộp trên dose_instances (liều taken/missed,
+      index idx_dose_instances_user_state_due_schedule phủ toàn bộ cột cần đọc)
+    """
+    start, _ = day_bounds(start_day)
+    _, end = day_bounds(end_day)
+
+    rows = {row.day: row for row in rollup_rows(user_id, start_day, end_day)}
+    by_day = []
+    day = start_day
+    while day <= end_day:
+        row = rows.get(day)
+        by_day.append(dict({column: getattr(row, column) if row else 0 for column in ROLLUP_COLUMNS},
+                           day=day.isoformat()))
+        day += timedelta(days=1)
+
+    summary = sum_rollup(rows.values())
+    summary['compliance_rate'] = compliance_rate(summary['taken'], summary['expected'])
+
+    # Số liều đã uống / bỏ lỡ theo (thuốc, giờ hẹn) - cùng định nghĩa với bảng tổng hợp ngày:
+    # mỗi liều được tính một lần theo trạng thái của nó, không tính xác nhận lặp hay ngoài lịch
+    hour = sa.func.substr(Schedule.time, 1, 2)
+    grouped = db.session.query(
+        Schedule.medicine_id,
+        hour,
+        sa.func.sum(sa.case((DoseInstance.state == 'taken', 1), else_=0)),
+        sa.func.sum(sa.case((DoseInstance.state == 'missed', 1), else_=0))
+    ).join(
+        Schedule, Schedule.id == DoseInstance.schedule_id
+    ).filter(
+        DoseInstance.user_id == user_id,
+        DoseInstance.state.in_(['taken', 'missed']),
+        DoseInstance.due_at >= start,
+        DoseInstance.due_at <= end
+    ).group_by(Schedule.medicine_id, hour).all()
+
+    by_medicine = {
+        medicine.id: {
+            'medicine_id': medicine.id,
+            'name': medicine.name,
+            'compartment': medicine.compartment_number,
+            'taken': 0,
+            'missed': 0
+        }
+        for medicine in Medicine.query.filter_by(user_id=user_id).order_by(Medicine.compartment_number)
+    }
+    by_slot = {slot: {'slot': slot, 'label': label, 'taken': 0, 'missed': 0} for slot, label, _, _ in TIME_SLOTS}
+
+    for medicine_id, schedule_hour, taken, missed in grouped:
+        counts = {'taken': int(taken or 0), 'missed': int(missed or 0)}
+        targets = [by_medicine[medicine_id]] if medicine_id in by_medicine else []
+        try:
+            targets.append(by_slot[time_slot(int(schedule_hour))])
+        except (TypeError, ValueError):
+            pass
+        for target in targets:
+            for column, count in counts.items():
+                target[column] += count
+
+    for item in list(by_medicine.values()) + list(by_slot.values()):
+        item['compliance_rate'] = compliance_rate(item['taken'], item['taken'] + item['missed'])
+
+    return {
+        'start': start_day.isoformat(),
+        'end': end_day.isoformat(),
+        'summary': summary,
+        'by_day': by_day,
+        'by_medicine': list(by_medicine.values()),
+        'by_slot': list(by_slot.values())
+    }
+
+
+def compliance_rate(taken, expected):
+    return round(taken / expected * 100, 1) if expected else 0
@@ -1,15 +1,78 @@
-from flask import Blueprint, render_template, request, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from flask import flash
 from models import db, Medicine, Schedule, MedicineHistory, User, SystemConfig, AdminLog, NotificationHistory
 from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
 from auth import require_api_key, admin_required, super_admin_required, user_active_required
 from werkzeug.security import generate_password_hash
 from zalo_service import zalo_service
+from schedule_index import schedule_index
+from dose_instances import generate_dose_instances, mark_dose_taken, delete_dose_instances, confirmation_dedup_key
+from sql_metrics import sql_metrics
+from event_store import event_store
+from power_state import power_state
+from content_version import get_content_version, make_etag, not_modified, with_etag
+from event_ingest import ingest_events, MAX_BULK_EVENTS
+from compliance_rollup import rollup_rows, sum_rollup
+from profile_cache import profile_cache
+from reports import build_report, parse_report_range
+from expected_doses import expected_doses, load_active_schedules, refresh_expected_week
+from fleet_compliance import fleet_compliance_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from collections import Counter
+import json
+import math
 import re
+import time
 
 main = Blueprint('main', __name__)
 
+# Server-Sent Events: client tự kết nối lại sau khi stream đóng
+SCHEDULE_STREAM_MAX_SECONDS = 300
+SCHEDULE_STREAM_HEARTBEAT_SECONDS = 15
+
+# So user toi da trong mot request batch cua gateway
+MAX_BATCH_USERS = 500
+
+# Thoi gian ngu toi da goi y cho thiet bi (Retry-After), de lich moi duoc nhan kip thoi
+NEXT_DOSE_MAX_WAIT_SECONDS = 60
+NEXT_DOSE_MAX_WAIT_LIMIT = 3600
+
+# Kenh su kien tam thoi (event_store) cho nut INFO va xac nhan uong thuoc
+INFO_FLAG_CHANNEL = 'info_flag'
+CONFIRMATION_CHANNEL = 'confirmation'
+CONFIRMATION_TTL_SECONDS = 300
+
+# Do dai toi da cua khoa idempotency khi xac nhan uong thuoc (medicine_history.dedup_key)
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+
+# Thu tu cac phan trong cursor cua /api/device_state
+DEVICE_STATE_SECTIONS = ('schedule', 'info_flag', 'confirmation', 'system')
+
+# ?fields= cua /api/user_profile: ten field -> cac khoa cap tren trong payload
+PROFILE_CONTACT_KEYS = ('emergency_contact_name', 'emergency_contact_phone', 'emergency_contact_relationship',
+                        'emergency_contact_zalo_id', 'notification_delay_minutes')
+PROFILE_FIELDS = {
+    'user_info': ('user_info',),
+    'weekly_stats': ('weekly_stats',),
+    'medicines': ('medicines',),
+    'system_info': ('system_info',),
+    'emergency_contact': PROFILE_CONTACT_KEYS,
+}
+PROFILE_FIELDS.update((key, (key,)) for key in PROFILE_CONTACT_KEYS)
+
+# ?compact=1: khoa ngan cho ESP32 (bo dem JSON co dinh)
+PROFILE_SHORT_KEYS = {
+    'user_info': 'u', 'username': 'un', 'full_name': 'fn', 'age': 'ag', 'email': 'em',
+    'phone': 'ph', 'user_type': 'ut',
+    'weekly_stats': 'ws', 'doses_taken': 'dt', 'expected_doses': 'ed', 'compliance_rate': 'cr',
+    'taken_today': 'tt',
+    'medicines': 'm', 'name': 'n', 'compartment': 'c', 'quantity': 'q', 'low_stock': 'ls',
+    'system_info': 'si', 'total_medicines': 'tm', 'low_stock_count': 'lc', 'active_schedules': 'as',
+    'emergency_contact_name': 'ecn', 'emergency_contact_phone': 'ecp', 'emergency_contact_relationship': 'ecr',
+    'emergency_contact_zalo_id': 'ecz', 'notification_delay_minutes': 'nd',
+}
+
 # Super Admin Routes
 @main.route('/admin/system-config', methods=['GET', 'POST'])
 @super_admin_required
@@ -223,6 +286,20 @@ def admin_logs():
     logs = AdminLog.query.order_by(AdminLog.timestamp.desc()).limit(100).all()
     return render_template('admin/logs.html', logs=logs, User=User)
 
+@main.route('/api/metrics', methods=['GET'])
+@admin_required
+def get_sql_metrics():
+    """API cho admin - so cau lenh SQL va thoi gian DB gop theo endpoint"""
+    if request.args.get('reset') == '1':
+        sql_metrics.reset()
+        return jsonify({'success': True, 'endpoints': [], 'profile_cache': profile_cache.stats(reset=True)})
+    
+    return jsonify({
+        'success': True,
+        'endpoints': sql_metrics.snapshot(),
+        'profile_cache': profile_cache.stats()
+    })
+
 # Admin Routes
 @main.route('/admin/users')
 @admin_required
@@ -257,6 +334,41 @@ def manage_schedules():
     users = User.query.filter_by(role='user').all()
     return render_template('admin/manage_schedules.html', users=users)
 
+@main.route('/admin/compliance')
+@admin_required
+def fleet_compliance():
+    """Bảng tuân thủ của mọi user theo khoảng ngày (?start=&end=), phân trang bằng ?after=<user_id>"""
+    start_day, end_day, error = parse_report_range(request.args.get('start'), request.args.get('end'))
+    if error:
+        flash(error, 'error')
+        start_day, end_day, _ = parse_report_range(None, None)
+    after_id, limit, _ = fleet_page_args()
+    page = fleet_compliance_page(start_day, end_day, after_id or 0, limit or DEFAULT_PAGE_SIZE)
+    return render_template('admin/compliance.html', page=page, limit=limit or DEFAULT_PAGE_SIZE)
+
+@main.route('/api/fleet_compliance', methods=['GET'])
+@admin_required
+def get_fleet_compliance():
+    """API cho admin - tuân thủ, số liều bỏ lỡ và số thuốc sắp hết của mọi user (?start=&end=&after=&limit=)"""
+    start_day, end_day, error = parse_report_range(request.args.get('start'), request.args.get('end'))
+    if error:
+        return jsonify({'error': error}), 400
+    after_id, limit, error = fleet_page_args()
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify(fleet_compliance_page(start_day, end_day, after_id, limit))
+
+def fleet_page_args():
+    """Đọc ?after= và ?limit= của bảng tuân thủ, trả về (after_id, limit, lỗi)"""
+    try:
+        after_id = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None, None, 'after and limit must be integers'
+    if after_id < 0 or not 1 <= limit <= MAX_PAGE_SIZE:
+        return None, None, f'limit must be 1-{MAX_PAGE_SIZE} and after must not be negative'
+    return after_id, limit, None
+
 @main.route('/admin/schedules/<int:user_id>')
 @admin_required
 def user_schedules(user_id):
@@ -305,8 +417,11 @@ def delete_schedule(schedule_id):
         print("Unauthorized access attempt.")
         return jsonify({'error': 'Unauthorized access'}), 403
 
+    delete_dose_instances(schedule.id)
     db.session.delete(schedule)
+    refresh_expected_week([current_user.id], datetime.now().date())
     db.session.commit()
+    schedule_index.remove(schedule_id)
     print("Schedule deleted successfully.")
     flash('Schedule deleted successfully.', 'success')
     return redirect(url_for('main.index'))
@@ -361,7 +476,6 @@ def add_medicine():
 @login_required
 def add_schedule():
     if request.method == 'POST':
-        import json
         days_list = request.form.getlist('days[]')
         new_schedule = Schedule(
             medicine_id=int(request.form['medicine_id']),
@@ -372,7 +486,10 @@ def add_schedule():
             active=True
         )
         db.session.add(new_schedule)
+        refresh_expected_week([current_user.id], datetime.now().date())
         db.session.commit()
+        schedule_index.add(new_schedule)
+        generate_dose_instances(datetime.now().date(), [new_schedule])
         return redirect(url_for('main.index'))
     medicines = Medicine.query.filter_by(user_id=current_user.id).all()
     return render_template('add_schedule.html', medicines=medicines)
@@ -380,8 +497,22 @@ def add_schedule():
 @main.route('/reports')
 @login_required
 def reports():
-    weekly_stats = calculate_weekly_stats(current_user.id)
-    return render_template('reports.html', stats=weekly_stats)
+    """Báo cáo tuân thủ theo khoảng ngày (?start=&end=, mặc định tuần này)"""
+    start_day, end_day, error = parse_report_range(request.args.get('start'), request.args.get('end'))
+    if error:
+        flash(error, 'error')
+        start_day, end_day, _ = parse_report_range(None, None)
+    report = build_report(current_user.id, start_day, end_day)
+    return render_template('reports.html', report=report)
+
+@main.route('/api/reports/<int:user_id>', methods=['GET'])
+@require_api_key
+def get_report(user_id):
+    """API báo cáo tuân thủ theo ngày, theo thuốc và theo khung giờ (?start=&end=)"""
+    start_day, end_day, error = parse_report_range(request.args.get('start'), request.args.get('end'))
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify(build_report(user_id, start_day, end_day))
 
 @main.route('/api/check_schedule', methods=['GET'])
 @login_required
@@ -394,8 +525,99 @@ def check_schedule():
 @require_api_key
 def check_schedule_by_user(user_id):
     # API cho Raspberry Pi - chi can API key, khong can dang nhap
-    schedules = get_current_schedules(user_id)
-    return jsonify(schedules)
+    # ETag tinh truoc truy van - poll lap lai trong cung phut tra 304
+    current_time = datetime.now()
+    etag = schedule_etag(user_id, current_time)
+    return not_modified(etag) or with_etag(jsonify(get_current_schedules(user_id, current_time)), etag)
+
+@main.route('/api/check_schedule_batch', methods=['POST'])
+@require_api_key
+def check_schedule_batch():
+    """API cho gateway phuc vu nhieu nguoi - kiem tra lich cua nhieu user trong mot request"""
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get('user_ids')
+    
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({'error': 'user_ids must be a non-empty list'}), 400
+    if len(user_ids) > MAX_BATCH_USERS:
+        return jsonify({'error': f'Too many user_ids (max {MAX_BATCH_USERS})'}), 400
+    try:
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'user_ids must be integers'}), 400
+    
+    schedules = get_current_schedules_many(user_ids)
+    return jsonify({
+        'schedules': {str(user_id): schedules.get(user_id, []) for user_id in user_ids}
+    })
+
+@main.route('/api/next_dose/<int:user_id>', methods=['GET'])
+@require_api_key
+def get_next_dose(user_id):
+    """API cho Pi/ESP32 - tra ve thoi diem lieu tiep theo de thiet bi ngu thay vi poll"""
+    now = datetime.now()
+    max_wait = request.args.get('max_wait', NEXT_DOSE_MAX_WAIT_SECONDS, type=int)
+    max_wait = min(max(max_wait, 1), NEXT_DOSE_MAX_WAIT_LIMIT)
+    
+    next_due, schedule_ids = schedule_index.next_due(user_id, now)
+    if next_due is None:
+        seconds_until = None
+        retry_after = max_wait
+    else:
+        # 0 nghia la lieu dang den han, thiet bi nen goi check_schedule_by_user ngay
+        seconds_until = max(0, math.ceil((next_due - now).total_seconds()))
+        retry_after = min(seconds_until, max_wait)
+    
+    response = jsonify({
+        'next_due_at': next_due.isoformat() if next_due else None,
+        'seconds_until': seconds_until,
+        'schedule_ids': schedule_ids,
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@main.route('/api/schedule_stream/<int:user_id>', methods=['GET'])
+@require_api_key
+def schedule_stream(user_id):
+    """API Server-Sent Events cho Pi/ESP32 - giu ket noi va chi day su kien khi co lieu den han"""
+    def generate():
+        started = time.monotonic()
+        last_sent = started
+        pushed = set()  # (schedule_id, phut hen gio) da day
+        yield 'retry: 3000\n\n'
+        
+        while time.monotonic() - started < SCHEDULE_STREAM_MAX_SECONDS:
+            current_time = datetime.now()
+            minute_start = current_time.replace(second=0, microsecond=0)
+            
+            schedules = [
+                s for s in get_current_schedules(user_id)
+                if (s['schedule_id'], minute_start) not in pushed
+            ]
+            # Tra ket noi DB ve pool trong luc cho
+            db.session.remove()
+            
+            if schedules:
+                pushed.update((s['schedule_id'], minute_start) for s in schedules)
+                yield f'event: schedule\ndata: {json.dumps(schedules)}\n\n'
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= SCHEDULE_STREAM_HEARTBEAT_SECONDS:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            
+            # Trong 10 giay dau cua phut thi kiem tra moi giay, ngoai ra ngu den phut tiep theo
+            if (current_time - minute_start).total_seconds() <= 10:
+                wait = 1
+            else:
+                wait = 60 - (current_time - minute_start).total_seconds()
+            wait = min(wait, SCHEDULE_STREAM_HEARTBEAT_SECONDS - (time.monotonic() - last_sent))
+            time.sleep(max(wait, 0.05))
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @main.route('/api/confirm_medicine', methods=['POST'])
 @login_required
@@ -407,20 +629,28 @@ def confirm_medicine():
     if schedule.user_id != current_user.id:
         return jsonify({'error': 'Không có quyền truy cập'}), 403
     
-    history_entry = MedicineHistory(
-        schedule_id=schedule_id,
-        timestamp=datetime.now(),
-        status='taken'
-    )
-    db.session.add(history_entry)
+    taken_at = datetime.now()
+    idempotency_key, error = confirmation_key(schedule, taken_at)
+    if error:
+        return error
+
+    history_entry, created = record_confirmation(schedule, idempotency_key, taken_at)
+    if history_entry is None:
+        return jsonify({'error': 'Idempotency key đã dùng cho lịch khác'}), 409
     db.session.commit()
-    
-    return jsonify({'success': True})
+
+    return jsonify({
+        'success': True,
+        'duplicate': not created,
+        'history_id': history_entry.id,
+        'taken_at': history_entry.timestamp.isoformat()
+    })
 
 @main.route('/api/confirm_medicine_by_user', methods=['POST'])
 @require_api_key
 def confirm_medicine_by_user():
-    # API cho Raspberry Pi - chi can API key, khong can dang nhap
+    # API cho Raspberry Pi va ESP32 - chi can API key, khong can dang nhap
+    # Pi gui them "source": "pi_button" de ESP32 duoc bao qua kenh confirmation
     schedule_id = request.json.get('schedule_id')
     user_id = request.json.get('user_id')
     
@@ -430,15 +660,151 @@ def confirm_medicine_by_user():
     if schedule.user_id != user_id:
         return jsonify({'error': 'Không có quyền truy cập'}), 403
     
-    history_entry = MedicineHistory(
-        schedule_id=schedule_id,
-        timestamp=datetime.now(),
-        status='taken'
-    )
-    db.session.add(history_entry)
+    taken_at = datetime.now()
+    idempotency_key, error = confirmation_key(schedule, taken_at)
+    if error:
+        return error
+
+    history_entry, created = record_confirmation(schedule, idempotency_key, taken_at)
+    if history_entry is None:
+        return jsonify({'error': 'Idempotency key đã dùng cho lịch khác'}), 409
     db.session.commit()
-    
-    return jsonify({'success': True})
+
+    # ESP32 cũng xác nhận qua API này - chỉ báo cho ESP32 khi nút bấm nằm trên Pi,
+    # để ESP32 không nhận lại xác nhận của chính nó rồi tắt nhầm cảnh báo khác
+    confirmation = None
+    if request.json.get('source') == 'pi_button':
+        if created:
+            # Báo cho ESP32 qua kênh confirmation (không ghi thêm bản ghi history)
+            confirmation = publish_confirmation(schedule, history_entry.timestamp, 'pi_button')
+        else:
+            # Pi gửi lại (VD: mất phản hồi) - trả về sự kiện đã đẩy lần trước nếu ESP32 chưa xóa
+            confirmation = pending_confirmation(schedule)
+
+    return jsonify({
+        'success': True,
+        'duplicate': not created,
+        'history_id': history_entry.id,
+        'taken_at': history_entry.timestamp.isoformat(),
+        'confirmation_id': confirmation['id'] if confirmation else None
+    })
+
+def confirmation_key(schedule, taken_at):
+    """
+    Khóa idempotency của một lần xác nhận: header Idempotency-Key hoặc trường
+    idempotency_key (VD: UUID do thiết bị sinh). Mặc định là (schedule_id, ngày uống)
+    nên mỗi lịch chỉ được ghi một lần mỗi ngày, dù Pi gửi lại hay web bấm thêm.
+
+    Returns:
+        (key, None) hoặc (None, response lỗi 400)
+    """
+    key = request.headers.get('Idempotency-Key') or request.json.get('idempotency_key')
+    if not key:
+        return confirmation_dedup_key(schedule.id, taken_at), None
+
+    key = str(key).strip()
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return None, (jsonify({'error': f'idempotency_key phải có 1-{MAX_IDEMPOTENCY_KEY_LENGTH} ký tự'}), 400)
+    return key, None
+
+def record_confirmation(schedule, idempotency_key, taken_at):
+    """
+    Ghi lịch sử uống thuốc và cập nhật liều trong ngày, một lần cho mỗi khóa.
+    Không commit. Unique index trên dedup_key chặn cả hai request gửi đồng thời.
+
+    Returns:
+        (history_entry, created): created = False nếu khóa đã được ghi trước đó;
+        history_entry = None nếu khóa đã dùng cho lịch khác
+    """
+    existing = MedicineHistory.query.filter_by(dedup_key=idempotency_key).first()
+    if existing is None:
+        history_entry = MedicineHistory(
+            schedule_id=schedule.id,
+            timestamp=taken_at,
+            status='taken',
+            dedup_key=idempotency_key
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(history_entry)
+        except IntegrityError:
+            # Request khác cùng khóa vừa ghi xong
+            existing = MedicineHistory.query.filter_by(dedup_key=idempotency_key).first()
+        else:
+            mark_dose_taken(schedule, taken_at)
+            return history_entry, True
+
+    if existing is None or existing.schedule_id != schedule.id:
+        return None, False
+    return existing, False
+
+def pending_confirmation(schedule):
+    """Sự kiện confirmation của lịch còn chờ ESP32 hiển thị (nếu có)"""
+    for event in event_store.pending(CONFIRMATION_CHANNEL, schedule.user_id):
+        if event['data'].get('schedule_id') == schedule.id:
+            return event
+    return None
+
+def publish_confirmation(schedule, taken_at, source):
+    """Đẩy sự kiện xác nhận uống thuốc vào hàng đợi confirmation của user"""
+    medicine = schedule.medicine
+    return event_store.publish(CONFIRMATION_CHANNEL, schedule.user_id, {
+        'schedule_id': schedule.id,
+        'medicine_name': medicine.name,
+        'compartment_number': medicine.compartment_number,
+        'taken_at': taken_at.isoformat(),
+        'source': source
+    }, ttl_seconds=CONFIRMATION_TTL_SECONDS)
+
+@main.route('/api/events/bulk', methods=['POST'])
+@require_api_key
+def ingest_event_batch():
+    """
+    Nhận một lô sự kiện thiết bị lưu đệm khi mất Wi-Fi, ghi trong một transaction.
+
+    Body: {"user_id": 15, "events": [
+        {"type": "confirmation", "schedule_id": 5, "occurred_at": "2025-07-31T08:02:10"},
+        {"type": "notification_log", "schedule_id": 5, "delivery_status": "sent", ...},
+        {"type": "power_press", "new_status": false, "occurred_at": "..."},
+        {"type": "info_press"}
+    ]}
+    Trả về kết quả cho từng sự kiện theo thứ tự gửi lên. Confirmation dùng khóa
+    idempotency như /api/confirm_medicine_by_user nên gửi lại cả lô không ghi trùng.
+    """
+    data = request.get_json(silent=True) or {}
+    events = data.get('events')
+
+    if not isinstance(events, list) or not events:
+        return jsonify({'error': 'events must be a non-empty list'}), 400
+    if len(events) > MAX_BULK_EVENTS:
+        return jsonify({'error': f'Too many events (max {MAX_BULK_EVENTS})'}), 400
+
+    try:
+        results, followups = ingest_events(events, data.get('user_id'), now=datetime.now())
+        db.session.commit()
+    except IntegrityError:
+        # Request khác vừa ghi cùng khóa confirmation - gửi lại lô sẽ được đánh dấu duplicate
+        db.session.rollback()
+        return jsonify({'error': 'Conflicting concurrent upload, retry the batch'}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Failed to ingest events: {str(e)}'}), 500
+
+    # Chỉ báo cho ESP32 các sự kiện còn mới - sự kiện cũ trong lô chỉ cần lưu lịch sử
+    now = datetime.now()
+    for event, result, schedule in followups:
+        age = (now - event['occurred_at']).total_seconds()
+        if event['type'] == 'confirmation' and age < CONFIRMATION_TTL_SECONDS:
+            confirmation = publish_confirmation(schedule, event['occurred_at'], 'pi_button')
+            result['confirmation_id'] = confirmation['id']
+        elif event['type'] == 'info_press' and age < event_store.ttl_seconds:
+            result['flag_id'] = event_store.publish(INFO_FLAG_CHANNEL, event['user_id'], {'info_flag': True})['id']
+
+    return jsonify({
+        'success': True,
+        'results': results,
+        'counts': dict(Counter(result['status'] for result in results))
+    })
 
 @main.route('/api/trigger_info_display', methods=['POST'])
 @require_api_key
@@ -449,59 +815,54 @@ def trigger_info_display():
 
     if not user_id or not info_flag:
         return jsonify({'error': 'Missing required fields'}), 400
-
-    # Log the INFO flag for ESP32 to detect
     try:
-        log_entry = AdminLog(
-            admin_id=user_id,
-            action='info_flag',
-            target_type='user',
-            target_id=user_id,
-            details='INFO button pressed',
-            timestamp=datetime.now()
-        )
-        db.session.add(log_entry)
-        db.session.commit()
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid user_id'}), 400
 
-        return jsonify({'success': True, 'message': 'INFO flag logged successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    # Đẩy INFO flag vào kho sự kiện tạm thời cho ESP32 đọc (tự hết hạn sau 2 phút)
+    event = event_store.publish(INFO_FLAG_CHANNEL, user_id, {'info_flag': info_flag})
+
+    return jsonify({'success': True, 'message': 'INFO flag logged successfully', 'flag_id': event['id']})
 
 @main.route('/api/check_info_flag/<int:user_id>', methods=['GET'])
 @require_api_key
 def check_info_flag(user_id):
     """API endpoint for ESP32 to check if INFO button was pressed"""
-    # Tìm INFO flag gần nhất trong vòng 1 phút
-    from datetime import timedelta
-    recent_time = datetime.now() - timedelta(minutes=2)
-    
-    recent_info_flag = AdminLog.query.filter(
-        AdminLog.target_id == user_id,
-        AdminLog.action == 'info_flag',
-        AdminLog.timestamp >= recent_time
-    ).order_by(AdminLog.timestamp.desc()).first()
-    
+    return jsonify(info_flag_state(user_id))
+
+def info_flag_state(user_id):
+    """INFO flag gần nhất chưa được hiển thị (trong vòng 2 phút)"""
+    recent_info_flag = event_store.latest(INFO_FLAG_CHANNEL, user_id)
+
     if recent_info_flag:
-        return jsonify({
+        return {
             'info_flag_detected': True,
-            'timestamp': recent_info_flag.timestamp.isoformat(),
-            'flag_id': recent_info_flag.id
-        })
-    else:
-        return jsonify({'info_flag_detected': False})
+            'timestamp': recent_info_flag['timestamp'],
+            'flag_id': recent_info_flag['id']
+        }
+    return {'info_flag_detected': False}
 
 @main.route('/api/clear_info_flag/<int:flag_id>', methods=['POST'])
 @require_api_key
 def clear_info_flag(flag_id):
-    """API để ESP32 xóa INFO flag sau khi đã hiển thị"""
-    flag = AdminLog.query.get_or_404(flag_id)
-    # Đổi action để không còn được detect nữa
-    flag.action = 'info_flag_displayed'
-    db.session.commit()
-    
+    """API để ESP32 xóa INFO flag sau khi đã hiển thị. Body: {"user_id": n} - chỉ xóa được flag của hộ đó"""
+    user_id = (request.get_json(silent=True) or {}).get('user_id')
+    if not isinstance(user_id, int):
+        return jsonify({'error': 'user_id is required'}), 400
+
+    if not event_store.ack(INFO_FLAG_CHANNEL, user_id, flag_id):
+        return jsonify({'error': 'INFO flag not found or expired'}), 404
+
     return jsonify({'success': True})
 
-    """API đặc biệt để Pi button gửi flag cho ESP32 sync"""
+@main.route('/api/confirm_pi_button', methods=['POST'])
+@require_api_key
+def confirm_pi_button():
+    """
+    API đặc biệt để Pi button gửi flag cho ESP32 sync (giữ cho firmware Pi cũ).
+    confirm_medicine_by_user đã tự đẩy sự kiện confirmation nên API này không ghi history.
+    """
     schedule_id = request.json.get('schedule_id')
     user_id = request.json.get('user_id')
     
@@ -511,17 +872,13 @@ def clear_info_flag(flag_id):
     if schedule.user_id != user_id:
         return jsonify({'error': 'Không có quyền truy cập'}), 403
     
-    # Tạo history entry với flag đặc biệt cho Pi button
-    pi_history_entry = MedicineHistory(
-        schedule_id=schedule_id,
-        timestamp=datetime.now(),
-        status='taken',
-        notes='pi_button_confirmed'  # Flag đặc biệt để ESP32 detect
-    )
-    db.session.add(pi_history_entry)
-    db.session.commit()
-    
-    return jsonify({'success': True, 'pi_confirmation_id': pi_history_entry.id})
+    # Không tạo sự kiện trùng nếu confirm_medicine_by_user vừa đẩy cho lịch này
+    confirmation = pending_confirmation(schedule)
+    if confirmation:
+        return jsonify({'success': True, 'pi_confirmation_id': confirmation['id']})
+
+    confirmation = publish_confirmation(schedule, datetime.now(), 'pi_button')
+    return jsonify({'success': True, 'pi_confirmation_id': confirmation['id']})
 
 @main.route('/api/medicine/<int:medicine_id>', methods=['GET'])
 @require_api_key
@@ -577,54 +934,35 @@ def verify_compartment():
 @main.route('/api/user_profile/<int:user_id>', methods=['GET'])
 @require_api_key
 def get_user_profile(user_id):
-    """API endpoint để ESP32 lấy user profile + thống kê tuần"""
-    user = User.query.get_or_404(user_id)
-    
-    # Tính thống kê tuần này
-    from datetime import timedelta
+    """
+    API endpoint để ESP32 lấy user profile + thống kê tuần.
+    ?fields=user_info,weekly_stats chỉ trả (và chỉ truy vấn) các phần được yêu cầu;
+    ?compact=1 dùng khóa ngắn (PROFILE_SHORT_KEYS) cho bộ đệm JSON nhỏ của MCU.
+    """
+    fields, error = requested_fields(PROFILE_FIELDS)
+    if error:
+        return error
+    compact = request.args.get('compact', type=int) == 1
+    keys = {key for field in fields for key in PROFILE_FIELDS[field]}
     now = datetime.now()
-    week_start = now - timedelta(days=now.weekday())
-    week_end = week_start + timedelta(days=6)
-    
-    # Lấy lịch sử uống thuốc tuần này
-    week_history = MedicineHistory.query.join(Schedule).filter(
-        Schedule.user_id == user_id,
-        MedicineHistory.timestamp >= week_start,
-        MedicineHistory.timestamp <= week_end,
-        MedicineHistory.status == 'taken'
-    ).count()
     
-    # Tổng số lịch thuốc active
-    total_schedules = Schedule.query.filter_by(user_id=user_id, active=True).count()
+    # ETag theo phiên bản nội dung của user + ngày (thống kê thay đổi theo ngày/tuần) + dạng payload
+    etag = make_etag('profile', user_id, get_content_version(user_id), now.date(), ','.join(sorted(keys)), compact)
+    cached = not_modified(etag)
+    if cached:
+        return cached
     
-    # Compliance rate tuần này
-    expected_doses_week = total_schedules * 7  # 7 ngày
-    compliance_rate = (week_history / expected_doses_week * 100) if expected_doses_week > 0 else 0
-    
-    # Thuốc hôm nay
-    today_start = datetime.combine(now.date(), datetime.min.time())
-    today_end = datetime.combine(now.date(), datetime.max.time())
-    
-    taken_today = MedicineHistory.query.join(Schedule).filter(
-        Schedule.user_id == user_id,
-        MedicineHistory.timestamp >= today_start,
-        MedicineHistory.timestamp <= today_end,
-        MedicineHistory.status == 'taken'
-    ).count()
+    # Payload đã dựng sẵn cho đúng phiên bản này (Pi gọi mỗi lần nhắc, ESP32 mỗi lần mở INFO)
+    variant = (','.join(sorted(keys)), compact)
+    body = profile_cache.get(user_id, variant, etag)
+    if body is not None:
+        return with_etag(Response(body, mimetype='application/json'), etag)
     
-    # Lấy danh sách thuốc trong các ngăn
-    medicines = Medicine.query.filter_by(user_id=user_id).all()
-    medicine_list = []
-    for med in medicines:
-        medicine_list.append({
-            'name': med.name,
-            'compartment': med.compartment_number,
-            'quantity': med.quantity,
-            'low_stock': med.quantity <= med.min_quantity
-        })
+    user = User.query.get_or_404(user_id)
+    profile = {}
     
-    return jsonify({
-        'user_info': {
+    if 'user_info' in keys:
+        profile['user_info'] = {
             'id': user.id,
             'username': user.username,
             'full_name': user.full_name or user.username,
@@ -632,154 +970,227 @@ def get_user_profile(user_id):
             'email': user.email,
             'phone': user.phone or 'N/A',
             'user_type': user.user_type or 'patient'
-        },
-        'weekly_stats': {
+        }
+    
+    # Lịch active dùng chung cho weekly_stats và system_info
+    if 'weekly_stats' in keys or 'system_info' in keys:
+        active_schedules = load_active_schedules([user_id])
+        total_schedules = len(active_schedules)
+    
+    if 'weekly_stats' in keys:
+        # Thống kê tuần này từ bảng tổng hợp ngày (tối đa 7 dòng)
+        week_start = now.date() - timedelta(days=now.weekday())
+        week_rows = rollup_rows(user_id, week_start, week_start + timedelta(days=6))
+        week_history = sum_rollup(week_rows)['taken']
+        taken_today = sum(row.taken for row in week_rows if row.day == now.date())
+        
+        # Compliance rate tuần này - số liều theo lịch từng thứ của các lịch đang active
+        expected_doses_week = expected_doses(active_schedules, week_start, week_start + timedelta(days=6)).get(user_id, 0)
+        compliance_rate = (week_history / expected_doses_week * 100) if expected_doses_week > 0 else 0
+        
+        profile['weekly_stats'] = {
             'doses_taken': week_history,
             'expected_doses': expected_doses_week,
             'compliance_rate': round(compliance_rate, 1),
             'taken_today': taken_today
-        },
-        'medicines': medicine_list,
-        'system_info': {
-            'total_medicines': len(medicine_list),
-            'low_stock_count': sum(1 for m in medicine_list if m['low_stock']),
-            'active_schedules': total_schedules
-        },
-        # Emergency contact info for notification system
+        }
+    
+    if 'medicines' in keys or 'system_info' in keys:
+        # Lấy danh sách thuốc trong các ngăn
+        medicine_list = []
+        for med in Medicine.query.filter_by(user_id=user_id).all():
+            medicine_list.append({
+                'name': med.name,
+                'compartment': med.compartment_number,
+                'quantity': med.quantity,
+                'low_stock': med.quantity <= med.min_quantity
+            })
+        if 'medicines' in keys:
+            profile['medicines'] = medicine_list
+        if 'system_info' in keys:
+            profile['system_info'] = {
+                'total_medicines': len(medicine_list),
+                'low_stock_count': sum(1 for m in medicine_list if m['low_stock']),
+                'active_schedules': total_schedules
+            }
+    
+    # Emergency contact info for notification system
+    contact = {
         'emergency_contact_name': user.emergency_contact_name,
         'emergency_contact_phone': user.emergency_contact_phone,
         'emergency_contact_relationship': user.emergency_contact_relationship,
         'emergency_contact_zalo_id': user.emergency_contact_zalo_id,
         'notification_delay_minutes': user.notification_delay_minutes or 15
-    })
-
-def get_current_schedules(user_id):
-    current_time = datetime.now()
-    current_weekday = current_time.weekday()  # 0=Monday, 6=Sunday
-    weekday_mapping = {
-        0: 'monday',
-        1: 'tuesday',
-        2: 'wednesday',
-        3: 'thursday',
-        4: 'friday',
-        5: 'saturday',
-        6: 'sunday'
     }
-    current_day = weekday_mapping[current_weekday]
+    profile.update((key, value) for key, value in contact.items() if key in keys)
     
-    today_schedules = Schedule.query.filter_by(
-        user_id=user_id,
-        active=True
-    ).all()
+    if compact:
+        profile = shorten_keys(profile, PROFILE_SHORT_KEYS)
+    response = jsonify(profile)
+    profile_cache.put(user_id, variant, etag, response.get_data())
+    return with_etag(response, etag)
+
+def requested_fields(allowed):
+    """
+    Đọc ?fields=a,b (projection). Không có ?fields= thì trả về mọi field.
+
+    Returns:
+        (tập field, None) hoặc (None, response lỗi 400)
+    """
+    value = request.args.get('fields')
+    if not value:
+        return set(allowed), None
     
-    current_schedules = []
-    for schedule in today_schedules:
-        # Kiem tra xem hom nay co trong danh sach ngay khong
-        import json
-        try:
-            schedule_days = json.loads(schedule.days) if isinstance(schedule.days, str) else schedule.days
-        except:
-            schedule_days = []
-            
-        if current_day not in schedule_days:
-            continue
-            
-        schedule_time = datetime.strptime(schedule.time, '%H:%M').time()
-        schedule_datetime = datetime.combine(current_time.date(), schedule_time)
-        
-        # Kiem tra xem da uong chua trong ngay hom nay
-        today_start = datetime.combine(current_time.date(), datetime.min.time())
-        today_end = datetime.combine(current_time.date(), datetime.max.time())
-        
-        existing_history = MedicineHistory.query.filter(
-            MedicineHistory.schedule_id == schedule.id,
-            MedicineHistory.timestamp >= today_start,
-            MedicineHistory.timestamp <= today_end,
-            MedicineHistory.status == 'taken'
-        ).first()
-        
-        # Neu da uong roi thi khong hien thi nua
-        if existing_history:
-            continue
-        
-        # FIXED TIMING LOGIC: Chi kich hoat tu dung gio den 2 phut sau (KHONG kich hoat som)
-        time_diff = (current_time - schedule_datetime).total_seconds()
-        if 0 <= time_diff <= 120:  # Tu dung gio (0s) den 2 phut sau (120s)
-            # Kiem tra xem co phai trong khoang thoi gian dau tien cua schedule khong
-            # De tranh kich hoat lien tuc moi 5 giay
-            if time_diff <= 10:  # Chi return trong 10 giay dau
-                medicine = Medicine.query.get(schedule.medicine_id)
-                if medicine:
-                    current_schedules.append({
-                        'schedule_id': schedule.id,
-                        'medicine_id': medicine.id,
-                        'medicine_name': medicine.name,
-                        'compartment_number': medicine.compartment_number,
-                        'time': schedule.time,
-                        'dosage': medicine.dosage,
-                        'notes': medicine.notes,
-                        'time_diff': time_diff  # Debug info
-                    })
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = fields - set(allowed)
+    if unknown or not fields:
+        return None, (jsonify({
+            'error': f"Unknown fields: {', '.join(sorted(unknown)) or value}",
+            'allowed_fields': list(allowed)
+        }), 400)
+    return fields, None
+
+def shorten_keys(value, short_keys):
+    """Đổi tên khóa (đệ quy) theo bảng khóa ngắn, khóa không có trong bảng giữ nguyên"""
+    if isinstance(value, dict):
+        return {short_keys.get(key, key): shorten_keys(item, short_keys) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shorten_keys(item, short_keys) for item in value]
+    return value
+
+def get_current_schedules(user_id, current_time=None):
+    return get_current_schedules_many([user_id], current_time).get(user_id, [])
+
+def due_window_entries(user_ids, current_time):
+    """Cac lich co gio hen dung phut hien tai, chi trong 10 giay dau cua phut: {user_id: [(schedule_id, entry)]}"""
+    # FIXED TIMING LOGIC: Chi kich hoat trong 10 giay dau cua phut hen gio
+    # De tranh kich hoat lien tuc moi 5 giay
+    minute_start = current_time.replace(second=0, microsecond=0)
+    if (current_time - minute_start).total_seconds() > 10:
+        return {}
     
+    # Tra chi muc (thu, phut trong ngay) thay vi quet bang va parse JSON
+    return schedule_index.due_entries_many(user_ids, current_time)
+
+def schedule_etag(user_id, current_time):
+    """
+    ETag cua lich den han, tinh khong can truy van lieu: lich den han trong phut nay (chi muc
+    trong bo nho) + phien ban noi dung cua user (doi khi xac nhan/sua lich). Khong dua
+    time_diff vao de ETag khong doi moi giay trong cua so den han.
+    """
+    due_ids = [schedule_id for schedule_id, _ in due_window_entries([user_id], current_time).get(user_id, [])]
+    if not due_ids:
+        return make_etag('schedule', user_id, 'none')
+    return make_etag('schedule', user_id, get_content_version(user_id),
+                     current_time.strftime('%Y-%m-%dT%H:%M'), *due_ids)
+
+def get_current_schedules_many(user_ids, current_time=None):
+    """Lay cac lieu den han cua nhieu user bang mot truy van, tra ve {user_id: [lieu]}"""
+    current_time = current_time or datetime.now()
+    due_entries = due_window_entries(user_ids, current_time)
+    if not due_entries:
+        return {}
+    time_diff = (current_time - current_time.replace(second=0, microsecond=0)).total_seconds()
+    
+    schedule_ids = [schedule_id for entries in due_entries.values() for schedule_id, _ in entries]
+    current_schedules = {}
+    for schedule, medicine in query_due_doses(schedule_ids, current_time):
+        current_schedules.setdefault(schedule.user_id, []).append(
+            serialize_due_dose(schedule, medicine, time_diff)
+        )
     return current_schedules
 
-def calculate_weekly_stats(user_id):
-    now = datetime.now()
-    week_start = now - timedelta(days=now.weekday())
+def query_due_doses(schedule_ids, current_time):
+    """
+    Lay cac lieu den han trong mot cau lenh duy nhat:
+    schedules JOIN medicines, loai bo lich da co history 'taken' trong ngay (anti-join)
+    """
+    if not schedule_ids:
+        return []
     
-    week_history = MedicineHistory.query.join(Schedule).filter(
-        Schedule.user_id == user_id,
-        MedicineHistory.timestamp >= week_start
-    ).all()
+    today_start = datetime.combine(current_time.date(), datetime.min.time())
+    today_end = datetime.combine(current_time.date(), datetime.max.time())
     
-    total_scheduled = Schedule.query.filter_by(user_id=user_id, active=True).count() * 7
-    taken = sum(1 for h in week_history if h.status == 'taken')
-    missed = total_scheduled - taken
+    taken_today = db.session.query(MedicineHistory.id).filter(
+        MedicineHistory.schedule_id == Schedule.id,
+        MedicineHistory.timestamp >= today_start,
+        MedicineHistory.timestamp <= today_end,
+        MedicineHistory.status == 'taken'
+    ).exists()
     
+    return db.session.query(Schedule, Medicine).join(
+        Medicine, Medicine.id == Schedule.medicine_id
+    ).filter(
+        Schedule.id.in_(schedule_ids),
+        Schedule.active == True,
+        ~taken_today
+    ).order_by(Schedule.id).all()
+
+def serialize_due_dose(schedule, medicine, time_diff):
     return {
-        'taken': taken,
-        'missed': missed,
-        'compliance_rate': (taken / total_scheduled * 100) if total_scheduled > 0 else 0
+        'schedule_id': schedule.id,
+        'medicine_id': medicine.id,
+        'medicine_name': medicine.name,
+        'compartment_number': medicine.compartment_number,
+        'time': schedule.time,
+        'dosage': medicine.dosage,
+        'notes': medicine.notes,
+        'time_diff': time_diff  # Debug info
     }
 
 @main.route('/api/check_confirmation_status/<int:user_id>', methods=['GET'])
 @require_api_key
 def check_confirmation_status(user_id):
-    """API endpoint để ESP32 kiểm tra trạng thái confirmation từ Pi button"""
-    # Tìm confirmation gần nhất trong vòng 5 phút
-    from datetime import timedelta
-    recent_time = datetime.now() - timedelta(minutes=5)
-    
-    recent_confirmation = MedicineHistory.query.join(Schedule).filter(
-        Schedule.user_id == user_id,
-        MedicineHistory.timestamp >= recent_time,
-        MedicineHistory.status == 'taken',
-        MedicineHistory.notes == 'pi_button_confirmed'  # Flag đặc biệt cho Pi button
-    ).order_by(MedicineHistory.timestamp.desc()).first()
-    
+    """
+    API endpoint để ESP32 kiểm tra trạng thái confirmation từ Pi button.
+    Trả về confirmation mới nhất chưa được xác nhận (trong vòng 5 phút).
+    Nếu có ?after=<confirmation_id>, trả thêm 'events' gồm mọi confirmation sau cursor đó.
+    """
+    after = request.args.get('after', type=int)
+    if after is None:
+        return jsonify(confirmation_state(user_id))
+
+    events = event_store.pending(CONFIRMATION_CHANNEL, user_id, after=after)
+    result = confirmation_state(user_id, events[-1] if events else None)
+    result['events'] = [serialize_confirmation(event) for event in events]
+    result['cursor'] = events[-1]['id'] if events else after
+    return jsonify(result)
+
+def confirmation_state(user_id, recent_confirmation=None):
+    """Confirmation mới nhất chưa được ESP32 xác nhận (trong vòng 5 phút)"""
+    if recent_confirmation is None:
+        recent_confirmation = event_store.latest(CONFIRMATION_CHANNEL, user_id)
+
     if recent_confirmation:
-        schedule = Schedule.query.get(recent_confirmation.schedule_id)
-        medicine = Medicine.query.get(schedule.medicine_id)
-        
-        return jsonify({
-            'confirmed': True,
-            'timestamp': recent_confirmation.timestamp.isoformat(),
-            'medicine_name': medicine.name,
-            'compartment_number': medicine.compartment_number,
-            'confirmation_id': recent_confirmation.id
-        })
-    else:
-        return jsonify({'confirmed': False})
+        result = serialize_confirmation(recent_confirmation)
+        result['confirmed'] = True
+        return result
+    return {'confirmed': False}
+
+def serialize_confirmation(event):
+    data = event['data']
+    return {
+        'confirmation_id': event['id'],
+        'timestamp': data['taken_at'],
+        'schedule_id': data['schedule_id'],
+        'medicine_name': data['medicine_name'],
+        'compartment_number': data['compartment_number']
+    }
 
 @main.route('/api/clear_confirmation/<int:confirmation_id>', methods=['POST'])
 @require_api_key
 def clear_confirmation(confirmation_id):
-    """API để ESP32 xóa confirmation sau khi đã hiển thị"""
-    confirmation = MedicineHistory.query.get_or_404(confirmation_id)
-    # Đổi notes để không còn được detect nữa
-    confirmation.notes = 'pi_button_confirmed_displayed'
-    db.session.commit()
-    
+    """
+    API để ESP32 xác nhận đã hiển thị mọi confirmation tới confirmation_id (cursor).
+    Body: {"user_id": n} - chỉ xác nhận được confirmation của chính hộ đó.
+    """
+    user_id = (request.get_json(silent=True) or {}).get('user_id')
+    if not isinstance(user_id, int):
+        return jsonify({'error': 'user_id is required'}), 400
+
+    if not event_store.ack(CONFIRMATION_CHANNEL, user_id, confirmation_id):
+        return jsonify({'error': 'Confirmation not found or expired'}), 404
+
     return jsonify({'success': True})
 
 # ============ SYSTEM POWER CONTROL API ============
@@ -787,36 +1198,78 @@ def clear_confirmation(confirmation_id):
 @main.route('/api/system_status', methods=['GET'])
 @require_api_key
 def get_system_status():
-    """API để ESP32 kiểm tra trạng thái hệ thống (bật/tắt)"""
+    """
+    API để ESP32/Pi kiểm tra trạng thái hệ thống (bật/tắt).
+    ?user_id=<id> trả về trạng thái của hộ đó (kế thừa trạng thái chung nếu hộ chưa bấm POWER).
+    """
     try:
-        # Execute raw SQL query to get system status
-        result = db.session.execute(
-            "SELECT system_enabled, updated_at FROM system_control ORDER BY id DESC LIMIT 1"
-        ).fetchone()
-        
-        if result:
-            return jsonify({
-                'system_enabled': bool(result[0]),
-                'last_updated': result[1].isoformat() if result[1] else None,
-                'status': 'active' if result[0] else 'disabled'
-            })
-        else:
-            # Nếu chưa có record nào, tạo mặc định
-            db.session.execute("""
-                INSERT INTO system_control (system_enabled, updated_by, notes)
-                VALUES (TRUE, 'auto_init', 'Auto-created system status')
-            """)
-            db.session.commit()
-            
-            return jsonify({
-                'system_enabled': True,
-                'status': 'active',
-                'last_updated': datetime.now().isoformat()
-            })
+        user_id = request.args.get('user_id', type=int)
+        # Đọc từ cache trong tiến trình, chỉ kiểm tra phiên bản trong DB định kỳ
+        status, stamp = power_state.get(user_id)
+        etag = make_etag('system_status', user_id, stamp)
+        return not_modified(etag) or with_etag(jsonify(status), etag)
             
     except Exception as e:
         return jsonify({'error': f'Database error: {str(e)}'}), 500
 
+@main.route('/api/device_state/<int:user_id>', methods=['GET'])
+@require_api_key
+def device_state(user_id):
+    """
+    API gộp cho ESP32: lịch đến hạn, INFO flag, confirmation và trạng thái hệ thống
+    trong một request. Gửi lại 'cursor' của lần trước qua ?since= để bỏ các phần không đổi.
+    ?fields=schedule,system chỉ đọc và trả các phần được yêu cầu.
+    """
+    sections, error = requested_fields(DEVICE_STATE_SECTIONS)
+    if error:
+        return error
+    try:
+        return jsonify(collect_device_state(user_id, request.args.get('since'), sections))
+    except Exception as e:
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+def collect_device_state(user_id, since=None, sections=DEVICE_STATE_SECTIONS):
+    """
+    Trạng thái thiết bị gồm các phần đã thay đổi so với cursor `since` và 'cursor' mới.
+    Chỉ đọc các phần trong `sections`; phần không yêu cầu có token rỗng trong cursor.
+    Dùng chung cho /api/device_state và WebSocket (routes/ws.py).
+    """
+    since = dict(zip(DEVICE_STATE_SECTIONS, (since or '').split('.')))
+
+    # Lịch, các sự kiện và trạng thái hệ thống đều đọc từ bộ nhớ
+    state = {}
+    tokens = dict.fromkeys(DEVICE_STATE_SECTIONS, '')
+    if 'schedule' in sections:
+        # Token từ lịch đến hạn + phiên bản nội dung, chỉ truy vấn liều khi token đổi
+        current_time = datetime.now()
+        tokens['schedule'] = schedule_etag(user_id, current_time)[:8]
+        if since.get('schedule') != tokens['schedule']:
+            state['schedule'] = get_current_schedules(user_id, current_time)
+    if 'info_flag' in sections:
+        state['info_flag'] = info_flag_state(user_id)
+        tokens['info_flag'] = str(state['info_flag'].get('flag_id', 0))
+    if 'confirmation' in sections:
+        state['confirmation'] = confirmation_state(user_id)
+        tokens['confirmation'] = str(state['confirmation'].get('confirmation_id', 0))
+    if 'system' in sections:
+        state['system'], tokens['system'] = power_state.get(user_id)
+
+    result = {}
+    for name in DEVICE_STATE_SECTIONS:
+        if name in state and since.get(name) != tokens[name]:
+            result[name] = state[name]
+
+    result['cursor'] = '.'.join(tokens[name] for name in DEVICE_STATE_SECTIONS)
+    return result
+
+def household_id(value):
+    """user_id của hộ trong body JSON: None (trạng thái chung) hoặc số nguyên, lỗi ValueError nếu sai"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(value)
+    return int(value)
+
 @main.route('/api/system_control', methods=['POST'])
 @require_api_key
 def update_system_control():
@@ -834,38 +1287,21 @@ def update_system_control():
             return jsonify({'error': 'Invalid action. Use "enable" or "disable"'}), 400
         
         system_enabled = True if action == 'enable' else False
+        try:
+            user_id = household_id(data.get('user_id'))  # bỏ trống = trạng thái chung của server
+        except (TypeError, ValueError):
+            return jsonify({'error': 'user_id must be an integer'}), 400
         
-        # Cập nhật trạng thái trong database
-        result = db.session.execute("""
-            UPDATE system_control
-            SET system_enabled = :enabled, updated_at = :updated_at, updated_by = :updated_by, notes = :notes
-            WHERE id = 1
-        """, {
-            'enabled': system_enabled,
-            'updated_at': datetime.now(),
-            'updated_by': source,
-            'notes': f'{action.title()} by {source}. {notes}'
-        })
-        
-        if result.rowcount == 0:
-            # Nếu chưa có record, tạo mới
-            db.session.execute("""
-                INSERT INTO system_control (id, system_enabled, updated_by, notes)
-                VALUES (1, :enabled, :updated_by, :notes)
-            """, {
-                'enabled': system_enabled,
-                'updated_by': source,
-                'notes': f'{action.title()} by {source}. {notes}'
-            })
+        # Cập nhật trạng thái trong database (và cache khi commit)
+        power_state.set(system_enabled, datetime.now(), source,
+                        f'{action.title()} by {source}. {notes}', user_id=user_id)
         
-        db.session.commit()
-        
-        # Log action cho admin
+        # Log action cho admin (cùng transaction với thay đổi trạng thái)
         log_entry = AdminLog(
             admin_id=1,  # System user
             action=f'system_{action}',
             target_type='system_control',
-            target_id=1,
+            target_id=user_id or 1,
             details=f'System {action}d by {source}. {notes}',
             timestamp=datetime.now()
         )
@@ -876,11 +1312,13 @@ def update_system_control():
             'success': True,
             'action': action,
             'system_enabled': system_enabled,
+            'user_id': user_id,
             'timestamp': datetime.now().isoformat(),
             'message': f'System successfully {action}d'
         })
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Failed to update system status: {str(e)}'}), 500
 
 @main.route('/api/power_button_press', methods=['POST'])
@@ -889,50 +1327,24 @@ def handle_power_button_press():
     """API đặc biệt để xử lý nhấn nút power từ Raspberry Pi"""
     try:
         data = request.get_json()
-        user_id = data.get('user_id', 1)
+        try:
+            user_id = household_id(data.get('user_id'))  # thiết bị của hộ nào - bỏ trống = trạng thái chung
+        except (TypeError, ValueError):
+            return jsonify({'error': 'user_id must be an integer'}), 400
         button_duration = data.get('duration', 0)  # thời gian nhấn nút (giây)
         
-        # Lấy trạng thái hiện tại
-        result = db.session.execute(
-            "SELECT system_enabled FROM system_control ORDER BY id DESC LIMIT 1"
-        ).fetchone()
-        
-        current_status = result[0] if result else True
-        
-        # Toggle trạng thái
-        new_status = not current_status
+        # Đảo trạng thái bằng một câu UPDATE nguyên tử (chỉ bản ghi của hộ này),
+        # ghi log audit trong cùng transaction
+        new_status = power_state.toggle(datetime.now(), f'power_button_user_{user_id}',
+                                        f'Power button pressed for {button_duration}s', user_id=user_id)
+        current_status = not new_status
         action = 'enable' if new_status else 'disable'
         
-        # Cập nhật database
-        update_result = db.session.execute("""
-            UPDATE system_control
-            SET system_enabled = :enabled, updated_at = :updated_at, updated_by = :updated_by, notes = :notes
-            WHERE id = 1
-        """, {
-            'enabled': new_status,
-            'updated_at': datetime.now(),
-            'updated_by': f'power_button_user_{user_id}',
-            'notes': f'Power button pressed for {button_duration}s - {action}d system'
-        })
-        
-        if update_result.rowcount == 0:
-            db.session.execute("""
-                INSERT INTO system_control (id, system_enabled, updated_by, notes)
-                VALUES (1, :enabled, :updated_by, :notes)
-            """, {
-                'enabled': new_status,
-                'updated_by': f'power_button_user_{user_id}',
-                'notes': f'Power button pressed - {action}d system'
-            })
-        
-        db.session.commit()
-        
-        # Log cho admin
         log_entry = AdminLog(
-            admin_id=user_id,
+            admin_id=user_id or 1,
             action=f'power_button_{action}',
             target_type='system_control',
-            target_id=1,
+            target_id=user_id or 1,
             details=f'Power button pressed by user {user_id} - System {action}d',
             timestamp=datetime.now()
         )
@@ -943,12 +1355,14 @@ def handle_power_button_press():
             'success': True,
             'previous_status': current_status,
             'new_status': new_status,
+            'user_id': user_id,
             'action': action,
             'timestamp': datetime.now().isoformat(),
             'message': f'Power button processed - System {action}d'
         })
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Power button processing failed: {str(e)}'}), 500
 
 @main.route('/admin/system-power')
@@ -958,7 +1372,7 @@ def system_power_control():
     try:
         # Lấy trạng thái hiện tại
         result = db.session.execute(
-            "SELECT * FROM system_control ORDER BY updated_at DESC LIMIT 1"
+            "SELECT * FROM system_control WHERE user_id IS NULL ORDER BY updated_at DESC LIMIT 1"
         ).fetchone()
         
         # Convert result to dict-like object if exists
@@ -971,6 +1385,16 @@ def system_power_control():
                 'notes': result[4]
             }
         
+        # Các hộ đã bấm POWER có bản ghi riêng - tắt chung vẫn tắt cả các hộ này
+        household_counts = db.session.execute(
+            "SELECT COUNT(*), SUM(CASE WHEN system_enabled THEN 0 ELSE 1 END) "
+            "FROM system_control WHERE user_id IS NOT NULL"
+        ).fetchone()
+        households = {
+            'total': household_counts[0] or 0,
+            'disabled': int(household_counts[1] or 0)
+        }
+        
         # Lấy lịch sử thay đổi gần đây
         recent_logs = AdminLog.query.filter(
             AdminLog.target_type == 'system_control'
@@ -978,6 +1402,7 @@ def system_power_control():
         
         return render_template('admin/system_power.html',
                              current_status=current_status,
+                             households=households,
                              recent_logs=recent_logs,
                              User=User)
     except Exception as e:
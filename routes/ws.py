@@ -0,0 +1,69 @@
+from flask import Blueprint, request
+from flask_sock import Sock
+from models import db
+from auth import verify_api_key
+from event_store import event_store
+from routes.main import collect_device_state, requested_fields, DEVICE_STATE_SECTIONS, INFO_FLAG_CHANNEL, CONFIRMATION_CHANNEL
+import json
+
+ws = Blueprint('ws', __name__)
+sock = Sock()
+
+# Chu ky kiem tra trang thai cua moi socket (lich den han, INFO flag, confirmation, nguon)
+WS_POLL_SECONDS = 1
+
+@sock.route('/ws/device/<int:user_id>', bp=ws)
+def device_socket(socket, user_id):
+    """
+    WebSocket cho màn hình ESP32: đẩy lịch đến hạn, INFO flag, confirmation và
+    trạng thái hệ thống ngay khi thay đổi (cùng định dạng với /api/device_state).
+
+    Server gửi: {"type": "state", "cursor": ..., <các phần đã đổi>}
+    Client gửi: {"type": "clear_info_flag", "flag_id": n}
+                {"type": "clear_confirmation", "confirmation_id": n}
+    """
+    if not verify_api_key():
+        socket.close(reason=1008, message='API key không hợp lệ')
+        return
+
+    # ?fields=schedule,system giống /api/device_state
+    sections, error = requested_fields(DEVICE_STATE_SECTIONS)
+    if error:
+        socket.close(reason=1008, message='fields không hợp lệ')
+        return
+
+    cursor = request.args.get('since')
+    first = True
+
+    while True:
+        try:
+            state = collect_device_state(user_id, cursor, sections)
+        finally:
+            # Trả connection về pool - socket sống lâu không được giữ transaction mở
+            db.session.remove()
+
+        if first or len(state) > 1:
+            state['type'] = 'state'
+            socket.send(json.dumps(state))
+            first = False
+        cursor = state['cursor']
+
+        message = socket.receive(timeout=WS_POLL_SECONDS)
+        if message:
+            handle_client_message(socket, message, user_id)
+
+def handle_client_message(socket, message, user_id):
+    """Xử lý tin nhắn xác nhận từ ESP32 - chỉ xác nhận được sự kiện của user của socket"""
+    try:
+        data = json.loads(message)
+        if data.get('type') == 'clear_info_flag':
+            acked = event_store.ack(INFO_FLAG_CHANNEL, user_id, int(data['flag_id']))
+        elif data.get('type') == 'clear_confirmation':
+            acked = event_store.ack(CONFIRMATION_CHANNEL, user_id, int(data['confirmation_id']))
+        else:
+            socket.send(json.dumps({'type': 'error', 'error': 'Unknown message type'}))
+            return
+        if not acked:
+            socket.send(json.dumps({'type': 'error', 'error': 'Event not found or expired'}))
+    except (ValueError, KeyError, TypeError) as e:
+        socket.send(json.dumps({'type': 'error', 'error': f'Invalid message: {e}'}))
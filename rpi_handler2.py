@@ -2,6 +2,7 @@ import RPi.GPIO as GPIO
 import time
 import threading
 import requests
+import json
 from datetime import datetime
 import sys
 import os
@@ -33,34 +34,66 @@ SERVO_OPEN = 90
 SERVER_URL = "http://192.168.1.159:5000"
 API_KEY = "my-secret-key-2025"
 
+# Gửi lại xác nhận khi lỗi mạng/server (an toàn nhờ idempotency_key)
+CONFIRM_RETRIES = 3
+CONFIRM_RETRY_SECONDS = 2
+
+# Sự kiện gửi không được (mất Wi-Fi) được lưu đệm và upload theo lô qua /api/events/bulk
+BACKLOG_FLUSH_SECONDS = 30
+BACKLOG_MAX_EVENTS = 500
+
 # User ID - change according to the specific user
 USER_ID = 15
 
+# Schedule mode: "poll" checks the server every 5 seconds,
+# "stream" keeps one Server-Sent Events connection open and waits for pushes,
+# "sleep" asks /api/next_dose when the next dose is due and sleeps until then
+SCHEDULE_MODE = "stream"
+
+# Hub mode: one gateway drives several residents' dispensers and polls them
+# all with a single /api/check_schedule_batch request. Leave empty for one user.
+# Example:
+# HUB_DISPENSERS = {
+#     15: {"servo_pins": {1: 12, 2: 13}, "confirm_pin": 16, "info_pin": 23, "power_pin": 22},
+#     16: {"servo_pins": {1: 18, 2: 19}, "confirm_pin": 24},
+# }
+HUB_DISPENSERS = {}
+
 class TestRaspberryPiHandler:
-    def __init__(self):
+    def __init__(self, user_id=USER_ID, servo_pins=SERVO_PINS, confirm_pin=PIN_CONFIRM,
+                 info_pin=PIN_INFO, power_pin=PIN_POWER, start_schedule_thread=True):
+        self.user_id = user_id
+        self.servo_pins = servo_pins
+        self.confirm_pin = confirm_pin
+        self.info_pin = info_pin
+        self.power_pin = power_pin
+
         print("=" * 60)
         print("AUTOMATIC MEDICINE DISPENSER SYSTEM - TEST PROGRAM")
         print("=" * 60)
-        print(f"USER ID: {USER_ID}")
+        print(f"USER ID: {self.user_id}")
         print("=" * 60)
 
         GPIO.setmode(GPIO.BCM)
-        GPIO.setup(PIN_CONFIRM, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(PIN_INFO, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(PIN_POWER, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.add_event_detect(PIN_INFO, GPIO.FALLING, callback=self.info_callback, bouncetime=300)
-        GPIO.add_event_detect(PIN_POWER, GPIO.FALLING, callback=self.power_callback, bouncetime=500)
+        GPIO.setup(self.confirm_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        # INFO/POWER buttons are optional for extra dispensers in hub mode
+        if self.info_pin is not None:
+            GPIO.setup(self.info_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+            GPIO.add_event_detect(self.info_pin, GPIO.FALLING, callback=self.info_callback, bouncetime=300)
+        if self.power_pin is not None:
+            GPIO.setup(self.power_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+            GPIO.add_event_detect(self.power_pin, GPIO.FALLING, callback=self.power_callback, bouncetime=500)
 
         self.servos = {}
-        print(f"Initializing {len(SERVO_PINS)} medicine compartments:")
-        for compartment, pin in SERVO_PINS.items():
+        print(f"Initializing {len(self.servo_pins)} medicine compartments:")
+        for compartment, pin in self.servo_pins.items():
             GPIO.setup(pin, GPIO.OUT)
             self.servos[compartment] = GPIO.PWM(pin, 50)
             self.servos[compartment].start(0)
             self.set_servo_angle(compartment, SERVO_CLOSED)
             print(f"   Compartment {compartment} (GPIO {pin}) - Closed")
 
-        GPIO.add_event_detect(PIN_CONFIRM, GPIO.FALLING, callback=self.confirm_callback, bouncetime=300)
+        GPIO.add_event_detect(self.confirm_pin, GPIO.FALLING, callback=self.confirm_callback, bouncetime=300)
 
         self.is_alerting = False
         self.current_compartment = None
@@ -70,21 +103,39 @@ class TestRaspberryPiHandler:
         self.system_enabled = True  # Track system power status
         self.power_button_press_time = None
         
+        # ETag cache for conditional GETs: url -> (etag, json body)
+        self.etag_cache = {}
+
         # Emergency notification tracking
         self.pending_notifications = {}  # Track unconfirmed notifications
         self.notification_sent = {}  # Track sent notifications
 
-        print(f"Confirmation button: GPIO {PIN_CONFIRM}")
-        print(f"INFO button: GPIO {PIN_INFO}")
-        print(f"POWER button: GPIO {PIN_POWER}")
+        # Events waiting for upload while the server is unreachable
+        self.event_backlog = []
+        self.backlog_lock = threading.Lock()
+
+        print(f"Confirmation button: GPIO {self.confirm_pin}")
+        print(f"INFO button: GPIO {self.info_pin}")
+        print(f"POWER button: GPIO {self.power_pin}")
         print("Connecting to server...")
         
         # Check initial system status
         self.check_system_status()
 
-        self.schedule_thread = threading.Thread(target=self.schedule_loop)
-        self.schedule_thread.daemon = True
-        self.schedule_thread.start()
+        # In hub mode the HubScheduler polls for every user instead
+        if start_schedule_thread:
+            if SCHEDULE_MODE == "stream":
+                self.schedule_thread = threading.Thread(target=self.schedule_stream_loop)
+            elif SCHEDULE_MODE == "sleep":
+                self.schedule_thread = threading.Thread(target=self.schedule_sleep_loop)
+            else:
+                self.schedule_thread = threading.Thread(target=self.schedule_loop)
+            self.schedule_thread.daemon = True
+            self.schedule_thread.start()
+
+        self.backlog_thread = threading.Thread(target=self.backlog_flush_loop)
+        self.backlog_thread.daemon = True
+        self.backlog_thread.start()
 
         print("Initialization complete! Checking medicine schedule...")
         print("=" * 60)
@@ -101,27 +152,45 @@ class TestRaspberryPiHandler:
         time.sleep(2)
         self.servos[compartment].ChangeDutyCycle(0)
 
+    def conditional_get(self, url):
+        """GET a JSON endpoint with If-None-Match; returns (status_code, json body or None)"""
+        headers = {"X-API-Key": API_KEY}
+        cached = self.etag_cache.get(url)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+
+        response = requests.get(url, headers=headers, timeout=10)
+
+        if response.status_code == 304 and cached:
+            return 200, cached[1]
+        if response.status_code == 200:
+            data = response.json()
+            etag = response.headers.get("ETag")
+            if etag:
+                self.etag_cache[url] = (etag, data)
+            return 200, data
+        return response.status_code, None
+
     def check_system_status(self):
         """Check system power status from server"""
         try:
-            headers = {"X-API-Key": API_KEY}
-            response = requests.get(f"{SERVER_URL}/api/system_status", headers=headers)
+            status_code, status_data = self.conditional_get(
+                f"{SERVER_URL}/api/system_status?user_id={self.user_id}")
             
-            if response.status_code == 200:
-                status_data = response.json()
+            if status_code == 200:
                 self.system_enabled = status_data.get('system_enabled', True)
                 status_text = "ENABLED" if self.system_enabled else "DISABLED"
                 print(f"System Status: {status_text}")
                 return self.system_enabled
             else:
-                print(f"Error checking system status: {response.status_code}")
+                print(f"Error checking system status: {status_code}")
                 return True  # Default to enabled if can't check
         except Exception as e:
             print(f"Error checking system status: {e}")
             return True
 
     def schedule_loop(self):
-        print("Starting schedule check for user ID:", USER_ID)
+        print("Starting schedule check for user ID:", self.user_id)
         while True:
             try:
                 # Check and send notifications for unconfirmed medicines
@@ -133,54 +202,141 @@ class TestRaspberryPiHandler:
                     time.sleep(10)  # Check less frequently when disabled
                     continue
                 
-                headers = {"X-API-Key": API_KEY}
-                response = requests.get(f"{SERVER_URL}/api/check_schedule_by_user/{USER_ID}", headers=headers)
+                status_code, schedules = self.conditional_get(
+                    f"{SERVER_URL}/api/check_schedule_by_user/{self.user_id}")
+
+                if status_code == 200:
+                    self.handle_due_schedules(schedules)
+
+                elif status_code == 401:
+                    print("Authentication error - Check your API key or login status")
+                else:
+                    print(f"API error ({status_code})")
+
+            except requests.exceptions.ConnectionError:
+                print("Cannot connect to the server. Retrying...")
+            except Exception as e:
+                print(f"Error checking schedule: {e}")
+
+            time.sleep(5)
+
+    def handle_due_schedules(self, schedules):
+        """Open the compartment and start reminders for due schedules"""
+        if schedules:
+            print(f"Found {len(schedules)} scheduled medicines for user {self.user_id}:")
+
+        for schedule in schedules:
+            compartment = schedule.get("compartment_number")
+            medicine_name = schedule.get("medicine_name")
+            schedule_id = schedule.get("schedule_id")
+            notes = schedule.get("notes", "")
+
+            if compartment in self.servo_pins and not self.is_alerting and self.system_enabled:
+                self.is_alerting = True
+                self.current_compartment = compartment
+                self.current_medicine = medicine_name
+                self.current_schedule_id = schedule_id
+                self.alert_time = datetime.now()
+
+                print("\n" + "=" * 60)
+                print("MEDICINE REMINDER!")
+                print("=" * 60)
+                print(f"User ID: {self.user_id}")
+                print(f"Time: {self.alert_time.strftime('%H:%M:%S - %d/%m/%Y')}")
+                print(f"Medicine: {medicine_name}")
+                print(f"Compartment: {compartment}")
+                if notes:
+                    print(f"Note: {notes}")
+                print("=" * 60)
+
+                print(f"Opening compartment {compartment}...")
+                self.set_servo_angle(compartment, SERVO_OPEN)
+                print(f"Compartment {compartment} opened to 90 degrees for 2 seconds")
+
+                self.set_servo_angle(compartment, SERVO_CLOSED)
+                print(f"Compartment {compartment} closed")
+
+                print("\nPLEASE PRESS THE CONFIRM BUTTON AFTER TAKING THE MEDICINE!")
+                print("Waiting for confirmation...")
+
+                self.setup_notification_timer(schedule_id, medicine_name, compartment)
+
+                self.start_reminder_timer()
+
+    def schedule_stream_loop(self):
+        """Receive due schedules pushed by the server (Server-Sent Events)"""
+        print("Starting schedule stream for user ID:", self.user_id)
+        headers = {"X-API-Key": API_KEY, "Accept": "text/event-stream"}
+        while True:
+            try:
+                self.check_pending_notifications()
+
+                if not self.check_system_status():
+                    print("System is DISABLED - Skipping schedule stream")
+                    time.sleep(10)
+                    continue
+
+                with requests.get(f"{SERVER_URL}/api/schedule_stream/{self.user_id}",
+                                  headers=headers, stream=True, timeout=(5, 60)) as response:
+                    if response.status_code == 401:
+                        print("Authentication error - Check your API key or login status")
+                        time.sleep(5)
+                        continue
+                    if response.status_code != 200:
+                        print(f"API error ({response.status_code}): {response.text}")
+                        time.sleep(5)
+                        continue
+
+                    event_name = None
+                    for line in response.iter_lines(decode_unicode=True):
+                        # Keepalive comments also give us a chance to send overdue notifications
+                        self.check_pending_notifications()
+                        if line.startswith("event:"):
+                            event_name = line[len("event:"):].strip()
+                        elif line.startswith("data:") and event_name == "schedule":
+                            if self.check_system_status():
+                                self.handle_due_schedules(json.loads(line[len("data:"):]))
+                            else:
+                                print("System is DISABLED - Ignoring pushed schedule")
+                        elif not line:
+                            event_name = None
+
+            except requests.exceptions.ConnectionError:
+                print("Cannot connect to the server. Retrying...")
+                time.sleep(5)
+            except Exception as e:
+                print(f"Error in schedule stream: {e}")
+                time.sleep(5)
+
+    def schedule_sleep_loop(self):
+        """Sleep until the server says the next dose is due instead of polling"""
+        print("Starting next-dose schedule check for user ID:", self.user_id)
+        headers = {"X-API-Key": API_KEY}
+        while True:
+            wait_seconds = 5
+            try:
+                self.check_pending_notifications()
+
+                if not self.check_system_status():
+                    print("System is DISABLED - Skipping schedule check")
+                    time.sleep(10)
+                    continue
+
+                response = requests.get(f"{SERVER_URL}/api/next_dose/{self.user_id}", headers=headers, timeout=10)
 
                 if response.status_code == 200:
-                    schedules = response.json()
-                    if schedules:
-                        print(f"Found {len(schedules)} scheduled medicines for user {USER_ID}:")
-
-                    for schedule in schedules:
-                        compartment = schedule.get("compartment_number")
-                        medicine_name = schedule.get("medicine_name")
-                        schedule_id = schedule.get("schedule_id")
-                        notes = schedule.get("notes", "")
-
-                        if compartment in SERVO_PINS and not self.is_alerting and self.system_enabled:
-                            self.is_alerting = True
-                            self.current_compartment = compartment
-                            self.current_medicine = medicine_name
-                            self.current_schedule_id = schedule_id
-                            self.alert_time = datetime.now()
-
-                            print("\n" + "=" * 60)
-                            print("MEDICINE REMINDER!")
-                            print("=" * 60)
-                            print(f"User ID: {USER_ID}")
-                            print(f"Time: {self.alert_time.strftime('%H:%M:%S - %d/%m/%Y')}")
-                            print(f"Medicine: {medicine_name}")
-                            print(f"Compartment: {compartment}")
-                            if notes:
-                                print(f"Note: {notes}")
-                            print("=" * 60)
-
-                         
-                            print(f"Opening compartment {compartment}...")
-                            self.set_servo_angle(compartment, SERVO_OPEN)
-                            print(f"Compartment {compartment} opened to 90 degrees for 2 seconds")
-
- 
-                            self.set_servo_angle(compartment, SERVO_CLOSED)
-                            print(f"Compartment {compartment} closed")
-
-                            print("\nPLEASE PRESS THE CONFIRM BUTTON AFTER TAKING THE MEDICINE!")
-                            print("Waiting for confirmation...")
-
-                     
-                            self.setup_notification_timer(schedule_id, medicine_name, compartment)
-
-                            self.start_reminder_timer()
+                    next_dose = response.json()
+                    if next_dose.get("seconds_until") == 0:
+                        due = requests.get(f"{SERVER_URL}/api/check_schedule_by_user/{self.user_id}",
+                                           headers=headers, timeout=10)
+                        if due.status_code == 200:
+                            self.handle_due_schedules(due.json())
+                        # Skip past the due window so the same dose is not fetched twice
+                        wait_seconds = 11
+                    else:
+                        wait_seconds = int(response.headers.get("Retry-After", next_dose.get("retry_after", 5)))
+                        if next_dose.get("next_due_at"):
+                            print(f"Next dose at {next_dose['next_due_at']} - sleeping {wait_seconds}s")
 
                 elif response.status_code == 401:
                     print("Authentication error - Check your API key or login status")
@@ -190,9 +346,12 @@ class TestRaspberryPiHandler:
             except requests.exceptions.ConnectionError:
                 print("Cannot connect to the server. Retrying...")
             except Exception as e:
-                print(f"Error checking schedule: {e}")
+                print(f"Error checking next dose: {e}")
 
-            time.sleep(5)
+            # Wake up regularly while an emergency notification is pending
+            if self.pending_notifications:
+                wait_seconds = min(wait_seconds, 30)
+            time.sleep(max(wait_seconds, 1))
 
     def start_reminder_timer(self):
         """Start reminder thread to alert if user hasn't confirmed"""
@@ -220,7 +379,7 @@ class TestRaspberryPiHandler:
             print("\n" + "=" * 60)
             print("CONFIRMATION RECEIVED!")
             print("=" * 60)
-            print(f"User ID: {USER_ID}")
+            print(f"User ID: {self.user_id}")
             print(f"Medicine: {self.current_medicine}")
             print(f"Compartment: {self.current_compartment}")
             print(f"Confirmed at: {confirm_time.strftime('%H:%M:%S - %d/%m/%Y')}")
@@ -229,35 +388,8 @@ class TestRaspberryPiHandler:
             print("Thank you for taking your medicine on time!")
             print("=" * 60)
 
-            try:
-                if self.current_schedule_id:
-                    headers = {"X-API-Key": API_KEY, "Content-Type": "application/json"}
-                    data = {"schedule_id": self.current_schedule_id, "user_id": USER_ID}
-
-                    response = requests.post(f"{SERVER_URL}/api/confirm_medicine_by_user",
-                                             headers=headers, json=data)
-
-                    if response.status_code == 200:
-                        print("Confirmation successfully sent to server!")
-                        pi_flag_data = {
-                            "schedule_id": self.current_schedule_id,
-                            "user_id": USER_ID,
-                            "pi_button_flag": True
-                        }
-                        
-                        pi_response = requests.post(f"{SERVER_URL}/api/confirm_pi_button",
-                                                   headers=headers, json=pi_flag_data)
-                        
-                        if pi_response.status_code == 200:
-                            print("Pi button flag sent to server for ESP32 sync!")
-                        else:
-                            print(f"Error sending Pi button flag: {pi_response.status_code}")
-                            
-                    else:
-                        print(f"Error sending confirmation to server: {response.status_code}")
-
-            except Exception as e:
-                print(f"Error sending confirmation: {e}")
+            if self.current_schedule_id:
+                self.send_confirmation(self.current_schedule_id, confirm_time)
 
             # Cancel pending notification when confirmed
             if self.current_schedule_id in self.pending_notifications:
@@ -274,11 +406,87 @@ class TestRaspberryPiHandler:
         else:
             print("No pending medicine reminder to confirm!")
         
+    def send_confirmation(self, schedule_id, confirm_time):
+        """
+        Gửi một xác nhận duy nhất (server ghi history và báo ESP32).
+        Khóa idempotency cố định theo lần bấm nên gửi lại khi lỗi mạng không ghi trùng.
+        """
+        headers = {"X-API-Key": API_KEY, "Content-Type": "application/json"}
+        data = {
+            "schedule_id": schedule_id,
+            "user_id": self.user_id,
+            "idempotency_key": f"{schedule_id}:{confirm_time.date().isoformat()}",
+            "source": "pi_button"  # server chỉ báo ESP32 cho xác nhận từ nút trên Pi
+        }
+
+        for attempt in range(1, CONFIRM_RETRIES + 1):
+            try:
+                response = requests.post(f"{SERVER_URL}/api/confirm_medicine_by_user",
+                                         headers=headers, json=data, timeout=5)
+                if response.status_code == 200:
+                    if response.json().get('duplicate'):
+                        print("Confirmation already recorded on server")
+                    else:
+                        print("Confirmation successfully sent to server!")
+                    return True
+                print(f"Error sending confirmation to server: {response.status_code}")
+                if response.status_code < 500:
+                    return False
+            except Exception as e:
+                print(f"Error sending confirmation (attempt {attempt}/{CONFIRM_RETRIES}): {e}")
+            time.sleep(CONFIRM_RETRY_SECONDS)
+
+        # Vẫn không gửi được - lưu đệm, upload lại cùng khóa khi có mạng
+        self.queue_event(dict(data, type="confirmation", occurred_at=confirm_time.isoformat()))
+        return False
+
+    def queue_event(self, event):
+        """Lưu đệm một sự kiện để upload theo lô khi có mạng trở lại"""
+        with self.backlog_lock:
+            self.event_backlog.append(event)
+            if len(self.event_backlog) > BACKLOG_MAX_EVENTS:
+                dropped = self.event_backlog.pop(0)
+                print(f"Backlog full, dropped oldest {dropped['type']} event")
+        print(f"Queued {event['type']} event for later upload ({len(self.event_backlog)} pending)")
+
+    def flush_backlog(self):
+        """Upload các sự kiện lưu đệm trong một request; giữ lại nếu server không nhận"""
+        with self.backlog_lock:
+            batch = list(self.event_backlog)
+        if not batch:
+            return True
+
+        headers = {"X-API-Key": API_KEY, "Content-Type": "application/json"}
+        try:
+            response = requests.post(f"{SERVER_URL}/api/events/bulk", headers=headers,
+                                     json={"user_id": self.user_id, "events": batch}, timeout=15)
+        except Exception as e:
+            print(f"Backlog upload failed, will retry: {e}")
+            return False
+
+        if response.status_code != 200:
+            print(f"Backlog upload failed: {response.status_code}")
+            return False
+
+        # Sự kiện bị từ chối (dữ liệu sai) gửi lại cũng không được nên bỏ luôn
+        for result in response.json().get('results', []):
+            if result.get('status') == 'error':
+                print(f"Server rejected {result.get('type')} event: {result.get('error')}")
+        with self.backlog_lock:
+            del self.event_backlog[:len(batch)]
+        print(f"Uploaded {len(batch)} buffered events")
+        return True
+
+    def backlog_flush_loop(self):
+        while True:
+            time.sleep(BACKLOG_FLUSH_SECONDS)
+            self.flush_backlog()
+
     def info_callback(self, channel):
             print("INFO button pressed!")
             try:
                 headers = {"X-API-Key": API_KEY, "Content-Type": "application/json"}
-                data = {"user_id": USER_ID, "info_flag": True}  # Add a flag for the INFO button
+                data = {"user_id": self.user_id, "info_flag": True}  # Add a flag for the INFO button
         
                 response = requests.post(f"{SERVER_URL}/api/trigger_info_display", headers=headers, json=data)
         
@@ -305,13 +513,16 @@ class TestRaspberryPiHandler:
         print("=" * 60)
         
         try:
+            # Lần bấm khi offline phải lên server trước, nếu không sẽ ghi đè lần bấm này
+            self.flush_backlog()
+
             # Get current system status
             current_status = self.check_system_status()
             new_action = 'disable' if current_status else 'enable'
             
             headers = {"X-API-Key": API_KEY, "Content-Type": "application/json"}
             data = {
-                "user_id": USER_ID,
+                "user_id": self.user_id,
                 "duration": 1,  # Button press duration
                 "timestamp": press_time.isoformat()
             }
@@ -338,12 +549,22 @@ class TestRaspberryPiHandler:
             else:
                 print(f"Error processing power button: {response.status_code}")
                 print(f"Response: {response.text}")
+                if response.status_code >= 500:
+                    self.toggle_offline(press_time)
                 
         except Exception as e:
             print(f"Error handling power button press: {e}")
+            self.toggle_offline(press_time)
         
         print("=" * 60)
 
+    def toggle_offline(self, press_time):
+        """Server không phản hồi - đảo trạng thái tại chỗ, gửi trạng thái mới theo lô sau"""
+        self.system_enabled = not self.system_enabled
+        print(f"Server unreachable - System {'ENABLED' if self.system_enabled else 'DISABLED'} locally")
+        self.queue_event({"type": "power_press", "user_id": self.user_id,
+                          "new_status": self.system_enabled, "occurred_at": press_time.isoformat()})
+
     def setup_notification_timer(self, schedule_id, medicine_name, compartment):
         """Setup timer for emergency notifications"""
         if not NOTIFICATION_AVAILABLE:
@@ -352,16 +573,18 @@ class TestRaspberryPiHandler:
             
         try:
             # Get user info from server to know notification delay
-            headers = {"X-API-Key": API_KEY}
-            response = requests.get(f"{SERVER_URL}/api/user_profile/{USER_ID}", headers=headers)
+            # Chỉ lấy thông tin cá nhân + người liên hệ khẩn cấp, bỏ thống kê và danh sách thuốc
+            status_code, profile = self.conditional_get(
+                f"{SERVER_URL}/api/user_profile/{self.user_id}?fields=user_info,emergency_contact")
             
-            if response.status_code == 200:
-                user_info = response.json()
-                notification_delay = user_info.get('user_info', {}).get('notification_delay_minutes', 15)
+            if status_code == 200:
+                notification_delay = profile.get('notification_delay_minutes', 15)
+                user_info = dict(profile.get('user_info', {}))
+                user_info.update((key, value) for key, value in profile.items() if key != 'user_info')
                 
                 # Save pending notification info
                 self.pending_notifications[schedule_id] = {
-                    'user_info': user_info.get('user_info', {}),
+                    'user_info': user_info,
                     'medicine_name': medicine_name,
                     'compartment': compartment,
                     'alert_time': time.time(),
@@ -445,7 +668,7 @@ class TestRaspberryPiHandler:
         try:
             headers = {"X-API-Key": API_KEY, "Content-Type": "application/json"}
             log_data = {
-                'user_id': USER_ID,
+                'user_id': self.user_id,
                 'schedule_id': schedule_id,
                 'notification_type': 'missed_medicine',
                 'method': method,
@@ -462,20 +685,89 @@ class TestRaspberryPiHandler:
             
             if response.status_code == 200:
                 print(f"Notification logged to server")
-            else:
-                print(f"Cannot log notification: {response.status_code}")
+                return
+            print(f"Cannot log notification: {response.status_code}")
                 
         except Exception as e:
             print(f"Error logging notification: {e}")
 
+        self.queue_event(dict(log_data, type="notification_log", occurred_at=datetime.now().isoformat()))
+
     def cleanup(self):
         for servo in self.servos.values():
             servo.stop()
         GPIO.cleanup()
 
+class HubScheduler:
+    """Drive several residents' dispensers from one process with the batch API"""
+
+    def __init__(self, dispensers):
+        self.handlers = {}
+        for user_id, config in dispensers.items():
+            self.handlers[user_id] = TestRaspberryPiHandler(
+                user_id=user_id,
+                servo_pins=config["servo_pins"],
+                confirm_pin=config["confirm_pin"],
+                info_pin=config.get("info_pin"),
+                power_pin=config.get("power_pin"),
+                start_schedule_thread=False
+            )
+
+        self.schedule_thread = threading.Thread(target=self.schedule_loop)
+        self.schedule_thread.daemon = True
+        self.schedule_thread.start()
+
+    def schedule_loop(self):
+        user_ids = list(self.handlers.keys())
+        print("Starting batch schedule check for user IDs:", user_ids)
+        headers = {"X-API-Key": API_KEY, "Content-Type": "application/json"}
+        while True:
+            try:
+                for handler in self.handlers.values():
+                    handler.check_pending_notifications()
+
+                # Each household has its own POWER state - only check schedules for enabled ones
+                enabled_ids = []
+                for user_id, handler in self.handlers.items():
+                    handler.system_enabled = handler.check_system_status()
+                    if handler.system_enabled:
+                        enabled_ids.append(user_id)
+                    else:
+                        print(f"System is DISABLED for user {user_id} - Skipping schedule check")
+                if not enabled_ids:
+                    time.sleep(10)
+                    continue
+
+                response = requests.post(f"{SERVER_URL}/api/check_schedule_batch",
+                                         headers=headers, json={"user_ids": enabled_ids})
+
+                if response.status_code == 200:
+                    schedules = response.json().get("schedules", {})
+                    for user_id in enabled_ids:
+                        self.handlers[user_id].handle_due_schedules(schedules.get(str(user_id), []))
+
+                elif response.status_code == 401:
+                    print("Authentication error - Check your API key or login status")
+                else:
+                    print(f"API error ({response.status_code}): {response.text}")
+
+            except requests.exceptions.ConnectionError:
+                print("Cannot connect to the server. Retrying...")
+            except Exception as e:
+                print(f"Error checking schedule: {e}")
+
+            time.sleep(5)
+
+    def cleanup(self):
+        for handler in self.handlers.values():
+            handler.cleanup()
+
 if __name__ == "__main__":
     try:
-        handler = TestRaspberryPiHandler()
+        if HUB_DISPENSERS:
+            handler = HubScheduler(HUB_DISPENSERS)
+        else:
+            handler = TestRaspberryPiHandler()
         print("System running... Press Ctrl+C to stop")
 
         while True:
@@ -0,0 +1,172 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import Schedule, days_to_mask
+
+# Nạp lại lịch của user sau khoảng thời gian này để đồng bộ giữa các worker
+RELOAD_SECONDS = 60
+
+# Liều được coi là đến hạn trong bấy nhiêu giây đầu của phút hẹn giờ
+DUE_WINDOW_SECONDS = 10
+
+
+def schedule_days_mask(schedule):
+    """Bitmask thứ của lịch, tính từ cột days nếu bản ghi chưa được backfill"""
+    return schedule.days_mask or days_to_mask(schedule.days)
+
+
+def parse_schedule_minute(time_str):
+    """Chuyển 'HH:MM' thành số phút trong ngày, trả về None nếu sai định dạng"""
+    try:
+        parsed = datetime.strptime(time_str, '%H:%M')
+    except (ValueError, TypeError):
+        return None
+    return parsed.hour * 60 + parsed.minute
+
+
+class ScheduleIndex:
+    """
+    Chỉ mục lịch uống thuốc trong bộ nhớ, khóa theo (thứ, phút trong ngày).
+
+    Lịch của mỗi user được nạp một lần khi cần rồi cập nhật tăng dần qua
+    add()/remove() khi lịch được thêm, sửa hoặc xóa. Việc kiểm tra liều đến
+    hạn chỉ còn là một lần tra dict thay vì quét bảng và parse JSON.
+    """
+
+    def __init__(self, reload_seconds=RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._slots = {}        # (weekday, minute) -> {user_id: set(schedule_id)}
+        self._entries = {}      # schedule_id -> {'user_id', 'medicine_id', 'time', 'keys'}
+        self._by_user = {}      # user_id -> set(schedule_id)
+        self._loaded_at = {}    # user_id -> thời điểm nạp gần nhất
+
+    def _insert(self, schedule):
+        minute = parse_schedule_minute(schedule.time)
+        if not schedule.active or minute is None:
+            return
+        mask = schedule_days_mask(schedule)
+        keys = [(weekday, minute) for weekday in range(7) if mask & (1 << weekday)]
+        for key in keys:
+            self._slots.setdefault(key, {}).setdefault(schedule.user_id, set()).add(schedule.id)
+        self._entries[schedule.id] = {
+            'user_id': schedule.user_id,
+            'medicine_id': schedule.medicine_id,
+            'time': schedule.time,
+            'keys': keys
+        }
+        self._by_user.setdefault(schedule.user_id, set()).add(schedule.id)
+
+    def _discard(self, schedule_id):
+        entry = self._entries.pop(schedule_id, None)
+        if not entry:
+            return
+        user_ids = self._by_user.get(entry['user_id'])
+        if user_ids:
+            user_ids.discard(schedule_id)
+        for key in entry['keys']:
+            users = self._slots.get(key)
+            if not users:
+                continue
+            ids = users.get(entry['user_id'])
+            if ids:
+                ids.discard(schedule_id)
+                if not ids:
+                    del users[entry['user_id']]
+            if not users:
+                del self._slots[key]
+
+    def add(self, schedule):
+        """Thêm hoặc cập nhật một lịch (gọi sau khi commit)"""
+        with self._lock:
+            self._discard(schedule.id)
+            if schedule.user_id in self._loaded_at:
+                self._insert(schedule)
+
+    def remove(self, schedule_id):
+        """Xóa một lịch khỏi chỉ mục"""
+        with self._lock:
+            self._discard(schedule_id)
+
+    def invalidate_user(self, user_id):
+        """Bỏ toàn bộ lịch của user, lần tra cứu sau sẽ nạp lại từ database"""
+        with self._lock:
+            self._drop_user(user_id)
+
+    def _drop_user(self, user_id):
+        self._loaded_at.pop(user_id, None)
+        for schedule_id in list(self._by_user.pop(user_id, ())):
+            self._discard(schedule_id)
+
+    def _ensure_users(self, user_ids):
+        now = time.monotonic()
+        stale = [
+            user_id for user_id in user_ids
+            if user_id not in self._loaded_at or now - self._loaded_at[user_id] >= self.reload_seconds
+        ]
+        if not stale:
+            return
+        schedules = Schedule.query.filter(
+            Schedule.user_id.in_(stale),
+            Schedule.active == True
+        ).all()
+        with self._lock:
+            for user_id in stale:
+                self._drop_user(user_id)
+            for schedule in schedules:
+                self._insert(schedule)
+            for user_id in stale:
+                self._loaded_at[user_id] = now
+
+    def due_entries(self, user_id, when):
+        """Trả về list (schedule_id, entry) của user có giờ hẹn đúng phút `when`"""
+        return self.due_entries_many([user_id], when).get(user_id, [])
+
+    def due_entries_many(self, user_ids, when):
+        """Như due_entries nhưng cho nhiều user, nạp lịch còn thiếu bằng một truy vấn"""
+        self._ensure_users(user_ids)
+        key = (when.weekday(), when.hour * 60 + when.minute)
+        with self._lock:
+            users = self._slots.get(key, {})
+            return {
+                user_id: [(sid, dict(self._entries[sid])) for sid in sorted(users[user_id])]
+                for user_id in user_ids if users.get(user_id)
+            }
+
+    def next_due(self, user_id, when):
+        """
+        Tìm liều tiếp theo của user tính từ `when`.
+
+        Returns:
+            tuple: (datetime đến hạn, list schedule_id) hoặc (None, []) nếu user không có lịch
+        """
+        self._ensure_users([user_id])
+        minute_now = when.hour * 60 + when.minute
+        in_window = when.second + when.microsecond / 1e6 <= DUE_WINDOW_SECONDS
+        midnight = datetime.combine(when.date(), datetime.min.time())
+
+        best_due, best_ids = None, []
+        with self._lock:
+            for schedule_id in self._by_user.get(user_id, ()):
+                for weekday, minute in self._entries[schedule_id]['keys']:
+                    days_ahead = (weekday - when.weekday()) % 7
+                    if days_ahead == 0 and (minute < minute_now or (minute == minute_now and not in_window)):
+                        days_ahead = 7
+                    due = midnight + timedelta(days=days_ahead, minutes=minute)
+                    if best_due is None or due < best_due:
+                        best_due, best_ids = due, [schedule_id]
+                    elif due == best_due and schedule_id not in best_ids:
+                        best_ids.append(schedule_id)
+        return best_due, sorted(best_ids)
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            self._entries.clear()
+            self._by_user.clear()
+            self._loaded_at.clear()
+
+
+# Singleton dùng chung cho toàn bộ app
+schedule_index = ScheduleIndex()
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class SQLMetrics:
+    """
+    Đếm số câu lệnh SQL và thời gian DB cho mỗi request và gộp theo endpoint.
+
+    Dùng sự kiện before_cursor_execute/after_cursor_execute của SQLAlchemy.
+    Ở chế độ debug, mỗi response có thêm header X-SQL-Count và X-SQL-Time-Ms.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}  # endpoint -> {'requests', 'statements', 'db_ms', 'max_statements'}
+
+    def init_app(self, app):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('sql_metrics_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('sql_metrics_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if has_app_context() and 'sql_count' in g:
+            g.sql_count += 1
+            g.sql_time += elapsed
+
+    def _start_request(self):
+        g.sql_count = 0
+        g.sql_time = 0.0
+
+    def _finish_request(self, response):
+        count = g.get('sql_count', 0)
+        db_ms = g.get('sql_time', 0.0) * 1000
+        endpoint = request.endpoint or 'unknown'
+
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'requests': 0, 'statements': 0, 'db_ms': 0.0, 'max_statements': 0
+            })
+            stats['requests'] += 1
+            stats['statements'] += count
+            stats['db_ms'] += db_ms
+            stats['max_statements'] = max(stats['max_statements'], count)
+
+        if current_app.debug:
+            response.headers['X-SQL-Count'] = str(count)
+            response.headers['X-SQL-Time-Ms'] = f'{db_ms:.2f}'
+        return response
+
+    def snapshot(self):
+        """Thống kê gộp theo endpoint, sắp xếp theo tổng thời gian DB giảm dần"""
+        with self._lock:
+            items = [(endpoint, dict(stats)) for endpoint, stats in self._endpoints.items()]
+
+        result = []
+        for endpoint, stats in items:
+            requests_count = stats['requests'] or 1
+            result.append({
+                'endpoint': endpoint,
+                'requests': stats['requests'],
+                'statements': stats['statements'],
+                'avg_statements': round(stats['statements'] / requests_count, 2),
+                'max_statements': stats['max_statements'],
+                'db_ms': round(stats['db_ms'], 2),
+                'avg_db_ms': round(stats['db_ms'] / requests_count, 3)
+            })
+        return sorted(result, key=lambda r: r['db_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+# Singleton dùng chung cho toàn bộ app
+sql_metrics = SQLMetrics()
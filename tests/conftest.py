@@ -0,0 +1,122 @@
+"""
+Fixture dùng chung cho bộ test: app Flask trên SQLite tạm, schema tạo mới cho mỗi test.
+
+Chạy từ thư mục gốc của project:
+    python -m pytest -q tests
+Không có config.py thì dùng config.example.py (cấu hình qua biến môi trường).
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+API_KEY = 'test-api-key'
+_db_fd, DB_PATH = tempfile.mkstemp(suffix='.db', prefix='elder_test_')
+os.close(_db_fd)
+
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ['API_KEY'] = API_KEY
+
+if not os.path.exists(os.path.join(ROOT, 'config.py')):
+    _spec = importlib.util.spec_from_file_location('config', os.path.join(ROOT, 'config.example.py'))
+    sys.modules['config'] = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules['config'])
+
+from flask import Flask
+from sqlalchemy import event, text
+
+from config import Config
+from models import db, User
+from auth import init_login_manager
+from routes.auth import auth
+from routes.main import main
+from schedule_index import schedule_index
+from power_state import power_state
+
+# system_control không có model - tạo theo database/system_control_schema.sql (cú pháp SQLite)
+SYSTEM_CONTROL_DDL = """
+    CREATE TABLE IF NOT EXISTS system_control (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        system_enabled BOOLEAN DEFAULT 1,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_by VARCHAR(50) DEFAULT 'system',
+        notes TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER UNIQUE REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+
+def create_app():
+    app = Flask(__name__, root_path=ROOT)
+    app.config.from_object(Config)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{DB_PATH}',
+        SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}},
+        API_KEY_REQUIRED=True,
+        API_KEY=API_KEY,
+        TESTING=True
+    )
+    db.init_app(app)
+    init_login_manager(app)
+    app.register_blueprint(auth, url_prefix='/auth')
+    app.register_blueprint(main)
+    return app
+
+
+def use_immediate_transactions(engine):
+    """
+    Transaction SQLite lấy khóa ghi ngay từ BEGIN, để các request đồng thời xếp hàng
+    chờ khóa (busy timeout) thay vì lỗi 'database is locked' khi nâng cấp khóa đọc.
+    """
+    @event.listens_for(engine, 'connect')
+    def _disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _begin_immediate(connection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    with app.app_context():
+        use_immediate_transactions(db.engine)
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+    os.remove(DB_PATH)
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        with db.engine.begin() as connection:
+            connection.execute(text('DROP TABLE IF EXISTS system_control'))
+            connection.execute(text(SYSTEM_CONTROL_DDL))
+        schedule_index.clear()
+        power_state.clear()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def user(database):
+    user = User(username='test_user', email='test_user@example.com', password_hash='x',
+                role='user', status='active')
+    database.session.add(user)
+    database.session.commit()
+    return user
+
+
+@pytest.fixture
+def api_headers():
+    return {'X-API-Key': API_KEY}
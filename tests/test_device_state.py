@@ -0,0 +1,58 @@
+import json
+from datetime import datetime
+
+from models import db, Medicine, Schedule, WEEKDAY_NAMES, days_to_mask
+from content_version import bump_content_version
+import routes.main as main_routes
+
+# Thứ Hai 08:00 - các giây 0..10 nằm trong cửa sổ đến hạn
+DUE_MINUTE = datetime(2026, 10, 19, 8, 0, 0)
+
+
+class FrozenDateTime(datetime):
+    frozen_at = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.frozen_at
+
+
+def add_schedule(user_id):
+    medicine = Medicine(name='Medicine 1', user_id=user_id, compartment_number=1, quantity=30, min_quantity=5)
+    db.session.add(medicine)
+    db.session.flush()
+    schedule = Schedule(medicine_id=medicine.id, user_id=user_id, time='08:00',
+                        days=json.dumps(WEEKDAY_NAMES), days_mask=days_to_mask(WEEKDAY_NAMES),
+                        period='daily', active=True)
+    db.session.add(schedule)
+    db.session.commit()
+    return schedule.id
+
+
+def state_at(user_id, second, since=None):
+    FrozenDateTime.frozen_at = DUE_MINUTE.replace(second=second)
+    return main_routes.collect_device_state(user_id, since, ('schedule',))
+
+
+def test_schedule_cursor_is_stable_within_the_due_minute(user, monkeypatch):
+    monkeypatch.setattr(main_routes, 'datetime', FrozenDateTime)
+    schedule_id = add_schedule(user.id)
+
+    first = state_at(user.id, 1)
+    assert [dose['schedule_id'] for dose in first['schedule']] == [schedule_id]
+
+    # time_diff đổi mỗi giây nhưng cursor thì không - lịch không bị gửi lại
+    for second in range(2, 10):
+        state = state_at(user.id, second, first['cursor'])
+        assert 'schedule' not in state
+        assert state['cursor'] == first['cursor']
+
+    # Xác nhận/sửa lịch tăng phiên bản nội dung - lịch được gửi lại
+    bump_content_version(user.id)
+    db.session.commit()
+    assert 'schedule' in state_at(user.id, 9, first['cursor'])
+
+    # Hết cửa sổ đến hạn - danh sách rỗng được gửi một lần
+    after = state_at(user.id, 30, first['cursor'])
+    assert after['schedule'] == []
+    assert 'schedule' not in state_at(user.id, 45, after['cursor'])
@@ -0,0 +1,39 @@
+import json
+from datetime import datetime, timedelta
+
+from models import db, Medicine, Schedule, DailyCompliance, WEEKDAY_NAMES, days_to_mask
+from dose_instances import generate_dose_instances, mark_missed_doses, mark_dose_taken, delete_dose_instances
+
+
+def rollup(user_id, day):
+    row = db.session.get(DailyCompliance, (user_id, day))
+    return (row.taken, row.missed) if row else (0, 0)
+
+
+def test_deleting_a_schedule_keeps_past_compliance(user):
+    today = datetime.now().date()
+    yesterday = today - timedelta(days=1)
+    medicine = Medicine(name='Medicine 1', user_id=user.id, compartment_number=1, quantity=30, min_quantity=5)
+    db.session.add(medicine)
+    db.session.flush()
+    schedule = Schedule(medicine_id=medicine.id, user_id=user.id, time='00:00',
+                        days=json.dumps(WEEKDAY_NAMES), days_mask=days_to_mask(WEEKDAY_NAMES),
+                        period='daily', active=True)
+    db.session.add(schedule)
+    db.session.commit()
+
+    # Hôm qua bỏ lỡ, hôm nay đã uống
+    generate_dose_instances(yesterday)
+    mark_missed_doses(yesterday)
+    generate_dose_instances(today)
+    mark_dose_taken(schedule, datetime.combine(today, datetime.min.time()) + timedelta(minutes=5))
+    db.session.commit()
+    assert rollup(user.id, yesterday) == (0, 1)
+    assert rollup(user.id, today) == (1, 0)
+
+    delete_dose_instances(schedule.id)
+    db.session.delete(schedule)
+    db.session.commit()
+
+    assert rollup(user.id, yesterday) == (0, 1)
+    assert rollup(user.id, today) == (0, 0)
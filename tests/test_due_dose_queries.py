@@ -0,0 +1,84 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from models import db, Medicine, Schedule, MedicineHistory, WEEKDAY_NAMES, days_to_mask
+from routes.main import get_current_schedules, query_due_doses
+
+# Thứ Hai, 3 giây sau phút hẹn - nằm trong cửa sổ đến hạn 10 giây
+DUE_AT = datetime(2026, 10, 19, 8, 0, 3)
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def add_due_schedules(user_id, count):
+    """`count` lịch 08:00 mọi ngày, chia cho 4 ngăn thuốc"""
+    medicines = [
+        Medicine(name=f'Medicine {n}', user_id=user_id, compartment_number=n, quantity=30, min_quantity=5)
+        for n in range(1, 5)
+    ]
+    db.session.add_all(medicines)
+    db.session.flush()
+    schedules = [
+        Schedule(medicine_id=medicines[i % 4].id, user_id=user_id, time='08:00',
+                 days=json.dumps(WEEKDAY_NAMES), days_mask=days_to_mask(WEEKDAY_NAMES),
+                 period='daily', active=True)
+        for i in range(count)
+    ]
+    db.session.add_all(schedules)
+    db.session.commit()
+    return [schedule.id for schedule in schedules]
+
+
+@pytest.mark.parametrize('due_count', [1, 10, 50])
+def test_query_due_doses_is_one_statement(user, due_count):
+    schedule_ids = add_due_schedules(user.id, due_count)
+
+    with count_statements() as statements:
+        doses = query_due_doses(schedule_ids, DUE_AT)
+
+    assert len(statements) == 1
+    assert len(doses) == due_count
+
+
+@pytest.mark.parametrize('due_count', [1, 10, 50])
+def test_get_current_schedules_is_one_statement(user, due_count):
+    schedule_ids = add_due_schedules(user.id, due_count)
+    # Liều đã uống trong ngày bị loại ngay trong câu truy vấn (anti-join)
+    db.session.add(MedicineHistory(schedule_id=schedule_ids[0],
+                                   timestamp=DUE_AT, status='taken'))
+    db.session.commit()
+    # Nạp chỉ mục lịch của user trước, chỉ đếm phần truy vấn liều đến hạn
+    get_current_schedules(user.id, DUE_AT)
+
+    with count_statements() as statements:
+        doses = get_current_schedules(user.id, DUE_AT)
+
+    assert len(statements) == 1
+    assert sorted(dose['schedule_id'] for dose in doses) == schedule_ids[1:]
+
+
+def test_get_current_schedules_outside_due_window_skips_database(user):
+    add_due_schedules(user.id, 10)
+    get_current_schedules(user.id, DUE_AT)
+
+    with count_statements() as statements:
+        doses = get_current_schedules(user.id, DUE_AT.replace(second=30))
+
+    assert statements == []
+    assert doses == []
@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+
+from models import db, AdminLog
+from power_state import load_system_status
+
+
+def press_concurrently(app, headers, user_id, presses):
+    """Bấm POWER `presses` lần từ các thread cùng xuất phát, trả về các response"""
+    barrier = threading.Barrier(presses)
+    responses = [None] * presses
+
+    def press(index):
+        client = app.test_client()
+        barrier.wait()
+        response = client.post('/api/power_button_press', json={'user_id': user_id, 'duration': 1},
+                               headers=headers)
+        responses[index] = (response.status_code, response.get_json())
+
+    threads = [threading.Thread(target=press, args=(i,)) for i in range(presses)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+@pytest.mark.parametrize('presses', [16, 17])
+def test_concurrent_power_presses_toggle_once_each(app, user, api_headers, presses):
+    user_id = user.id
+    initial = load_system_status(user_id)[0]['system_enabled']
+    db.session.commit()
+
+    responses = press_concurrently(app, api_headers, user_id, presses)
+
+    assert [status for status, _ in responses] == [200] * presses
+    # Mỗi lần bấm đảo đúng một lần: kết quả xen kẽ bật/tắt, lệch nhau tối đa 1
+    enabled = sum(1 for _, body in responses if body['new_status'])
+    assert abs(enabled - (presses - enabled)) <= 1
+
+    final = db.session.execute(
+        text('SELECT system_enabled FROM system_control WHERE user_id = :user_id'), {'user_id': user_id}
+    ).scalar()
+    assert bool(final) == (bool(initial) != (presses % 2 == 1))
+    assert AdminLog.query.filter(
+        AdminLog.target_type == 'system_control',
+        AdminLog.target_id == user_id,
+        AdminLog.action.like('power_button_%')
+    ).count() == presses
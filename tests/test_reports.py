@@ -0,0 +1,33 @@
+import json
+from datetime import datetime, timedelta
+
+from models import db, Medicine, Schedule, MedicineHistory, WEEKDAY_NAMES, days_to_mask
+from dose_instances import generate_dose_instances, mark_dose_taken
+from reports import build_report
+
+
+def test_breakdowns_count_taken_like_the_daily_rollup(user):
+    today = datetime.now().date()
+    medicine = Medicine(name='Medicine 1', user_id=user.id, compartment_number=1, quantity=30, min_quantity=5)
+    db.session.add(medicine)
+    db.session.flush()
+    schedule = Schedule(medicine_id=medicine.id, user_id=user.id, time='08:00',
+                        days=json.dumps(WEEKDAY_NAMES), days_mask=days_to_mask(WEEKDAY_NAMES),
+                        period='daily', active=True)
+    db.session.add(schedule)
+    db.session.commit()
+    generate_dose_instances(today)
+
+    # Xác nhận lặp (khóa UUID khác) ghi thêm history nhưng liều chỉ được tính một lần
+    taken_at = datetime.combine(today, datetime.min.time()) + timedelta(hours=8, minutes=5)
+    for _ in range(2):
+        db.session.add(MedicineHistory(schedule_id=schedule.id, timestamp=taken_at, status='taken'))
+        mark_dose_taken(schedule, taken_at)
+    db.session.commit()
+
+    report = build_report(user.id, today, today)
+
+    assert report['summary']['taken'] == 1
+    assert sum(day['taken'] for day in report['by_day']) == 1
+    assert [item['taken'] for item in report['by_medicine']] == [1]
+    assert sum(slot['taken'] for slot in report['by_slot']) == 1
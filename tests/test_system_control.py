@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import text
+
+from models import db, AdminLog
+import routes.main as main_routes
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/api/system_control', {'action': 'disable'}),
+    ('/api/power_button_press', {}),
+])
+def test_string_user_id_is_coerced(app, user, api_headers, path, body):
+    response = app.test_client().post(path, json=dict(body, user_id=str(user.id)), headers=api_headers)
+
+    assert response.status_code == 200
+    assert response.get_json()['user_id'] == user.id
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/api/system_control', {'action': 'disable'}),
+    ('/api/power_button_press', {}),
+])
+@pytest.mark.parametrize('user_id', ['abc', [1], True])
+def test_invalid_user_id_is_rejected(app, api_headers, path, body, user_id):
+    response = app.test_client().post(path, json=dict(body, user_id=user_id), headers=api_headers)
+
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'user_id must be an integer'
+
+
+def system_status(client, headers, user_id=None):
+    query = {'user_id': user_id} if user_id else {}
+    return client.get('/api/system_status', query_string=query, headers=headers).get_json()
+
+
+def set_global(client, headers, action):
+    response = client.post('/api/system_control', json={'action': action, 'source': 'admin_panel'},
+                           headers=headers)
+    assert response.status_code == 200
+
+
+def test_global_disable_overrides_household_rows(app, user, api_headers):
+    client = app.test_client()
+    # Hộ bấm POWER hai lần: có bản ghi riêng, đang bật
+    for _ in range(2):
+        assert client.post('/api/power_button_press', json={'user_id': user.id},
+                           headers=api_headers).status_code == 200
+    assert system_status(client, api_headers, user.id)['scope'] == 'household'
+    assert system_status(client, api_headers, user.id)['system_enabled'] is True
+
+    set_global(client, api_headers, 'disable')
+    status = system_status(client, api_headers, user.id)
+    assert status['system_enabled'] is False
+    assert status['scope'] == 'global'
+
+    # Bấm POWER khi đang tắt chung chỉ đổi bản ghi của hộ - hộ vẫn tắt
+    client.post('/api/power_button_press', json={'user_id': user.id}, headers=api_headers)
+    assert system_status(client, api_headers, user.id)['system_enabled'] is False
+
+    set_global(client, api_headers, 'enable')
+    status = system_status(client, api_headers, user.id)
+    assert status['scope'] == 'household'
+    assert status['system_enabled'] is False
+
+
+def test_first_press_is_one_transaction(app, user, api_headers, monkeypatch):
+    def failing_audit(**kwargs):
+        raise RuntimeError('audit log unavailable')
+
+    # Lần bấm đầu tiên trên DB trống: bản ghi chung, bản ghi phiên bản và trạng thái của hộ
+    # chỉ được lưu cùng log audit - log lỗi thì không còn gì
+    monkeypatch.setattr(main_routes, 'AdminLog', failing_audit)
+    response = app.test_client().post('/api/power_button_press', json={'user_id': user.id}, headers=api_headers)
+
+    assert response.status_code == 500
+    assert db.session.execute(text('SELECT COUNT(*) FROM system_control')).scalar() == 0
+    assert db.session.execute(text('SELECT COUNT(*) FROM content_versions')).scalar() == 0
+    assert AdminLog.query.count() == 0
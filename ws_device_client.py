@@ -0,0 +1,75 @@
+"""
+Client tham khảo cho WebSocket /ws/device/<user_id> - làm giống màn hình ESP32.
+
+In ra mỗi lần server đẩy trạng thái, tự xác nhận INFO flag và confirmation
+sau khi "hiển thị", và kết nối lại (kèm cursor) khi mất kết nối.
+
+    python ws_device_client.py --server ws://192.168.1.159:5001 --user-id 13 --api-key my-secret-key-2025
+"""
+import argparse
+import json
+import time
+
+import simple_websocket
+
+RECONNECT_SECONDS = 5
+
+
+class DeviceSocketClient:
+    def __init__(self, server, user_id, api_key):
+        self.server = server.rstrip('/')
+        self.user_id = user_id
+        self.api_key = api_key
+        self.cursor = ''
+        self.state = {}
+
+    def url(self):
+        url = f"{self.server}/ws/device/{self.user_id}"
+        return f"{url}?since={self.cursor}" if self.cursor else url
+
+    def connect(self):
+        return simple_websocket.Client.connect(self.url(), headers={'X-API-Key': self.api_key})
+
+    def handle_state(self, socket, message):
+        """Cập nhật trạng thái cục bộ và xác nhận các sự kiện đã hiển thị"""
+        self.cursor = message.get('cursor', self.cursor)
+        for section in ('schedule', 'info_flag', 'confirmation', 'system'):
+            if section in message:
+                self.state[section] = message[section]
+                print(f"[{time.strftime('%H:%M:%S')}] {section}: {json.dumps(message[section], ensure_ascii=False)}")
+
+        info_flag = message.get('info_flag') or {}
+        if info_flag.get('info_flag_detected'):
+            socket.send(json.dumps({'type': 'clear_info_flag', 'flag_id': info_flag['flag_id']}))
+
+        confirmation = message.get('confirmation') or {}
+        if confirmation.get('confirmed'):
+            socket.send(json.dumps({'type': 'clear_confirmation',
+                                    'confirmation_id': confirmation['confirmation_id']}))
+
+    def run(self):
+        while True:
+            try:
+                socket = self.connect()
+                print(f"Connected to {self.url()}")
+                while True:
+                    message = json.loads(socket.receive())
+                    if message.get('type') == 'state':
+                        self.handle_state(socket, message)
+                    else:
+                        print(f"Server message: {message}")
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                print(f"Connection lost ({e}), reconnecting in {RECONNECT_SECONDS}s...")
+                time.sleep(RECONNECT_SECONDS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reference client for the ESP32 display WebSocket')
+    parser.add_argument('--server', default='ws://localhost:5001')
+    parser.add_argument('--user-id', type=int, default=13)
+    parser.add_argument('--api-key', default='my-secret-key-2025')
+    args = parser.parse_args()
+
+    DeviceSocketClient(args.server, args.user_id, args.api_key).run()